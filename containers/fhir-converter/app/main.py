@@ -10,6 +10,10 @@ from app.service import convert_to_fhir, resolve_references
 
 description = (Path(__file__).parent.parent / "README.md").read_text(encoding="utf-8")
 
+# any element with the LOINC code of a reportability response, which is only
+# present once an eICR has been merged with its RR
+rr_section_xpath = etree.XPath('//*[@code="88085-6"]')
+
 app = FastAPI(
     title="PHDI FHIR Converter Service",
     version="0.0.1",
@@ -118,7 +122,7 @@ def add_rr_data_to_eicr(rr, ecr):
     rr = etree.fromstring(rr)
     ecr = etree.fromstring(ecr)
 
-    if ecr.xpath('//*[@code="88085-6"]'):
+    if rr_section_xpath(ecr):
         print("This eCR has already been merged with RR data.")
         return etree.tostring(ecr, encoding="unicode", method="xml")
 
@@ -8,6 +8,11 @@ from pathlib import Path
 import hl7
 from lxml import etree
 
+# every <reference> element, and the text of the elements with a given ID,
+# passed as `$id`, compiled once rather than for every reference resolved
+reference_xpath = etree.XPath("//hl7:reference", namespaces={"hl7": "urn:hl7-org:v3"})
+referenced_text_xpath = etree.XPath("//*[@ID=$id]/text()")
+
 
 def add_data_source_to_bundle(bundle: dict, data_source: str) -> dict:
     """
@@ -54,12 +59,11 @@ def resolve_references(input_data: str) -> str:
     except etree.XMLSyntaxError:
         return input_data
 
-    ns = {"hl7": "urn:hl7-org:v3"}
-    refs = ecr.xpath("//hl7:reference", namespaces=ns)
+    refs = reference_xpath(ecr)
     for ref in refs:
         if "value" in ref.attrib:
             ref_id = ref.attrib["value"][1:]
-            ref.text = " ".join(ecr.xpath("//*[@ID='" + ref_id + "']/text()"))
+            ref.text = " ".join(referenced_text_xpath(ecr, id=ref_id))
 
     return etree.tostring(ecr).decode()
 
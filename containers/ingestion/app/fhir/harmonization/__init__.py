@@ -1,6 +1,7 @@
 from app.fhir.harmonization.standardization import (
     double_metaphone_bundle,
     double_metaphone_patient,
+    standardize_bundle,
     standardize_dob,
     standardize_names,
     standardize_phones,
@@ -12,4 +13,5 @@ __all__ = (
     "standardize_names",
     "standardize_phones",
     "standardize_dob",
+    "standardize_bundle",
 )
@@ -302,3 +302,50 @@ def standardize_dob(data: dict, format: str = "%Y-%m-%d", overwrite=True) -> dic
     if "entry" not in data:
         return bundle.get("entry", [{}])[0].get("resource", {})
     return bundle
+
+
+def standardize_bundle(
+    data: dict,
+    names: dict | None = None,
+    dob: dict | None = None,
+    phones: dict | None = None,
+    overwrite: bool = True,
+) -> dict:
+    """
+    Applies any combination of name, birth date and phone number
+    standardization to a given FHIR bundle or FHIR resource in a single pass
+    over its resources. Each standardization is applied only if its options
+    are supplied (an empty dictionary applies it with default settings).
+
+    :param data: A FHIR bundle or FHIR-formatted JSON dict.
+    :param names: Optionally, the keyword arguments for name standardization
+      (`trim`, `case` and `remove_numbers`), as accepted by `standardize_names`.
+    :param dob: Optionally, the keyword arguments for birth date
+      standardization (`format`), as accepted by `standardize_dob`.
+    :param phones: Optionally, an empty dictionary to apply phone number
+      standardization, as performed by `standardize_phones`.
+    :param overwrite: If true, `data` is modified in-place;
+      if false, a copy of `data` modified and returned.  Default: `True`
+    :return: The bundle or resource with the requested standardizations
+      applied.
+    """
+    if not overwrite:
+        data = copy.deepcopy(data)
+
+    # Allow users to pass in either a resource or a bundle
+    bundle = data
+    if "entry" not in data:
+        bundle = {"entry": [{"resource": data}]}
+
+    for entry in bundle.get("entry"):
+        resource = entry.get("resource", {})
+        if names is not None:
+            _standardize_names_in_resource(resource, **names, overwrite=True)
+        if dob is not None:
+            _standardize_dob_in_resource(resource, **dob, overwrite=True)
+        if phones is not None:
+            _standardize_phones_in_resource(resource, overwrite=True)
+
+    if "entry" not in data:
+        return bundle.get("entry", [{}])[0].get("resource", {})
+    return bundle
@@ -4,6 +4,7 @@ from fastapi import APIRouter
 from pydantic import BaseModel, Field, field_validator
 
 from app.fhir.harmonization.standardization import (
+    standardize_bundle,
     standardize_dob,
     standardize_names,
     standardize_phones,
@@ -173,3 +174,100 @@ async def standardize_dob_endpoint(
         result["bundle"] = input["data"]
         result["message"] = error.__str__()
     return result
+
+
+class StandardizeNamesOptions(BaseModel):
+    trim: Optional[bool] = Field(
+        description="When true, leading and trailing spaces are removed.", default=True
+    )
+    case: Optional[Literal["upper", "lower", "title"]] = Field(
+        description="The type of casing that should be used.",
+        default="upper",
+    )
+    remove_numbers: Optional[bool] = Field(
+        description="If true, delete numeric characters; if false leave numbers in "
+        "place.",
+        default=True,
+    )
+
+
+class StandardizeBirthDateOptions(BaseModel):
+    format: Optional[str] = Field(
+        default="%Y-%m-%d",
+        description="The date format that the input DOB is supplied in.",
+        json_schema_extra={
+            "example": "%m/%d/%Y",
+        },
+    )
+
+
+class StandardizePhonesOptions(BaseModel):
+    pass
+
+
+class StandardizeBundleInput(BaseModel):
+    data: dict = Field(
+        description="A FHIR resource or bundle in JSON format.",
+        json_schema_extra={"example": sample_name_request_data},
+    )
+    overwrite: Optional[bool] = Field(
+        description="If true, `data` is modified in-place; if false, a copy of `data` "
+        "is modified and returned.",
+        default=True,
+    )
+    standardize_names: Optional[StandardizeNamesOptions] = Field(
+        description="If supplied, names are standardized with these options.",
+        default=None,
+    )
+    standardize_dob: Optional[StandardizeBirthDateOptions] = Field(
+        description="If supplied, patient dates of birth are standardized with these "
+        "options.",
+        default=None,
+    )
+    standardize_phones: Optional[StandardizePhonesOptions] = Field(
+        description="If supplied, phone numbers are standardized.",
+        default=None,
+    )
+
+    _check_for_fhir = field_validator(
+        "data",
+    )(check_for_fhir)
+
+
+@router.post("/standardize_bundle")
+async def standardize_bundle_endpoint(
+    input: StandardizeBundleInput,
+) -> StandardResponse:
+    """
+    This endpoint applies any combination of name, date of birth and phone
+    number standardization to the provided FHIR bundle or resource in a
+    single pass. Each standardization is applied only if its options are
+    included in the request; an empty object applies it with its defaults.
+
+    ### Inputs and Outputs
+
+    - :param input: A dictionary with the schema specified by the
+        StandardizeBundleInput model.
+    - :return: A FHIR bundle or resource with the requested standardizations
+        applied.
+    """
+    options = {
+        key: getattr(input, field).model_dump()
+        for key, field in [
+            ("names", "standardize_names"),
+            ("dob", "standardize_dob"),
+            ("phones", "standardize_phones"),
+        ]
+        if getattr(input, field) is not None
+    }
+    result = {}
+    try:
+        result["bundle"] = standardize_bundle(
+            input.data, overwrite=input.overwrite, **options
+        )
+        result["status_code"] = "200"
+    except Exception as error:
+        result["status_code"] = "400"
+        result["bundle"] = input.data
+        result["message"] = error.__str__()
+    return result
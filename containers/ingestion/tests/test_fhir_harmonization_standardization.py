@@ -271,3 +271,66 @@ def test_standardize_dob_failures():
     )
 
     assert actual_response.json() == expected_response
+
+
+def test_standardize_bundle_success():
+    expected_response = {
+        "status_code": 200,
+        "message": None,
+        "bundle": copy.deepcopy(test_bundle),
+    }
+    patient = expected_response["bundle"]["entry"][0]["resource"]
+    patient["name"][0]["family"] = "SMITH"
+    patient["name"][0]["given"][0] = "DEEDEE"
+    patient["birthDate"] = "1955-11-05"
+    patient["telecom"][0]["value"] = "+18015557777"
+
+    actual_response = client.post(
+        "/fhir/harmonization/standardization/standardize_bundle",
+        json={
+            "data": test_bundle,
+            "standardize_names": {},
+            "standardize_dob": {},
+            "standardize_phones": {},
+        },
+    )
+    assert actual_response.json() == expected_response
+
+
+def test_standardize_bundle_subset_with_params():
+    updated_bundle = copy.deepcopy(test_bundle)
+    updated_bundle["entry"][0]["resource"]["birthDate"] = "11/05/1955"
+    expected_response = {
+        "status_code": 200,
+        "message": None,
+        "bundle": copy.deepcopy(updated_bundle),
+    }
+    patient = expected_response["bundle"]["entry"][0]["resource"]
+    patient["name"][0]["family"] = "smith"
+    patient["name"][0]["given"][0] = "deedee"
+    patient["birthDate"] = "1955-11-05"
+
+    actual_response = client.post(
+        "/fhir/harmonization/standardization/standardize_bundle",
+        json={
+            "data": updated_bundle,
+            "standardize_names": {"case": "lower"},
+            "standardize_dob": {"format": "%m/%d/%Y"},
+        },
+    )
+    assert actual_response.json() == expected_response
+
+
+def test_standardize_bundle_dob_failure():
+    updated_bundle = copy.deepcopy(test_bundle)
+    updated_bundle["entry"][0]["resource"]["birthDate"] = ""
+
+    actual_response = client.post(
+        "/fhir/harmonization/standardization/standardize_bundle",
+        json={"data": updated_bundle, "standardize_dob": {}},
+    )
+    assert actual_response.json() == {
+        "status_code": 400,
+        "message": "Date of Birth must be supplied!",
+        "bundle": updated_bundle,
+    }
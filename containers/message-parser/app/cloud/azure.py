@@ -1,4 +1,5 @@
 import json
+import threading
 from datetime import datetime, timezone
 from typing import Literal, Union
 
@@ -42,56 +43,105 @@ class AzureCredentialManager(BaseCredentialManager):
         """
         return self.__access_token
 
-    def __init__(self, resource_location: str = None, scope: str = None):
+    def __init__(
+        self,
+        resource_location: str = None,
+        scope: str = None,
+        refresh_ahead_seconds: float = 300,
+    ):
         """
         Creates a new AzureCredentialManager object.
 
         :param resource_location: The URL or other location of the requested resource.
         :param scope: A space-delimited list of scopes to limit access to resource.
           Default: `None`
+        :param refresh_ahead_seconds: How long before the access token expires to
+          start requesting a new one in the background. Default: `300`
         """
         self.__resource_location = resource_location
         self.__scope = scope
         self.__access_token = None
+        self.__refresh_ahead_seconds = refresh_ahead_seconds
+        self.__credential_object = None
+        self.__refresh_lock = threading.Lock()
 
         if self.scope is None:
             self.__scope = f"{self.resource_location}/.default"
 
     def get_credential_object(self) -> object:
         """
-        Gets an Azure-specific credential object.
+        Gets an Azure-specific credential object. The object is made once and
+        reused, since finding the credentials to use is slow.
 
         :return: An instance of one of the \\*Credential objects from the
           `azure.identity` package.
         """
-        return DefaultAzureCredential()
+        if self.__credential_object is None:
+            self.__credential_object = DefaultAzureCredential()
+        return self.__credential_object
 
     def get_access_token(self, force_refresh: bool = False) -> str:
         """
         Obtains an access token from the Azure identity provider. Returns the
         access token string, refreshed if expired or force_refresh is specified.
+        Once the token is within `refresh_ahead_seconds` of expiring, a new one is
+        requested in the background while the current one is still returned, so
+        that callers sharing this object do not wait on the identity provider.
 
         :param force_refresh: `True` if a new token should be requested, regardless
           of expiration timestamp. `False` otherwise. Default: `False`
         :return: An Azure access token.
         """
         if force_refresh or (self.access_token is None) or self._need_new_token():
-            creds = self.get_credential_object()
-            self.__access_token = creds.get_token(self.scope)
+            with self.__refresh_lock:
+                # Another caller may have refreshed the token while this one waited
+                if force_refresh or self._need_new_token():
+                    self._refresh_token()
+        elif self._need_new_token(self.__refresh_ahead_seconds):
+            self._refresh_token_in_background()
 
         return self.access_token.token
 
-    def _need_new_token(self) -> bool:
+    def _refresh_token(self) -> None:
+        """
+        Requests a new access token from the Azure identity provider.
+        """
+        creds = self.get_credential_object()
+        self.__access_token = creds.get_token(self.scope)
+
+    def _refresh_token_in_background(self) -> None:
+        """
+        Requests a new access token from the Azure identity provider in a separate
+        thread, unless a new token is already being requested.
+        """
+        if not self.__refresh_lock.acquire(blocking=False):
+            return
+
+        def refresh_token():
+            try:
+                self._refresh_token()
+            except Exception:
+                # The current token is still valid, and a new one will be
+                # requested again on a later call
+                pass
+            finally:
+                self.__refresh_lock.release()
+
+        threading.Thread(target=refresh_token, daemon=True).start()
+
+    def _need_new_token(self, margin_seconds: float = 0) -> bool:
         """
         Determines whether the token already stored for this object can be reused,
         or if it needs to be re-requested. A new token is needed if a token has not
         yet been created, or if the current token has expired.
 
+        :param margin_seconds: How long before the token expires to consider it
+          in need of replacing. Default: `0`
         :return: True if a new Azure access token is needed; false otherwise.
         """
         try:
             current_time_utc = datetime.now(timezone.utc).timestamp()
-            return self.access_token.expires_on < current_time_utc
+            return self.access_token.expires_on < current_time_utc + margin_seconds
         except AttributeError:
             # access_token not set
             return True
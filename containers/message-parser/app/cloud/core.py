@@ -17,10 +17,12 @@ class BaseCredentialManager(ABC):
         pass  # pragma: no cover
 
     @abstractmethod
-    def get_access_token(self) -> str:
+    def get_access_token(self, force_refresh: bool = False) -> str:
         """
         Gets an access token using the managed credentials.
 
+        :param force_refresh: `True` if a new token should be requested, even if
+          the current one has not expired. Default: `False`
         :return: An access token.
         """
         pass  # pragma: no cover
@@ -85,15 +85,19 @@ class GcpCredentialManager(BaseCredentialManager):
             )
         return self.__project_id
 
-    def get_access_token(self) -> str:
+    def get_access_token(self, force_refresh: bool = False) -> str:
         """
-        Obtains an access token from GCP.
+        Obtains an access token from GCP. The `google-auth` credentials stop
+        being valid a few minutes before their token expires, so the token is
+        refreshed ahead of its expiration.
 
+        :param force_refresh: `True` if a new token should be requested, regardless
+          of expiration timestamp. `False` otherwise. Default: `False`
         :return: The access token, refreshed if necessary.
         """
 
         creds = self.get_credential_object()
-        if not creds.valid:
+        if force_refresh or not creds.valid:
             request = google.auth.transport.requests.Request()
             creds.refresh(request=request)
 
@@ -7,6 +7,18 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     fhir_converter_url: Optional[str] = None
 
+    # The number of connections to the FHIR converter that are kept open and
+    # shared by every request.
+    fhir_converter_pool_size: int = 10
+
+    # The number of parsing schemas whose compiled parsers are kept, from the
+    # most recently used. Schemas sent inline with each request count too.
+    parser_cache_max_size: int = 64
+
+    # The number of messages from a single `/parse_messages` request that are
+    # parsed at the same time.
+    batch_max_concurrency: int = 4
+
 
 @lru_cache
 def get_settings() -> dict:
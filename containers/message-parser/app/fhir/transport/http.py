@@ -14,6 +14,7 @@ def http_request_with_reauth(
     allowed_methods: list[str],
     headers: dict,
     data: dict = None,
+    session: requests.Session = None,
 ) -> requests.Response:
     """
     First, calls :func:`phdi.transport.http.http_request_with_retry`. If the first call
@@ -33,6 +34,8 @@ def http_request_with_reauth(
       including Authorization and content-type.
     :param data: JSON data in the case that the request requires data to be
       posted. Default: `None`
+    :param session: A pooled session to make the requests with, as made by
+      :func:`app.transport.create_session_with_retry`. Default: `None`
     :return: A `requests.Request` object containing the response from the FHIR server.
     """
 
@@ -43,12 +46,13 @@ def http_request_with_reauth(
         allowed_methods=allowed_methods,
         headers=headers,
         data=data,
+        session=session,
     )
 
     # Retry with new token in case it expired since creation (or from cache)
     if response.status_code == 401:
         if headers.get("Authorization", "").startswith("Bearer "):
-            new_access_token = cred_manager.get_access_token()
+            new_access_token = cred_manager.get_access_token(force_refresh=True)
             headers["Authorization"] = f"Bearer {new_access_token}"
 
         response = http_request_with_retry(
@@ -1,18 +1,28 @@
+import asyncio
 import json
 import os
+from collections.abc import AsyncIterator
 from pathlib import Path
-from typing import Annotated
+from typing import Annotated, Union
 
-from fastapi import Body, Response, status
+from fastapi import Body, Request, Response, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
+from frozendict import frozendict
+from pydantic import ValidationError
 
 from app.base_service import BaseService
+from app.cloud.core import BaseCredentialManager
 from app.config import get_settings
 from app.models import (
     FhirToPhdcInput,
     GetSchemaResponse,
     ListSchemasResponse,
     ParseMessageInput,
+    ParseMessageOptions,
     ParseMessageResponse,
+    ParseMessagesInput,
+    ParserCacheResponse,
     ParsingSchemaModel,
     PutSchemaResponse,
 )
@@ -24,6 +34,9 @@ from app.utils import (
     freeze_parsing_schema,
     get_credential_manager,
     get_metadata,
+    get_parser_cache_stats,
+    get_parsers,
+    invalidate_parsing_schema,
     load_parsing_schema,
     read_json_from_assets,
     search_for_required_values,
@@ -81,39 +94,331 @@ async def parse_message_endpoint(
             response.status_code = status.HTTP_400_BAD_REQUEST
             return {"message": error.__str__(), "parsed_values": {}}
 
-    # 2. Convert to FHIR, if necessary.
-    if input.message_format != "fhir":
-        if input.credential_manager is not None:
-            input.credential_manager = get_credential_manager(
-                credential_manager=input.credential_manager,
-                location_url=input.fhir_converter_url,
-            )
+    # 2. Convert to FHIR, if necessary, and parse the desired values.
+    credential_manager = None
+    if input.message_format != "fhir" and input.credential_manager is not None:
+        credential_manager = get_credential_manager(
+            credential_manager=input.credential_manager,
+            location_url=input.fhir_converter_url,
+        )
+    response.status_code, parse_result = parse_message(
+        input, parsing_schema, input.message, credential_manager
+    )
+    return parse_result
+
 
-        search_result = search_for_required_values(dict(input), ["fhir_converter_url"])
+def parse_message(
+    options: ParseMessageOptions,
+    parsing_schema: frozendict,
+    message: Union[str, dict],
+    credential_manager: BaseCredentialManager = None,
+    parsers: frozendict = None,
+) -> tuple[int, dict]:
+    """
+    Extracts the desired values from a single message, converting it to FHIR
+    first if it is not already in FHIR format.
+
+    :param options: The options of the request, describing how the message is
+      to be parsed.
+    :param parsing_schema: The parsing schema to apply to the message.
+    :param message: The message to be parsed.
+    :param credential_manager: The credential manager used to authenticate
+      with the FHIR converter, if any.
+    :param parsers: The parsers compiled from the parsing schema, if they are
+      already at hand.
+    :return: The status code and the content of the response for the message.
+    """
+    # 1. Convert to FHIR, if necessary.
+    if options.message_format != "fhir":
+        search_result = search_for_required_values(
+            dict(options), ["fhir_converter_url"]
+        )
         if search_result != "All values were found.":
-            response.status_code = status.HTTP_400_BAD_REQUEST
-            return {"message": search_result, "parsed_values": {}}
+            return status.HTTP_400_BAD_REQUEST, {
+                "message": search_result,
+                "parsed_values": {},
+            }
 
         fhir_converter_response = convert_to_fhir(
-            message=input.message,
-            message_type=input.message_type,
-            fhir_converter_url=input.fhir_converter_url,
-            credential_manager=input.credential_manager,
+            message=message,
+            message_type=options.message_type,
+            fhir_converter_url=options.fhir_converter_url,
+            credential_manager=credential_manager,
         )
         if fhir_converter_response.status_code == 200:
-            input.message = fhir_converter_response.json()["FhirResource"]
+            message = fhir_converter_response.json()["FhirResource"]
         else:
-            response.status_code = status.HTTP_400_BAD_REQUEST
-            return {
+            return status.HTTP_400_BAD_REQUEST, {
                 "message": f"Failed to convert to FHIR: {fhir_converter_response.text}",
                 "parsed_values": {},
             }
 
-    # 3. Parse the desired values and find metadata, if needed
-    parsed_values = extract_and_apply_parsers(parsing_schema, input.message, response)
-    if input.include_metadata == "true":
+    # 2. Parse the desired values and find metadata, if needed
+    response = Response()
+    parsed_values = extract_and_apply_parsers(
+        parsing_schema, message, response, parsers
+    )
+    if options.include_metadata == "true":
         parsed_values = get_metadata(parsed_values, parsing_schema)
-    return {"message": "Parsing succeeded!", "parsed_values": parsed_values}
+    return response.status_code, {
+        "message": "Parsing succeeded!",
+        "parsed_values": parsed_values,
+    }
+
+
+# /parse_messages endpoint #
+parse_messages_request_body = {
+    "required": True,
+    "content": {
+        "application/json": {"schema": ParseMessagesInput.model_json_schema()},
+        "application/x-ndjson": {
+            "schema": {
+                "type": "string",
+                "description": "A line holding the options of a "
+                "`/parse_messages` request other than `messages`, followed by one "
+                "line for each message.",
+            }
+        },
+    },
+}
+
+
+@app.post(
+    "/parse_messages",
+    status_code=200,
+    openapi_extra={"requestBody": parse_messages_request_body},
+)
+async def parse_messages_endpoint(request: Request):
+    """
+    This endpoint extracts the desired values from many messages with the same
+    parsing schema, which is loaded and compiled only once for all of them.
+
+    The request may be a JSON object holding the same options as a
+    `/parse_message` request, with a list of `messages` in place of the
+    `message`. It may also be sent as newline-delimited JSON (with a
+    `Content-Type` of `application/x-ndjson`), whose first line holds the
+    options and each following line one message, so that a client can write
+    out a large batch without building one JSON document for it.
+
+    The messages are parsed concurrently, and the result for each one is
+    streamed back as a line of newline-delimited JSON holding the message's
+    position in the request (`index`), its `status_code`, and the `response`
+    `/parse_message` would have returned for it, in the order they finish. A
+    message that cannot be parsed does not affect the others.
+    """
+    # 1. Read the options, leaving the messages of NDJSON requests to be read
+    # from the request and decoded as they are parsed.
+    is_ndjson = request.headers.get("content-type", "").startswith(
+        "application/x-ndjson"
+    )
+    try:
+        if is_ndjson:
+            messages = _iter_ndjson_lines(request.stream())
+            try:
+                options_line = await messages.__anext__()
+            except StopAsyncIteration:
+                options_line = b""
+            options = ParseMessagesInput.model_validate_json(options_line)
+        else:
+            options = ParseMessagesInput.model_validate_json(await request.body())
+            messages = _iter_messages(options.messages)
+    except ValidationError as error:
+        raise RequestValidationError(
+            [{**detail, "loc": ("body", *detail["loc"])} for detail in error.errors()]
+        )
+
+    # 2. Load and compile the schema.
+    if options.parsing_schema:
+        parsing_schema = freeze_parsing_schema(options.parsing_schema)
+    else:
+        try:
+            parsing_schema = load_parsing_schema(options.parsing_schema_name)
+        except FileNotFoundError as error:
+            return JSONResponse(
+                content={"message": error.__str__(), "parsed_values": {}},
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+    parsers = get_parsers(parsing_schema)
+
+    credential_manager = None
+    if options.message_format != "fhir" and options.credential_manager is not None:
+        credential_manager = get_credential_manager(
+            credential_manager=options.credential_manager,
+            location_url=options.fhir_converter_url,
+        )
+
+    # 3. Parse the messages.
+    response_class = _RequestStreamingResponse if is_ndjson else StreamingResponse
+    return response_class(
+        stream_parse_results(
+            options, parsing_schema, parsers, credential_manager, messages
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
+class _RequestStreamingResponse(StreamingResponse):
+    """
+    A streaming response whose content is produced while the rest of the
+    request is still being read. Unlike `StreamingResponse`, it does not listen
+    for the client disconnecting while it streams, which would consume the
+    messages holding the rest of the request body.
+    """
+
+    async def __call__(self, scope, receive, send):
+        """
+        Sends the response, reading no messages from the client.
+        """
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def _iter_ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Splits a stream of newline-delimited JSON into its lines as they arrive,
+    skipping blank lines.
+
+    :param chunks: An async iterator of the chunks of the stream.
+    :return: An async iterator of the non-blank lines of the stream.
+    """
+    partial_line = []
+    async for chunk in chunks:
+        *lines, rest = chunk.split(b"\n")
+        if lines:
+            lines[0] = b"".join(partial_line + [lines[0]])
+            partial_line = []
+        partial_line.append(rest)
+        for line in lines:
+            if line.strip():
+                yield line
+    line = b"".join(partial_line)
+    if line.strip():
+        yield line
+
+
+async def _iter_messages(messages: list) -> AsyncIterator[Union[str, dict]]:
+    """
+    Yields the messages of a JSON `/parse_messages` request.
+    """
+    for message in messages:
+        yield message
+
+
+async def stream_parse_results(
+    options: ParseMessageOptions,
+    parsing_schema: frozendict,
+    parsers: frozendict,
+    credential_manager: BaseCredentialManager,
+    messages: AsyncIterator[Union[str, dict, bytes]],
+) -> AsyncIterator[bytes]:
+    """
+    Parses every message of a `/parse_messages` request in a pool of worker
+    threads, keeping at most `batch_max_concurrency` of them in flight at
+    once, and yields the result of each as a line of newline-delimited JSON in
+    the order they finish.
+
+    :param options: The options of the request, describing how the messages
+      are to be parsed.
+    :param parsing_schema: The parsing schema to apply to each message.
+    :param parsers: The parsers compiled from the parsing schema.
+    :param credential_manager: The credential manager used to authenticate
+      with the FHIR converter, if any.
+    :param messages: An async iterator of the messages, or of the NDJSON
+      lines holding them as they are read from the request.
+    :return: An async iterator of encoded NDJSON lines.
+    """
+    max_concurrency = get_settings()["batch_max_concurrency"]
+    pending = set()
+    try:
+        index = 0
+        async for message in messages:
+            if len(pending) >= max_concurrency:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+            pending.add(
+                asyncio.create_task(
+                    asyncio.to_thread(
+                        _parse_batch_message,
+                        options,
+                        parsing_schema,
+                        parsers,
+                        credential_manager,
+                        index,
+                        message,
+                    )
+                )
+            )
+            index += 1
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield task.result()
+    finally:
+        # The client may disconnect before every message has been parsed
+        for task in pending:
+            task.cancel()
+
+
+def _parse_batch_message(
+    options: ParseMessageOptions,
+    parsing_schema: frozendict,
+    parsers: frozendict,
+    credential_manager: BaseCredentialManager,
+    index: int,
+    message: Union[str, dict, bytes],
+) -> bytes:
+    """
+    Parses a single message of a `/parse_messages` request and summarizes the
+    outcome as a line of newline-delimited JSON, so that one failing message
+    does not end the whole stream.
+    """
+    try:
+        if isinstance(message, bytes):
+            message = json.loads(message)
+        if not isinstance(message, (str, dict)):
+            status_code, content = (
+                status.HTTP_400_BAD_REQUEST,
+                {
+                    "message": "A message must be a JSON string or object.",
+                    "parsed_values": {},
+                },
+            )
+        else:
+            status_code, content = parse_message(
+                options, parsing_schema, message, credential_manager, parsers
+            )
+    except json.JSONDecodeError as error:
+        status_code, content = (
+            status.HTTP_400_BAD_REQUEST,
+            {
+                "message": f"The message is not valid JSON: {error.__str__()}",
+                "parsed_values": {},
+            },
+        )
+    except Exception as error:
+        status_code, content = (
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+            {
+                "message": f"Message parser error: {error.__str__()}",
+                "parsed_values": {},
+            },
+        )
+
+    # Serialize the response as `/parse_message` does
+    result = {
+        "index": index,
+        "status_code": status_code,
+        "response": ParseMessageResponse.model_validate(content).model_dump(
+            mode="json"
+        ),
+    }
+    return json.dumps(result).encode("utf-8") + b"\n"
 
 
 # /fhir_to_phdc endpoint #
@@ -161,6 +466,8 @@ async def fhir_to_phdc_endpoint(
     # 4. Build PHDC
     builder = PHDCBuilder()
     builder.set_input_data(input_data)
+    if input.stream:
+        return StreamingResponse(builder.iter_xml(), media_type="application/xml")
     phdc = builder.build()
 
     return Response(content=phdc.to_xml_string(), media_type="application/xml")
@@ -251,6 +558,7 @@ async def upload_schema(
 
     with open(file_path, "w") as file:
         json.dump(schema_dict["parsing_schema"], file, indent=4)
+    invalidate_parsing_schema(parsing_schema_name)
 
     if schema_exists:
         return {"message": "Schema updated successfully!"}
@@ -259,6 +567,15 @@ async def upload_schema(
         return {"message": "Schema uploaded successfully!"}
 
 
+@app.get("/parser_cache")
+async def parser_cache() -> ParserCacheResponse:
+    """
+    This endpoint reports the size of the cache of compiled parsing schemas and
+    how often the schema of a request was found in it.
+    """
+    return get_parser_cache_stats()
+
+
 # This block is only executed if the script is run directly, for local development and debugging.
 if "__main__" == __name__:
     import uvicorn
@@ -53,9 +53,10 @@ def validate_secondary_reference_fields(values):
     return values
 
 
-class ParseMessageInput(BaseModel):
+class ParseMessageOptions(BaseModel):
     """
-    The schema for requests to the /extract endpoint.
+    The options shared by requests to the /parse_message and /parse_messages
+    endpoints, describing how messages are to be parsed.
     """
 
     message_format: Literal["fhir", "hl7v2", "ecr"] = Field(
@@ -91,7 +92,6 @@ class ParseMessageInput(BaseModel):
         description="Boolean to include metadata in the response.",
         default=None,
     )
-    message: Union[str, dict] = Field(description="The message to be parsed.")
 
     @model_validator(mode="before")
     def require_message_type_when_not_fhir(cls, values):
@@ -99,7 +99,7 @@ class ParseMessageInput(BaseModel):
         Function that checks when non-fhir-formatted data is given whether a
           message_type has been included with API call
 
-        :param cls: the ParseMessageInput class
+        :param cls: the ParseMessageOptions class
         :param values: the message_format provided by the user
         :raises ValueError: errors when message_type is None
           when message_format is not "fhir"
@@ -122,7 +122,7 @@ class ParseMessageInput(BaseModel):
           both parsing_schema and parsing_schema_name;
           only one should be provided for message_parser to work correctly.
 
-        :param cls: the ParseMessageInput class
+        :param cls: the ParseMessageOptions class
         :param values: the parsing_schema and parsing_schema_name provided by the user
         :raises ValueError: error when both parsing_schema and
           parsing_schema_name are provided in API call.
@@ -142,7 +142,7 @@ class ParseMessageInput(BaseModel):
           one of either parsing_schema and parsing_schema_name;
           one (and only one!) should be provided for message_parser to work correctly.
 
-        :param cls: the ParseMessageInput class
+        :param cls: the ParseMessageOptions class
         :param values: the parsing_schema and parsing_schema_name provided by the user
         :raises ValueError: error when both pasing_schema and parsing_schema_name
           are missing from API call.
@@ -171,6 +171,27 @@ class ParseMessageInput(BaseModel):
         return validate_secondary_reference_fields(values)
 
 
+class ParseMessageInput(ParseMessageOptions):
+    """
+    The schema for requests to the /extract endpoint.
+    """
+
+    message: Union[str, dict] = Field(description="The message to be parsed.")
+
+
+class ParseMessagesInput(ParseMessageOptions):
+    """
+    The schema for requests to the /parse_messages endpoint.
+    """
+
+    messages: list[Union[str, dict]] = Field(
+        description="The messages to be parsed. When the request is sent as "
+        "newline-delimited JSON, the messages follow the other options, one per "
+        "line, instead.",
+        default=[],
+    )
+
+
 class ParseMessageResponse(BaseModel):
     """
     The schema for responses from the /extract endpoint.
@@ -197,6 +218,12 @@ class FhirToPhdcInput(BaseModel):
         " and determines which PHDC schema is used when extracting."
     )
     message: dict = Field(description="The FHIR bundle to extract from.")
+    stream: bool = Field(
+        description="Whether to write the PHDC to the response section by section "
+        "as it is built, rather than building the whole document first. The XML "
+        "is the same, apart from whitespace and where namespaces are declared.",
+        default=False,
+    )
 
 
 class FhirToPhdcResponse(BaseModel):
@@ -285,3 +312,25 @@ class PutSchemaResponse(BaseModel):
     message: str = Field(
         "A message describing the result of a request to upload a parsing schema."
     )
+
+
+class ParserCacheResponse(BaseModel):
+    """
+    The schema for responses from the /parser_cache endpoint.
+    """
+
+    size: int = Field(
+        description="The number of parsing schemas whose compiled parsers are cached."
+    )
+    max_size: int = Field(
+        description="The most parsing schemas whose compiled parsers may be cached."
+    )
+    hits: int = Field(
+        description="The number of requests whose schema's parsers were cached."
+    )
+    misses: int = Field(
+        description="The number of requests whose schema's parsers had to be compiled."
+    )
+    hit_rate: float = Field(
+        description="The share of requests whose schema's parsers were cached."
+    )
@@ -1,7 +1,9 @@
+import io
 import logging
 import uuid
+from collections.abc import Iterator
 from datetime import datetime
-from typing import Literal, Optional
+from typing import BinaryIO, Literal, Optional
 
 from lxml import etree as ET
 
@@ -236,27 +238,34 @@ class PHDCBuilder:
         Builds the header of the PHDC document.
         """
         root = self.phdc.getroot()
-        root.append(self._get_realmCode())
-        root.append(self._get_type_id())
-        root.append(self._get_id())
-        root.append(self._get_clinical_info_code())
-        root.append(self._get_title())
-        root.append(self._get_effective_time())
-        root.append(self._get_confidentiality_code(confidentiality="normal"))
-        root.append(self._get_setId())
-        root.append(self._get_version_number())
-        root.append(
-            self._build_recordTarget(
-                id=str(uuid.uuid4()),
-                root="2.16.840.1.113883.4.1",
-                assigningAuthorityName="LR",
-                telecom_data=self.input_data.patient.telecom,
-                address_data=self.input_data.patient.address,
-                patient_data=self.input_data.patient,
-            )
+        for element in self._iter_header_elements():
+            root.append(element)
+
+    def _iter_header_elements(self) -> Iterator[ET.Element]:
+        """
+        Builds the elements of the PHDC header one at a time, in document order.
+
+        :return: An iterator of the XML elements of the header.
+        """
+        yield self._get_realmCode()
+        yield self._get_type_id()
+        yield self._get_id()
+        yield self._get_clinical_info_code()
+        yield self._get_title()
+        yield self._get_effective_time()
+        yield self._get_confidentiality_code(confidentiality="normal")
+        yield self._get_setId()
+        yield self._get_version_number()
+        yield self._build_recordTarget(
+            id=str(uuid.uuid4()),
+            root="2.16.840.1.113883.4.1",
+            assigningAuthorityName="LR",
+            telecom_data=self.input_data.patient.telecom,
+            address_data=self.input_data.patient.address,
+            patient_data=self.input_data.patient,
         )
-        root.append(self._build_author(family_name="CDC PRIME DIBBs"))
-        root.append(self._build_custodian(organizations=self.input_data.organization))
+        yield self._build_author(family_name="CDC PRIME DIBBs")
+        yield self._build_custodian(organizations=self.input_data.organization)
 
     def build_body(self):
         """
@@ -266,11 +275,23 @@ class PHDCBuilder:
         structured_body = ET.Element("structuredBody")
         body.append(structured_body)
 
+        for section in self._iter_body_sections():
+            structured_body.append(section)
+
+        self.phdc.getroot().append(body)
+
+    def _iter_body_sections(self) -> Iterator[ET.Element]:
+        """
+        Builds the sections of the PHDC body one at a time, in document order. The
+        sections depend on the type of the PHDC.
+
+        :return: An iterator of the XML elements of the body's sections.
+        """
         match self.input_data.type:
             case "case_report":
-                structured_body.append(self._build_social_history_info())
-                structured_body.append(self._build_clinical_info())
-                structured_body.append(self._build_repeating_questions())
+                yield self._build_social_history_info()
+                yield self._build_clinical_info()
+                yield self._build_repeating_questions()
 
             case "contact_record":
                 pass
@@ -279,8 +300,6 @@ class PHDCBuilder:
             case "morbidity_report":
                 pass
 
-        self.phdc.getroot().append(body)
-
     def _add_observations_to_section(
         self,
         section: ET.Element,
@@ -1002,3 +1021,62 @@ class PHDCBuilder:
         self.build_header()
         self.build_body()
         return PHDC(data=self.phdc)
+
+    def iter_xml(self) -> Iterator[bytes]:
+        """
+        Constructs a PHDC document like `build`, but serializes it incrementally
+        rather than assembling the whole element tree: each element of the header
+        and each section of the body is written as soon as it is built, and the
+        XML written so far is yielded, so that only one section is held in memory
+        at a time. The result is the same XML `build` produces, apart from
+        whitespace and the namespace declarations repeated on the elements that
+        use them.
+
+        :return: An iterator of the encoded UTF-8 XML of the PHDC document.
+        """
+        root = self.phdc.getroot()
+        buffer = io.BytesIO()
+
+        def take_written():
+            xml_file.flush()
+            written = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return written
+
+        with ET.xmlfile(buffer, encoding="utf-8") as xml_file:
+            xml_file.write_declaration()
+            xml_file.write(root.getprevious(), pretty_print=True)
+            # The incremental writer declares each namespace under one prefix
+            # only, so leave out the placeholder prefix of the default namespace
+            nsmap = {
+                prefix: uri
+                for prefix, uri in root.nsmap.items()
+                if prefix is None or uri != root.nsmap[None]
+            }
+            with xml_file.element(root.tag, root.attrib, nsmap=nsmap):
+                xml_file.write("\n")
+                for element in self._iter_header_elements():
+                    xml_file.write(element, pretty_print=True)
+                    yield take_written()
+
+                with xml_file.element("component"):
+                    with xml_file.element("structuredBody"):
+                        xml_file.write("\n")
+                        for section in self._iter_body_sections():
+                            xml_file.write(section, pretty_print=True)
+                            yield take_written()
+                    xml_file.write("\n")
+                xml_file.write("\n")
+        yield buffer.getvalue() + b"\n"
+
+    def write(self, output: BinaryIO):
+        """
+        Constructs a PHDC document and writes it to a binary file-like object,
+        such as a response stream, section by section as it is built. See
+        `iter_xml`.
+
+        :param output: The binary file-like object to write the PHDC XML to.
+        """
+        for xml in self.iter_xml():
+            output.write(xml)
@@ -1,3 +1,3 @@
-from .http import http_request_with_retry
+from .http import create_session_with_retry, http_request_with_retry
 
-__all__ = ["http_request_with_retry"]
+__all__ = ["create_session_with_retry", "http_request_with_retry"]
@@ -12,6 +12,7 @@ def http_request_with_retry(
     allowed_methods: list[str],
     headers: dict,
     data: dict = None,
+    session: requests.Session = None,
 ) -> requests.Response:
     """
     Executes an HTTP request, retrying the request if the returned HTTP status code
@@ -28,6 +29,9 @@ def http_request_with_retry(
       including Authorization and content-type.
     :param data: The data as a JSON-formatted dictionary, used when the request
       requires data to be posted. Default: `None`
+    :param session: A session made with :func:`create_session_with_retry`, to
+      reuse its pooled connections, whose own retry settings then apply. If not
+      given, a new session is made for the request. Default: `None`
     :raises ValueError: An unsupported HTTP method (e.g., PATCH, DELETE) was passed
       to the request_type parameter.
     :return: A HTTP request response.
@@ -41,15 +45,9 @@ def http_request_with_retry(
 
     # Configure the settings of the 'requests' session we'll make
     # the API call with
-    retry_strategy = Retry(
-        total=retry_count,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=allowed_methods,
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    http = requests.Session()
-    http.mount("http://", adapter)
-    http.mount("https://", adapter)
+    http = session
+    if http is None:
+        http = create_session_with_retry(retry_count, allowed_methods)
 
     # Now, actually try to complete the API request
     # TODO: Condense this down to make a single call using
@@ -67,3 +65,32 @@ def http_request_with_retry(
         )
 
     return response
+
+
+def create_session_with_retry(
+    retry_count: int, allowed_methods: list[str], pool_maxsize: int = 10
+) -> requests.Session:
+    """
+    Creates a `requests` session that retries requests whose returned HTTP status
+    code is one of a specified list of codes. A session keeps its connections open
+    between requests, so one that is shared by many requests to the same host only
+    pays to connect (and to negotiate TLS) once per pooled connection.
+
+    :param retry_count: The number of times to retry a request, if the
+      first attempt fails.
+    :param allowed_methods: The list of allowed HTTP request methods (i.e.,
+      POST, PUT) that are retried.
+    :param pool_maxsize: The number of connections kept open to each host.
+      Default: `10`
+    :return: A `requests` session.
+    """
+    retry_strategy = Retry(
+        total=retry_count,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=allowed_methods,
+    )
+    adapter = HTTPAdapter(max_retries=retry_strategy, pool_maxsize=pool_maxsize)
+    http = requests.Session()
+    http.mount("http://", adapter)
+    http.mount("https://", adapter)
+    return http
@@ -1,10 +1,15 @@
 import dataclasses
 import datetime
+import hashlib
 import json
 import pathlib
 import re
+import threading
 import uuid
-from functools import cache
+from collections import OrderedDict
+from collections.abc import Mapping
+from decimal import Decimal
+from functools import cache, lru_cache, partial
 from pathlib import Path
 from typing import Literal, Union
 
@@ -28,38 +33,141 @@ from app.phdc.models import (
     PHDCInputData,
     Telecom,
 )
-from app.transport.http import http_request_with_retry
+from app.transport.http import create_session_with_retry, http_request_with_retry
 
 DIBBS_REFERENCE_SIGNIFIER = "#REF#"
 
+# Matches a FHIRpath that starts by selecting the bundle's resources of one
+# type, capturing the resource type and the rest of the path
+ANCHORED_FHIR_PATH = re.compile(
+    r"^Bundle\.entry\.resource\.where\(\s*resourceType\s*=\s*'([^']+)'\s*\)(.*)$"
+)
+
+# Matches a reference field's `fhir_path` that selects the referenced resource
+# from the bundle by its type and ID, capturing the resource type and the rest
+# of the path
+REFERENCED_RESOURCE_PATH = re.compile(
+    r"^Bundle\.entry\.resource\.where\(\s*resourceType\s*=\s*'([^']+)'\s*\)"
+    rf"\.where\(\s*id\s*=\s*'{DIBBS_REFERENCE_SIGNIFIER}'\s*\)(.*)$"
+)
+
+# The outline of the rest of such a path, once its string literals and the
+# parameters of its function calls are removed, that can be run on the
+# selected resources in place of the bundle: an optional index, followed by
+# members and function calls, the first of which starts in lowercase (as a
+# capitalized first member would be read as a type)
+RESOURCE_PATH_OUTLINE = re.compile(
+    r"^(\[\d+\])?(?:\.[a-z]\w*(?:\(\)|\[\d+\])*(?:\.[A-Za-z_]\w*(?:\(\)|\[\d+\])*)*)?$"
+)
+
+# The functions that may be called on the selected resources. Each takes no
+# parameters or evaluates them on each resource in turn, so gives the same
+# result whether the resources were selected from the bundle or not
+RESOURCE_PATH_FUNCTIONS = frozenset(
+    {
+        "all",
+        "count",
+        "distinct",
+        "empty",
+        "exists",
+        "first",
+        "hasValue",
+        "last",
+        "not",
+        "select",
+        "single",
+        "tail",
+        "where",
+    }
+)
+
+# One step of a FHIRpath made only of members, indexes and `first()` calls
+SIMPLE_FHIR_PATH_STEP = re.compile(r"([A-Za-z_]\w*)((?:\[\d+\])*)")
+
+# Words FHIRpath reads as operators or literals rather than members
+FHIR_PATH_KEYWORDS = frozenset(
+    {
+        "and",
+        "as",
+        "contains",
+        "div",
+        "false",
+        "implies",
+        "in",
+        "is",
+        "mod",
+        "or",
+        "true",
+        "xor",
+    }
+)
+
+
+# Loaded schemas, keyed by name, along with the path and modification time of
+# the file each was loaded from
+_parsing_schemas: dict[str, tuple[Path, int, frozendict]] = {}
+
+# Compiled parsers, keyed by a digest of the content of the schema they were
+# compiled from, from the least to the most recently used, and the number of
+# lookups that did and did not find them
+_parser_cache: OrderedDict[str, frozendict] = OrderedDict()
+_parser_cache_lookups = {"hits": 0, "misses": 0}
+_parser_cache_lock = threading.Lock()
+
 
-@cache
 def load_parsing_schema(schema_name: str) -> dict:
     """
     Load a parsing schema given its name. Look in the 'custom_schemas/' directory first.
     If no custom schemas match the provided name, check the schemas provided by default
     with this service in the 'default_schemas/' directory.
 
+    Loaded schemas are cached, and are reloaded when the file they were read
+    from changes (or a custom schema starts shadowing a default one), so that
+    uploaded schemas are seen by every worker without a restart.
+
     :param path: The path to an extraction schema file.
     :return: A dictionary containing the extraction schema.
     """
-    custom_schema_path = Path(__file__).parent / "custom_schemas" / schema_name
-    try:
-        with open(custom_schema_path) as file:
-            parsing_schema = json.load(file)
-    except FileNotFoundError:
+    for schema_path in (
+        Path(__file__).parent / "custom_schemas" / schema_name,
+        Path(__file__).parent / "default_schemas" / schema_name,
+    ):
         try:
-            default_schema_path = (
-                Path(__file__).parent / "default_schemas" / schema_name
-            )
-            with open(default_schema_path) as file:
-                parsing_schema = json.load(file)
+            modified_time = schema_path.stat().st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+
+        cached = _parsing_schemas.get(schema_name)
+        if cached is not None and cached[:2] == (schema_path, modified_time):
+            return cached[2]
+        try:
+            with open(schema_path) as file:
+                parsing_schema = freeze_parsing_schema(json.load(file))
         except FileNotFoundError:
-            raise FileNotFoundError(
-                f"A schema with the name '{schema_name}' could not be found."
-            )
+            continue
+
+        _parsing_schemas[schema_name] = (schema_path, modified_time, parsing_schema)
+        return parsing_schema
+
+    _parsing_schemas.pop(schema_name, None)
+    raise FileNotFoundError(
+        f"A schema with the name '{schema_name}' could not be found."
+    )
+
 
-    return freeze_parsing_schema(parsing_schema)
+def invalidate_parsing_schema(schema_name: str) -> None:
+    """
+    Drops a schema, and the parsers compiled from it, from the caches, so that
+    it is read from disk the next time it is used. Called when a schema is
+    uploaded, since file modification times may be too coarse to notice a
+    quick rewrite.
+
+    :param schema_name: The name of the schema.
+    """
+    cached = _parsing_schemas.pop(schema_name, None)
+    if cached is not None:
+        with _parser_cache_lock:
+            _parser_cache.pop(get_schema_digest(cached[2]), None)
 
 
 def freeze_parsing_schema(parsing_schema: dict) -> frozendict:
@@ -87,16 +195,87 @@ def freeze_parsing_schema_helper(schema: dict) -> frozendict:
         return frozendict(schema)
 
 
-# Using frozendict here to have an immutable that can be hashed for caching purposes.
-# Caching the parsers reduces parsing time by over 60% after the first request for a
-# given schema.
-@cache
+def get_schema_digest(parsing_schema: dict) -> str:
+    """
+    Computes a digest of the content of a parsing schema, which is the same for
+    any two schemas with the same fields, whatever order they are listed in.
+
+    :param parsing_schema: A dictionary containing a parsing schema.
+    :return: The hex SHA-256 digest of the schema.
+    """
+    return hashlib.sha256(
+        json.dumps(parsing_schema, sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+
+
 def get_parsers(extraction_schema: frozendict) -> frozendict:
     """
     Generate a FHIRpath parser for each field in a given schema. Return these parsers as
     values in a dictionary whose keys indicate the field in the schema the parser is
     associated with.
 
+    Compiling the parsers is much slower than applying them, so the parsers
+    for the last `PARSER_CACHE_MAX_SIZE` schemas used are kept, keyed by a
+    digest of each schema's content.
+
+    :param extraction_schema: A dictionary containing an extraction schema.
+    :return: A dictionary containing a FHIRpath parsers for each field in the provided
+    schema.
+    """
+    schema_digest = get_schema_digest(extraction_schema)
+    with _parser_cache_lock:
+        parsers = _parser_cache.get(schema_digest)
+        if parsers is not None:
+            _parser_cache.move_to_end(schema_digest)
+            _parser_cache_lookups["hits"] += 1
+            return parsers
+        _parser_cache_lookups["misses"] += 1
+
+    parsers = compile_parsers(extraction_schema)
+    max_size = get_settings()["parser_cache_max_size"]
+    with _parser_cache_lock:
+        _parser_cache[schema_digest] = parsers
+        while len(_parser_cache) > max_size:
+            _parser_cache.popitem(last=False)
+    return parsers
+
+
+def get_parser_cache_stats() -> dict:
+    """
+    Reports the size of the cache of compiled parsers and how often schemas
+    were found in it.
+
+    :return: A dictionary of the number of schemas whose parsers are cached
+      (`size`), the most that may be (`max_size`), the number of lookups that
+      did and did not find a schema's parsers (`hits` and `misses`), and the
+      share of lookups that did (`hit_rate`).
+    """
+    with _parser_cache_lock:
+        hits = _parser_cache_lookups["hits"]
+        misses = _parser_cache_lookups["misses"]
+        return {
+            "size": len(_parser_cache),
+            "max_size": get_settings()["parser_cache_max_size"],
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+
+def clear_parser_cache() -> None:
+    """
+    Empties the cache of compiled parsers and resets its statistics.
+    """
+    with _parser_cache_lock:
+        _parser_cache.clear()
+        _parser_cache_lookups.update(hits=0, misses=0)
+
+
+def compile_parsers(extraction_schema: frozendict) -> frozendict:
+    """
+    Compiles the FHIRpath parsers for each field in a given schema, as returned
+    by `get_parsers`.
+
     :param extraction_schema: A dictionary containing an extraction schema.
     :return: A dictionary containing a FHIRpath parsers for each field in the provided
     schema.
@@ -104,8 +283,7 @@ def get_parsers(extraction_schema: frozendict) -> frozendict:
     parsers = {}
 
     for field, field_definition in extraction_schema.items():
-        parser = {}
-        parser["primary_parser"] = fhirpathpy.compile(field_definition["fhir_path"])
+        parser = compile_bundle_path(field_definition["fhir_path"])
         if "secondary_schema" in field_definition:
             secondary_parsers = {}
             for secondary_field, secondary_field_definition in field_definition[
@@ -119,7 +297,7 @@ def get_parsers(extraction_schema: frozendict) -> frozendict:
                     ):
                         tertiary_parser = {}
                         tertiary_parsers = {}
-                        tertiary_parser["primary_parser"] = fhirpathpy.compile(
+                        tertiary_parser["primary_parser"] = compile_fhir_path(
                             secondary_field_definition["fhir_path"]
                         )
                         for (
@@ -127,7 +305,7 @@ def get_parsers(extraction_schema: frozendict) -> frozendict:
                             tertiary_field_definition,
                         ) in secondary_field_definition["secondary_schema"].items():
                             tertiary_parsers[tertiary_field] = {
-                                "secondary_fhir_path": fhirpathpy.compile(
+                                "secondary_fhir_path": compile_fhir_path(
                                     tertiary_field_definition["fhir_path"]
                                 )
                             }
@@ -137,10 +315,15 @@ def get_parsers(extraction_schema: frozendict) -> frozendict:
                         }
 
                     else:
+                        secondary_parser = compile_fhir_path(
+                            secondary_field_definition["fhir_path"]
+                        )
                         secondary_parsers[secondary_field] = {
-                            "secondary_fhir_path": fhirpathpy.compile(
-                                secondary_field_definition["fhir_path"]
-                            )
+                            "secondary_fhir_path": secondary_parser,
+                            "property_accessors": get_property_accessors(
+                                secondary_field_definition["fhir_path"],
+                                secondary_parser,
+                            ),
                         }
                 # Reference case: secondary field is located on a different resource,
                 # so we can't compile the fhir_path proper; instead, compile the
@@ -148,15 +331,332 @@ def get_parsers(extraction_schema: frozendict) -> frozendict:
                 else:
                     secondary_parsers[secondary_field] = {
                         "secondary_fhir_path": secondary_field_definition["fhir_path"],
-                        "reference_path": fhirpathpy.compile(
+                        "reference_path": compile_fhir_path(
                             secondary_field_definition["reference_lookup"]
                         ),
                     }
+                    # When the path selects the referenced resource by type
+                    # and ID, compile the rest of it to run on the resource,
+                    # which is then found through the bundle's resource index
+                    match = REFERENCED_RESOURCE_PATH.match(
+                        secondary_field_definition["fhir_path"]
+                    )
+                    resource_path = (
+                        split_resource_path(match.group(2)) if match else None
+                    )
+                    if resource_path is not None:
+                        secondary_parsers[secondary_field].update(
+                            compile_resource_path(match.group(1), *resource_path)
+                        )
             parser["secondary_parsers"] = secondary_parsers
         parsers[field] = parser
     return frozendict(parsers)
 
 
+def compile_bundle_path(fhir_path: str) -> dict:
+    """
+    Compiles the FHIRpath of a schema field, which is run on the whole bundle.
+    When the path starts by selecting the bundle's resources of one type, only
+    the rest of it is compiled, to be run on those resources once they have
+    been grouped by type in a single pass over the bundle.
+
+    :param fhir_path: The FHIRpath to compile.
+    :return: A dictionary holding either the compiled path as its
+      `primary_parser`, or the `resource_type` the path selects and the
+      compiled rest of the path.
+    """
+    match = ANCHORED_FHIR_PATH.match(fhir_path)
+    resource_path = split_resource_path(match.group(2)) if match else None
+    if resource_path is None:
+        return {"primary_parser": compile_fhir_path(fhir_path)}
+    return {
+        "fhir_path": fhir_path,
+        **compile_resource_path(match.group(1), *resource_path),
+    }
+
+
+def compile_resource_path(
+    resource_type: str, resource_index: int | None, resource_path: str
+) -> dict:
+    """
+    Compiles the part of a FHIRpath that is run on the bundle's resources of
+    one type, as split by `split_resource_path`.
+
+    :param resource_type: The type of resources the path is run on.
+    :param resource_index: The index of the only resource the path is run on,
+      if any.
+    :param resource_path: The path to run on the resources, if any.
+    :return: A dictionary of the `resource_type`, `resource_index` and
+      compiled `resource_parser` (or None) of the path.
+    """
+    return {
+        "resource_type": resource_type,
+        "resource_index": resource_index,
+        "resource_parser": compile_fhir_path(resource_path) if resource_path else None,
+    }
+
+
+def split_resource_path(path: str) -> tuple[int | None, str] | None:
+    """
+    Given the rest of a FHIRpath that selects the bundle's resources of one
+    type, checks whether it gives the same result when run on the list of those
+    resources, and splits it into the index of the resource it selects (if
+    any) and the path to run on the resources. This is not the case for paths
+    that refer back to the bundle or to a variable, or that are combined with
+    another path by an operator (whose operands are run on the bundle).
+
+    :param path: The rest of the FHIRpath, following the resource selection.
+    :return: A tuple of the resource index and the path without its leading
+      ".", or None if the path must be run on the whole bundle.
+    """
+    if any(
+        text in path for text in ("Bundle", "%", "resolve", DIBBS_REFERENCE_SIGNIFIER)
+    ):
+        return None
+
+    # Reduce the path to the members and functions it invokes at its top level
+    outline = []
+    depth = 0
+    for character in re.sub(r"'(?:[^'\\]|\\.)*'", "''", path):
+        if character == ")":
+            depth -= 1
+        if depth == 0:
+            outline.append(character)
+        if character == "(":
+            depth += 1
+        if depth < 0:
+            return None
+    outline = "".join(outline)
+
+    match = RESOURCE_PATH_OUTLINE.match(outline)
+    if depth != 0 or not match:
+        return None
+    if not RESOURCE_PATH_FUNCTIONS.issuperset(re.findall(r"(\w+)\(\)", outline)):
+        return None
+    resource_index = match.group(1)
+    if resource_index is None:
+        return None, path.removeprefix(".")
+    return int(resource_index[1:-1]), path[len(resource_index) :].removeprefix(".")
+
+
+def compile_fhir_path(fhir_path: str):
+    """
+    Compiles a FHIRpath. Paths made only of members, indexes and `first()`
+    calls (such as `Observation.code.coding[0].display`) are compiled to read
+    the fields they name directly from the resource's dictionaries, giving the
+    same result as FHIRpath would; any other path is compiled with fhirpathpy.
+
+    :param fhir_path: The FHIRpath to compile.
+    :return: A function that takes a resource, or a list of resources, and
+      returns the list of values the path selects.
+    """
+    steps = []
+    for position, segment in enumerate(fhir_path.split(".")):
+        if segment == "first()" and position > 0:
+            steps.append(("first", None))
+            continue
+        match = SIMPLE_FHIR_PATH_STEP.fullmatch(segment)
+        if not match or match.group(1) in FHIR_PATH_KEYWORDS:
+            return fhirpathpy.compile(fhir_path)
+        steps.append(("member", match.group(1)))
+        for index in re.findall(r"\d+", match.group(2)):
+            steps.append(("index", int(index)))
+    return partial(evaluate_simple_fhir_path, tuple(steps))
+
+
+def evaluate_simple_fhir_path(steps: tuple, resource) -> list:
+    """
+    Evaluates a FHIRpath compiled by `compile_fhir_path` into a list of steps
+    on a resource, following the rules fhirpathpy applies to the same path.
+
+    :param steps: The `("member", name)`, `("index", index)` and
+      `("first", None)` steps of the path.
+    :param resource: The resource, or list of resources, to evaluate the path
+      on.
+    :return: The list of values the path selects.
+    """
+    if isinstance(resource, list):
+        values = resource
+    else:
+        values = [] if resource is None else [resource]
+
+    for position, (step, argument) in enumerate(steps):
+        if step == "index":
+            values = values[argument : argument + 1]
+        elif step == "first":
+            values = values[:1]
+        elif position == 0 and argument[0] == argument[0].upper():
+            # A capitalized first member selects resources of that type, and
+            # raises a KeyError for dictionaries with no `resourceType`
+            try:
+                values = [
+                    value for value in values if value["resourceType"] == argument
+                ]
+            except TypeError:
+                values = get_fhir_members(values, argument)
+        else:
+            values = get_fhir_members(values, argument)
+    return to_fhir_path_result(values)
+
+
+def get_fhir_members(values: list, member: str) -> list:
+    """
+    Collects a member of each of a list of FHIR values, flattening lists and
+    including the primitive extensions held in the `_<member>` field.
+
+    :param values: The values to read the member from.
+    :param member: The name of the member.
+    :return: The list of the members' values.
+    """
+    members = []
+    for value in values:
+        if isinstance(value, Mapping):
+            for child in (value.get(member), value.get(f"_{member}")):
+                if isinstance(child, list):
+                    members.extend(child)
+                elif child is not None:
+                    members.append(child)
+        elif member == "length":
+            members.append(len(value))
+    return members
+
+
+def to_fhir_path_result(values: list) -> list:
+    """
+    Converts the values selected from a resource into the form fhirpathpy
+    returns them in: copied, with decimals in place of floats and without the
+    values that only hold a primitive extension.
+
+    :param values: The selected values.
+    :return: The converted values.
+    """
+    result = []
+    for value in values:
+        # Lists selected as values are returned as they are, unlike nested lists
+        if not isinstance(value, list):
+            value = to_fhir_path_value(value)
+        if not (isinstance(value, dict) and list(value.keys()) == ["extension"]):
+            result.append(value)
+    return result
+
+
+def to_fhir_path_value(value):
+    """
+    Converts a value nested in a selected value into the form fhirpathpy
+    returns it in.
+
+    :param value: The nested value.
+    :return: The converted value.
+    """
+    if isinstance(value, float):
+        return Decimal(str(value))
+    if isinstance(value, list):
+        items = [to_fhir_path_value(item) for item in value]
+        return [
+            item
+            for item in items
+            if not (isinstance(item, dict) and list(item.keys()) == ["extension"])
+        ]
+    if isinstance(value, dict):
+        return {key: to_fhir_path_value(item) for key, item in value.items()}
+    return value
+
+
+def get_property_accessors(fhir_path: str, parser) -> list | None:
+    """
+    Gets the properties a secondary field's FHIRpath reads, for the ordinary
+    property search used on data types that FHIRpath will not read as
+    resources. The properties are taken from the text fhirpathpy parsed the
+    path from, which it does not keep for paths ending in an index.
+
+    :param fhir_path: The FHIRpath of the secondary field.
+    :param parser: The compiled FHIRpath.
+    :return: The properties following the path's leading type, or None if
+      there are none to read.
+    """
+    if isinstance(parser, partial):
+        text = None if fhir_path.endswith("]") else fhir_path
+    else:
+        text = parser.parsedPath.get("children")[0].get("text")
+    return None if text is None else text.split(".")[1:]
+
+
+@lru_cache(maxsize=1024)
+def get_compiled_fhir_path(fhir_path: str):
+    """
+    Compiles a FHIRpath that is only known once a message is being parsed,
+    such as the path of a reference field with the ID of the referenced
+    resource filled in. Recently used paths are kept, since the same resource
+    is usually referenced many times.
+
+    :param fhir_path: The FHIRpath to compile.
+    :return: The compiled FHIRpath.
+    """
+    return compile_fhir_path(fhir_path)
+
+
+def group_bundle_resources(bundle) -> dict | None:
+    """
+    Groups the resources of a FHIR bundle by their type in a single pass, in
+    the order they appear in the bundle, so that paths selecting the bundle's
+    resources of one type can be run on them directly.
+
+    :param bundle: The FHIR bundle to group the resources of.
+    :return: A dictionary mapping each resource type to the list of resources
+      of that type, or None if the message is not a bundle or has a resource
+      whose type is not a plain string, which must be parsed with whole paths.
+    """
+    if not isinstance(bundle, dict) or bundle.get("resourceType") != "Bundle":
+        return None
+    resources_by_type = {}
+    for resource in get_fhir_members(get_fhir_members([bundle], "entry"), "resource"):
+        if not isinstance(resource, Mapping):
+            continue
+        resource_type = resource.get("resourceType")
+        if (resource_type is not None and not isinstance(resource_type, str)) or (
+            resource.get("_resourceType") not in (None, [])
+        ):
+            return None
+        if resource_type is not None:
+            resources_by_type.setdefault(resource_type, []).append(resource)
+    return resources_by_type
+
+
+def build_resource_index(resources_by_type: dict) -> dict:
+    """
+    Indexes the resources of a FHIR bundle by their type and ID, so that
+    referenced resources can be looked up without searching the whole bundle
+    for each reference.
+
+    :param resources_by_type: The bundle's resources, as grouped by
+      `group_bundle_resources`.
+    :return: A dictionary mapping each `(resourceType, id)` pair to the list
+      of resources in the bundle with that type and ID.
+    """
+    index = {}
+    for resource_type, resources in resources_by_type.items():
+        for resource in resources:
+            index.setdefault((resource_type, resource.get("id")), []).append(resource)
+    return index
+
+
+def apply_resource_parser(parser: dict, resources: list) -> list:
+    """
+    Runs a path compiled by `compile_resource_path` on the bundle's resources
+    of the type it selects.
+
+    :param parser: The compiled path.
+    :param resources: The bundle's resources of the path's `resource_type`.
+    :return: The list of values the path selects.
+    """
+    resource_index = parser["resource_index"]
+    if resource_index is not None:
+        resources = resources[resource_index : resource_index + 1]
+    if parser["resource_parser"] is None:
+        return to_fhir_path_result(resources)
+    return parser["resource_parser"](resources)
+
+
 def get_metadata(parsed_values: dict, schema) -> dict:
     """
     Given a dictionary of parsed values and a schema, creates a dictionary containing
@@ -263,7 +763,10 @@ def convert_to_fhir(
     :param message: The serialized contents of the message to be converted to FHIR.
     :param message_type: The type of the message.
     :param fhir_converter_url: The URL of an instance of the FHIR conversion service.
-    :return:
+    :param headers: Any headers to send with the request.
+    :param credential_manager: The credential manager used to authenticate with
+      the FHIR conversion service, if any.
+    :return: The response from the FHIR conversion service.
 
     """
     conversion_settings = {
@@ -278,17 +781,20 @@ def convert_to_fhir(
         "root_template": conversion_settings[message_type]["root_template"],
     }
     fhir_converter_url = fhir_converter_url + "/convert-to-fhir"
+    # Copy the headers, so that the token is not left on the shared default
+    headers = dict(headers)
     if credential_manager:
         access_token = credential_manager.get_access_token()
         headers["Authorization"] = f"Bearer {access_token}"
         response = http_request_with_reauth(
-            credential_manager=credential_manager,
+            cred_manager=credential_manager,
             url=fhir_converter_url,
             retry_count=3,
             request_type="POST",
             allowed_methods=["POST"],
             headers=headers,
             data=data,
+            session=get_fhir_converter_session(),
         )
     else:
         response = http_request_with_retry(
@@ -298,20 +804,41 @@ def convert_to_fhir(
             allowed_methods=["POST"],
             headers=headers,
             data=data,
+            session=get_fhir_converter_session(),
         )
 
     return response
 
 
+@cache
+def get_fhir_converter_session() -> requests.Session:
+    """
+    Gets the session shared by every request to the FHIR converter, so that its
+    connections are reused rather than opened (with a new TLS handshake) for
+    each message converted.
+
+    :return: A `requests` session holding up to `fhir_converter_pool_size`
+      connections to each host.
+    """
+    return create_session_with_retry(
+        retry_count=3,
+        allowed_methods=["POST"],
+        pool_maxsize=get_settings()["fhir_converter_pool_size"],
+    )
+
+
 credential_managers = {"azure": AzureCredentialManager, "gcp": GcpCredentialManager}
 
 
+@lru_cache(maxsize=32)
 def get_credential_manager(
     credential_manager: str, location_url: str = None
 ) -> BaseCredentialManager:
     """
     Return a credential manager for different cloud providers depending upon which
-    one the user requests via the parameter.
+    one the user requests via the parameter. Credential managers are shared by
+    every request for the same provider and location, so that their access
+    tokens are reused until they are about to expire.
 
     :param credential_manager: A string identifying which cloud credential
     manager is desired.
@@ -378,7 +905,7 @@ def clean_schema(schema: dict):
         del schema[key]
 
 
-def extract_and_apply_parsers(parsing_schema, message, response):
+def extract_and_apply_parsers(parsing_schema, message, response, parsers=None):
     """
     Helper function used to pull parsing methods for each field out of the
     passed-in schema, resolve any reference dependencies, and apply the
@@ -393,25 +920,42 @@ def extract_and_apply_parsers(parsing_schema, message, response):
     :param message: The FHIR bundle to extract values from.
     :param response: The Response object the endpoint will send back, in
       case we need to apply error status codes.
+    :param parsers: The parsers compiled from the parsing schema, if they are
+      already at hand, as when parsing many messages with one schema.
     :return: A dictionary mapping schema keys to parsed values.
     """
-    parsers = get_parsers(parsing_schema)
+    if parsers is None:
+        parsers = get_parsers(parsing_schema)
     parsed_values = {}
+    # Group the bundle's resources by type in a single pass, so that fields
+    # whose paths select resources of one type are run on those resources
+    # directly, and index them by ID on first use to resolve references
+    resources_by_type = group_bundle_resources(message)
+    resource_index = None
 
     # Iterate over each parser and make the appropriate path call
     for field, parser in parsers.items():
+        if "resource_type" not in parser:
+            primary_values = parser["primary_parser"](message)
+        elif resources_by_type is not None:
+            primary_values = apply_resource_parser(
+                parser, resources_by_type.get(parser["resource_type"], [])
+            )
+        else:
+            # Messages that are not bundles are parsed with the whole path
+            primary_values = get_compiled_fhir_path(parser["fhir_path"])(message)
+
         if "secondary_parsers" not in parser:
-            value = parser["primary_parser"](message)
-            if len(value) == 0:
+            if len(primary_values) == 0:
                 value = None
             else:
-                value = ",".join(map(str, value))
+                value = ",".join(map(str, primary_values))
             parsed_values[field] = value
 
         # Use the secondary field data structure, remembering that some
         # fhir paths might not be compiled yet
         else:
-            initial_values = parser["primary_parser"](message)
+            initial_values = primary_values
             values = []
 
             # This check allows us to use secondary schemas on fields that
@@ -444,11 +988,12 @@ def extract_and_apply_parsers(parsing_schema, message, response):
                                     tv_parser = tertiary_path_struct[
                                         "secondary_fhir_path"
                                     ]
-                                    if len(tv_parser(v)) == 0:
+                                    tv_value = tv_parser(v)
+                                    if len(tv_value) == 0:
                                         tv[tertiary_field] = None
                                     else:
                                         tv[tertiary_field] = ",".join(
-                                            map(str, tv_parser(v))
+                                            map(str, tv_value)
                                         )
                                 tertiary_values.append(tv)
                             value[secondary_field] = tertiary_values
@@ -457,11 +1002,12 @@ def extract_and_apply_parsers(parsing_schema, message, response):
                                 secondary_parser = secondary_path_struct[
                                     "secondary_fhir_path"
                                 ]
-                                if len(secondary_parser(initial_value)) == 0:
+                                secondary_value = secondary_parser(initial_value)
+                                if len(secondary_value) == 0:
                                     value[secondary_field] = None
                                 else:
                                     value[secondary_field] = ",".join(
-                                        map(str, secondary_parser(initial_value))
+                                        map(str, secondary_value)
                                     )
                             # By default, fhirpathpy will compile such that *only*
                             # actual resources can be accessed, rather than data types.
@@ -472,11 +1018,9 @@ def extract_and_apply_parsers(parsing_schema, message, response):
                             # search.
                             except KeyError:
                                 try:
-                                    accessors = (
-                                        secondary_parser.parsedPath.get("children")[0]
-                                        .get("text")
-                                        .split(".")[1:]
-                                    )
+                                    accessors = secondary_path_struct[
+                                        "property_accessors"
+                                    ]
                                     val = initial_value
                                     for acc in accessors:
                                         if "[" not in acc:
@@ -494,7 +1038,8 @@ def extract_and_apply_parsers(parsing_schema, message, response):
                     # resource that we have to look up
                     else:
                         reference_parser = secondary_path_struct["reference_path"]
-                        if len(reference_parser(initial_value)) == 0:
+                        reference_value = reference_parser(initial_value)
+                        if len(reference_value) == 0:
                             response.status_code = status.HTTP_400_BAD_REQUEST
                             return {
                                 "message": "Provided `reference_lookup` location does "
@@ -502,19 +1047,38 @@ def extract_and_apply_parsers(parsing_schema, message, response):
                                 "parsed_values": {},
                             }
                         else:
-                            reference_to_find = ",".join(
-                                map(str, reference_parser(initial_value))
-                            )
+                            reference_to_find = ",".join(map(str, reference_value))
 
                             # FHIR references are prefixed with resource type
                             reference_to_find = reference_to_find.split("/")[-1]
 
-                            # Build the resultant concatenated reference path
-                            reference_path = secondary_path_struct[
-                                "secondary_fhir_path"
-                            ].replace(DIBBS_REFERENCE_SIGNIFIER, reference_to_find)
-                            reference_path = fhirpathpy.compile(reference_path)
-                            referenced_value = reference_path(message)
+                            if (
+                                "resource_type" in secondary_path_struct
+                                and resources_by_type is not None
+                            ):
+                                # Look up the referenced resources by type and
+                                # ID, indexing the bundle on first use
+                                if resource_index is None:
+                                    resource_index = build_resource_index(
+                                        resources_by_type
+                                    )
+                                referenced_value = apply_resource_parser(
+                                    secondary_path_struct,
+                                    resource_index.get(
+                                        (
+                                            secondary_path_struct["resource_type"],
+                                            reference_to_find,
+                                        ),
+                                        [],
+                                    ),
+                                )
+                            else:
+                                # Build the resultant concatenated reference path
+                                reference_path = secondary_path_struct[
+                                    "secondary_fhir_path"
+                                ].replace(DIBBS_REFERENCE_SIGNIFIER, reference_to_find)
+                                reference_path = get_compiled_fhir_path(reference_path)
+                                referenced_value = reference_path(message)
                             if len(referenced_value) == 0:
                                 value[secondary_field] = None
                             else:
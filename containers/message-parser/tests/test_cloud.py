@@ -154,6 +154,44 @@ def test_azure_credential_manager_force_refresh_token(mock_az_creds):
     assert access_token == az_access_token_str2
 
 
+@mock.patch("app.cloud.azure.threading.Thread")
+@mock.patch("app.cloud.azure.DefaultAzureCredential")
+def test_azure_credential_manager_refresh_ahead(mock_az_creds, mock_thread):
+    mock_az_creds_instance = mock_az_creds.return_value
+    az_resource_location = "https://some-url"
+
+    az_access_token_str1 = "some-token1"
+    az_access_token_exp1 = datetime.now(timezone.utc).timestamp() + 100
+    az_access_token1 = mock.Mock(
+        token=az_access_token_str1, expires_on=az_access_token_exp1
+    )
+    az_access_token_str2 = "some-token2"
+    az_access_token_exp2 = datetime.now(timezone.utc).timestamp() + 1000
+    az_access_token2 = mock.Mock(
+        token=az_access_token_str2, expires_on=az_access_token_exp2
+    )
+    mock_az_creds_instance.get_token = mock.Mock(
+        side_effect=[az_access_token1, az_access_token2]
+    )
+
+    cred_manager = AzureCredentialManager(
+        az_resource_location, refresh_ahead_seconds=300
+    )
+
+    # A token about to expire is still returned, while a new one is requested
+    # in the background, only once at a time
+    assert cred_manager.get_access_token() == az_access_token_str1
+    assert cred_manager.get_access_token() == az_access_token_str1
+    assert cred_manager.get_access_token() == az_access_token_str1
+    mock_thread.assert_called_once()
+    assert mock_az_creds_instance.get_token.call_count == 1
+
+    mock_thread.call_args.kwargs["target"]()
+    assert cred_manager.get_access_token() == az_access_token_str2
+    assert mock_az_creds_instance.get_token.call_count == 2
+    assert mock_az_creds.call_count == 1
+
+
 def test_azure_need_new_token_without_token():
     cred_manager = AzureCredentialManager("https://some-url")
     assert cred_manager._need_new_token()
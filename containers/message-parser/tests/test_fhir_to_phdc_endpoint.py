@@ -1,3 +1,4 @@
+import io
 import uuid
 from datetime import date
 from unittest.mock import patch
@@ -5,7 +6,10 @@ from unittest.mock import patch
 import pytest
 from app import utils
 from app.main import app
+from app.phdc.builder import PHDCBuilder
+from fastapi import Response
 from fastapi.testclient import TestClient
+from lxml import etree as ET
 
 client = TestClient(app)
 
@@ -31,3 +35,53 @@ def test_endpoint(fhir_bundle, expected_successful_response):
     print(actual_response.text)
     assert actual_response.status_code == 200
     assert actual_response.text == expected_successful_response
+
+
+@patch.object(uuid, "uuid4", lambda: "495669c7-96bf-4573-9dd8-59e745e05576")
+@patch.object(utils, "get_datetime_now", lambda: date(2010, 12, 15))
+def test_endpoint_stream(fhir_bundle):
+    test_request = {
+        "phdc_report_type": "case_report",
+        "message": fhir_bundle,
+    }
+    built_response = client.post("/fhir_to_phdc", json=test_request)
+    streamed_response = client.post(
+        "/fhir_to_phdc", json={**test_request, "stream": True}
+    )
+    assert streamed_response.status_code == 200
+    assert streamed_response.headers["content-type"] == "application/xml"
+
+    # The streamed PHDC is the same XML, apart from whitespace and where
+    # namespaces are declared
+    def canonicalize(xml):
+        parser = ET.XMLParser(remove_blank_text=True)
+        return ET.tostring(ET.fromstring(xml, parser), method="c14n", exclusive=True)
+
+    assert streamed_response.content.startswith(
+        b"<?xml version='1.0' encoding='utf-8'?>\n<?xml-stylesheet"
+    )
+    assert canonicalize(streamed_response.content) == canonicalize(
+        built_response.content
+    )
+
+
+def test_builder_write(fhir_bundle):
+    input_data = utils.transform_to_phdc_input_data(
+        utils.extract_and_apply_parsers(
+            utils.load_parsing_schema("phdc_case_report_schema.json"),
+            fhir_bundle,
+            Response(),
+        )
+    )
+    builder = PHDCBuilder()
+    builder.set_input_data(input_data)
+    chunks = list(builder.iter_xml())
+
+    # Each element of the header and each section of the body is yielded
+    # as soon as it is written
+    assert len(chunks) == 12 + 3 + 1
+    assert chunks[-1].endswith(b"</ClinicalDocument>\n")
+
+    output = io.BytesIO()
+    builder.write(output)
+    ET.fromstring(output.getvalue())
@@ -0,0 +1,254 @@
+import asyncio
+import json
+from unittest import mock
+
+import pytest
+from app.main import app
+from fastapi.testclient import TestClient
+
+from tests.test_parse_message_endpoint import (
+    expected_reference_response,
+    expected_successful_response,
+    expected_successful_response_floats,
+)
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def fhir_bundle(read_json_from_phdi_test_assets):
+    return read_json_from_phdi_test_assets("patient_bundle.json")
+
+
+@pytest.fixture
+def fhir_bundle_w_float(read_json_from_phdi_test_assets):
+    return read_json_from_phdi_test_assets("patient_bundle_w_floats.json")
+
+
+@pytest.fixture
+def reference_bundle(read_json_from_phdi_test_assets):
+    return read_json_from_phdi_test_assets("patient_bundle_w_labs.json")
+
+
+@pytest.fixture
+def test_reference_schema(read_schema_from_default_schemas):
+    return read_schema_from_default_schemas("test_reference_schema.json")
+
+
+def read_results(response):
+    results = [json.loads(line) for line in response.text.splitlines()]
+    return sorted(results, key=lambda result: result["index"])
+
+
+def test_parse_messages_json(fhir_bundle, fhir_bundle_w_float):
+    request = {
+        "message_format": "fhir",
+        "parsing_schema_name": "test_schema.json",
+        "messages": [fhir_bundle, fhir_bundle_w_float] * 5,
+    }
+
+    actual_response = client.post("/parse_messages", json=request)
+    assert actual_response.status_code == 200
+    assert actual_response.headers["content-type"] == "application/x-ndjson"
+    assert read_results(actual_response) == [
+        {
+            "index": index,
+            "status_code": 200,
+            "response": expected_successful_response_floats
+            if index % 2
+            else expected_successful_response,
+        }
+        for index in range(10)
+    ]
+
+
+def test_parse_messages_ndjson(test_reference_schema, reference_bundle):
+    options = {"message_format": "fhir", "parsing_schema": test_reference_schema}
+    lines = [
+        json.dumps(options),
+        json.dumps(reference_bundle),
+        "{not json",
+        "",
+        json.dumps(["not", "a", "message"]),
+        json.dumps(reference_bundle),
+    ]
+
+    actual_response = client.post(
+        "/parse_messages",
+        content="\n".join(lines),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert actual_response.status_code == 200
+    results = read_results(actual_response)
+
+    # Blank lines are skipped, and a bad message does not affect the others
+    assert [result["status_code"] for result in results] == [200, 400, 400, 200]
+    assert results[0]["response"] == expected_reference_response
+    assert results[1]["response"]["message"].startswith("The message is not valid JSON")
+    assert results[2]["response"] == {
+        "message": "A message must be a JSON string or object.",
+        "parsed_values": {},
+    }
+    assert results[3] == {**results[0], "index": 3}
+
+
+@mock.patch("starlette.requests.Request.body", new_callable=mock.AsyncMock)
+def test_parse_messages_ndjson_streamed(
+    patched_body, test_reference_schema, reference_bundle
+):
+    options = {"message_format": "fhir", "parsing_schema": test_reference_schema}
+    body = "\n".join(
+        [json.dumps(options)] + [json.dumps(reference_bundle)] * 3 + [""]
+    ).encode()
+    # lines are split across the messages the request body is received in
+    chunks = [body[start : start + 1000] for start in range(0, len(body), 1000)]
+    sent = []
+
+    async def receive():
+        if chunks:
+            return {
+                "type": "http.request",
+                "body": chunks.pop(0),
+                "more_body": bool(chunks),
+            }
+        # the client stays connected until the response is complete
+        await asyncio.sleep(60)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/parse_messages",
+        "raw_path": b"/parse_messages",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/x-ndjson")],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+    asyncio.run(asyncio.wait_for(app(scope, receive, send), 30))
+
+    assert sent[0]["status"] == 200
+    content = b"".join(message.get("body", b"") for message in sent[1:])
+    results = sorted(
+        (json.loads(line) for line in content.splitlines()),
+        key=lambda result: result["index"],
+    )
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert all(result["response"] == expected_reference_response for result in results)
+
+    # the messages are read from the request as they are parsed, rather than
+    # from the whole body
+    patched_body.assert_not_called()
+
+
+@mock.patch("app.main.convert_to_fhir")
+@mock.patch("app.main.get_credential_manager")
+def test_parse_messages_non_fhir(
+    patched_get_credential_manager, patched_convert_to_fhir, fhir_bundle
+):
+    request = {
+        "message_format": "hl7v2",
+        "message_type": "elr",
+        "parsing_schema_name": "test_schema.json",
+        "fhir_converter_url": "some-url",
+        "credential_manager": "azure",
+        "messages": ["some-hl7v2-elr-message", "some-other-hl7v2-elr-message"],
+    }
+
+    patched_get_credential_manager.return_value = "some-credential-manager"
+    convert_to_fhir_response = mock.Mock()
+    convert_to_fhir_response.status_code = 200
+    convert_to_fhir_response.json.return_value = {"FhirResource": fhir_bundle}
+    failed_response = mock.Mock()
+    failed_response.status_code = 400
+    failed_response.text = "some error message returned by the FHIR converter"
+    patched_convert_to_fhir.side_effect = lambda message, **kwargs: (
+        convert_to_fhir_response
+        if message == "some-hl7v2-elr-message"
+        else failed_response
+    )
+
+    actual_response = client.post("/parse_messages", json=request)
+    assert actual_response.status_code == 200
+    assert read_results(actual_response) == [
+        {"index": 0, "status_code": 200, "response": expected_successful_response},
+        {
+            "index": 1,
+            "status_code": 400,
+            "response": {
+                "message": f"Failed to convert to FHIR: {failed_response.text}",
+                "parsed_values": {},
+            },
+        },
+    ]
+
+    # The credential manager is shared by every message
+    patched_get_credential_manager.assert_called_once_with(
+        credential_manager="azure", location_url="some-url"
+    )
+    patched_convert_to_fhir.assert_any_call(
+        message="some-hl7v2-elr-message",
+        message_type="elr",
+        fhir_converter_url="some-url",
+        credential_manager="some-credential-manager",
+    )
+
+
+@mock.patch("app.main.extract_and_apply_parsers")
+def test_parse_messages_error(patched_extract_and_apply_parsers, fhir_bundle):
+    patched_extract_and_apply_parsers.side_effect = ValueError("some error")
+    request = {
+        "message_format": "fhir",
+        "parsing_schema_name": "test_schema.json",
+        "messages": [fhir_bundle],
+    }
+
+    actual_response = client.post("/parse_messages", json=request)
+    assert actual_response.status_code == 200
+    assert read_results(actual_response) == [
+        {
+            "index": 0,
+            "status_code": 500,
+            "response": {
+                "message": "Message parser error: some error",
+                "parsed_values": {},
+            },
+        }
+    ]
+
+
+def test_parse_messages_schema_not_found(fhir_bundle):
+    request = {
+        "message_format": "fhir",
+        "parsing_schema_name": "some-schema-that-does-not-exist.json",
+        "messages": [fhir_bundle],
+    }
+
+    actual_response = client.post("/parse_messages", json=request)
+    assert actual_response.status_code == 400
+    assert actual_response.json() == {
+        "message": "A schema with the name 'some-schema-that-does-not-exist.json' "
+        "could not be found.",
+        "parsed_values": {},
+    }
+
+
+def test_parse_messages_invalid_options():
+    actual_response = client.post(
+        "/parse_messages",
+        content=json.dumps(
+            {"message_format": "hl7v2", "parsing_schema_name": "test_schema.json"}
+        )
+        + "\n",
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert actual_response.status_code == 422
+    assert actual_response.json()["detail"][0]["msg"] == (
+        "Value error, when the message format is not FHIR then the message type "
+        "must be included."
+    )
@@ -148,3 +148,37 @@ def test_upload_schema_no_secondary():
         Path(__file__).parent.parent / "app" / "custom_schemas" / test_schema_name
     )
     parsing_schema.unlink()
+
+
+def test_upload_schema_overwrite_is_loaded():
+    test_schema_name = "test_schema2.json"
+    for fhir_path in ["Patient.id", "Patient.gender"]:
+        request_body = {
+            "parsing_schema": {
+                "my_field": {
+                    "fhir_path": fhir_path,
+                    "data_type": "string",
+                    "nullable": True,
+                }
+            },
+            "overwrite": True,
+        }
+        response = client.put(f"/schemas/{test_schema_name}", json=request_body)
+        assert response.status_code in (200, 201)
+
+        # The uploaded schema replaces the cached one at once.
+        response = client.get(f"/schemas/{test_schema_name}")
+        assert response.status_code == 200
+        assert response.json()["parsing_schema"]["my_field"]["fhir_path"] == fhir_path
+
+    # Delete the test schema to avoid conflicts with other tests.
+    parsing_schema = (
+        Path(__file__).parent.parent / "app" / "custom_schemas" / test_schema_name
+    )
+    parsing_schema.unlink()
+
+
+def test_parser_cache():
+    response = client.get("/parser_cache")
+    assert response.status_code == 200
+    assert set(response.json()) == {"size", "max_size", "hits", "misses", "hit_rate"}
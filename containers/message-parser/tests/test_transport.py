@@ -1,7 +1,7 @@
 from unittest import mock
 
 import pytest
-from app.transport import http_request_with_retry
+from app.transport import create_session_with_retry, http_request_with_retry
 from requests import Session
 
 
@@ -77,3 +77,23 @@ def test_http_request_with_retry_unsupported_action():
         http_request_with_retry(
             http_url, http_retry_count, http_action, [http_action], http_header
         )
+
+
+def test_http_request_with_retry_session():
+    http_url = "https://some-url"
+    http_header = {"some-header": "some-header-value"}
+    http_data = {"some-data": "some-data-value"}
+
+    session = create_session_with_retry(3, ["POST"], pool_maxsize=4)
+    adapter = session.get_adapter(http_url)
+    assert adapter.max_retries.total == 3
+    assert adapter._pool_maxsize == 4
+
+    # The session passed in is used in place of a new one
+    with mock.patch.object(session, "post") as mock_post:
+        response = http_request_with_retry(
+            http_url, 3, "POST", ["POST"], http_header, http_data, session=session
+        )
+
+    mock_post.assert_called_once_with(url=http_url, headers=http_header, json=http_data)
+    assert response == mock_post.return_value
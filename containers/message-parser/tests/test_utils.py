@@ -3,18 +3,29 @@ import os
 from pathlib import Path
 from unittest import mock
 
+import fhirpathpy
 import pytest
 from app.config import get_settings
 from app.utils import (
+    apply_resource_parser,
+    build_resource_index,
+    clear_parser_cache,
+    compile_bundle_path,
+    compile_fhir_path,
     convert_to_fhir,
+    extract_and_apply_parsers,
     field_metadata,
     freeze_parsing_schema,
     freeze_parsing_schema_helper,
     get_credential_manager,
+    get_fhir_converter_session,
     get_metadata,
+    get_parser_cache_stats,
     get_parsers,
+    group_bundle_resources,
     load_parsing_schema,
     search_for_required_values,
+    split_resource_path,
 )
 from frozendict import frozendict
 
@@ -42,16 +53,123 @@ def test_load_parsing_schema_fail():
 @mock.patch("app.utils.fhirpathpy")
 def test_get_parsers(patched_fhirpathpy):
     parsing_schema = load_parsing_schema("test_reference_schema.json")
-    get_parsers.cache_clear()
-    get_parsers(frozendict(parsing_schema))
+    clear_parser_cache()
+    parsers = get_parsers(frozendict(parsing_schema))
+
+    # Paths selecting the bundle's resources of one type are compiled to run on
+    # those resources, and paths made only of members, indexes and `first()`
+    # calls are read directly, leaving only the lab filter to fhirpathpy
+    patched_fhirpathpy.compile.assert_called_once_with(
+        "where(category.coding.code='laboratory')"
+    )
+    assert parsers["first_name"]["resource_type"] == "Patient"
+    assert parsers["labs"]["resource_type"] == "Observation"
+    assert (
+        parsers["labs"]["secondary_parsers"]["ordering_provider"]["resource_type"]
+        == "Organization"
+    )
+    clear_parser_cache()
+
+
+@mock.patch("app.utils.get_settings")
+def test_get_parsers_cache(patched_get_settings):
+    patched_get_settings.return_value = {"parser_cache_max_size": 2}
+    clear_parser_cache()
+    schemas = [
+        frozendict({f"field_{i}": frozendict({"fhir_path": f"Patient.id{i}"})})
+        for i in range(3)
+    ]
+
+    # Schemas with the same content share parsers, whatever their key order
+    parsers = get_parsers(schemas[0])
+    assert get_parsers(frozendict(dict(schemas[0]))) is parsers
+    both_fields = {
+        "a": frozendict({"fhir_path": "Patient.id"}),
+        "b": frozendict({"fhir_path": "Patient.gender"}),
+    }
+    assert get_parsers(frozendict(both_fields)) is get_parsers(
+        frozendict(reversed(both_fields.items()))
+    )
+
+    # The least recently used schema is evicted beyond the maximum size
+    get_parsers(schemas[0])
+    get_parsers(schemas[1])
+    get_parsers(schemas[2])
+    assert get_parsers(schemas[0]) is not parsers
+    assert get_parser_cache_stats() == {
+        "size": 2,
+        "max_size": 2,
+        "hits": 3,
+        "misses": 5,
+        "hit_rate": 0.375,
+    }
+    clear_parser_cache()
+    assert get_parser_cache_stats()["hits"] == 0
+
+
+@pytest.mark.parametrize(
+    "fhir_path",
+    [
+        "Patient.name.given",
+        "Patient.name[0].given[1]",
+        "Patient.name.first().family",
+        "Patient.telecom.value",
+        "Patient.extension.valueDecimal",
+        "Patient.id.length",
+        "Address.line",
+        "name.given",
+    ],
+)
+def test_compile_fhir_path_matches_fhirpathpy(fhir_path):
+    patient = {
+        "resourceType": "Patient",
+        "id": "p1",
+        "name": [
+            {"family": "Doe", "given": ["John", "Danger"]},
+            {"given": ["Johnny"], "_given": [{"extension": [{"url": "nickname"}]}]},
+        ],
+        "telecom": [{"value": "555-0100"}, {"_value": {"id": "unknown"}}],
+        "extension": [{"valueDecimal": 40.5}, {"valueDecimal": 1}],
+    }
 
-    expected_number_of_calls = 0
-    for field, field_definition in parsing_schema.items():
-        expected_number_of_calls += 1
-        if "secondary_schema" in field_definition:
-            expected_number_of_calls += len(field_definition["secondary_schema"])
+    assert compile_fhir_path(fhir_path)(patient) == fhirpathpy.evaluate(
+        patient, fhir_path
+    )
+    with pytest.raises(KeyError):
+        compile_fhir_path("Address.line")({"line": ["123 Main St"]})
+
+
+@pytest.mark.parametrize("schema_name", ["ecr.json", "extended.json", "core.json"])
+def test_compile_bundle_path_matches_fhirpathpy(
+    schema_name, read_json_from_phdi_test_assets
+):
+    bundle = read_json_from_phdi_test_assets("patient_bundle_w_labs.json")
+    resources_by_type = group_bundle_resources(bundle)
+
+    for field, field_definition in load_parsing_schema(schema_name).items():
+        parser = compile_bundle_path(field_definition["fhir_path"])
+        if "resource_type" in parser:
+            values = apply_resource_parser(
+                parser, resources_by_type.get(parser["resource_type"], [])
+            )
+        else:
+            values = parser["primary_parser"](bundle)
+        assert values == fhirpathpy.evaluate(bundle, field_definition["fhir_path"]), (
+            field
+        )
 
-    assert len(patched_fhirpathpy.compile.call_args_list) == expected_number_of_calls
+
+def test_split_resource_path():
+    assert split_resource_path("") == (None, "")
+    assert split_resource_path("[0].location[0].id") == (0, "location[0].id")
+    assert split_resource_path(
+        ".where(code.coding.code = '75274-1').value.coding.display"
+    ) == (None, "where(code.coding.code = '75274-1').value.coding.display")
+    # Paths whose results depend on the bundle are left to run on it
+    assert split_resource_path(".name | telecom.value") is None
+    assert split_resource_path(".Patient.name") is None
+    assert split_resource_path(".where(id = %resource.id)") is None
+    assert split_resource_path(".ofType(Patient)") is None
 
 
 def test_search_for_required_values_success():
@@ -106,6 +224,21 @@ def test_get_credential_manager_gcp():
     assert hasattr(actual_result, "scoped_credentials")
 
 
+def test_get_credential_manager_shared():
+    get_credential_manager.cache_clear()
+    azure_manager = get_credential_manager("azure", "Some URL")
+    assert get_credential_manager("azure", "Some URL") is azure_manager
+    assert get_credential_manager("azure", "Some other URL") is not azure_manager
+    assert get_credential_manager("gcp") is get_credential_manager("gcp")
+    get_credential_manager.cache_clear()
+
+
+def test_get_fhir_converter_session():
+    session = get_fhir_converter_session()
+    assert get_fhir_converter_session() is session
+    assert session.get_adapter("https://some-url")._pool_maxsize == 10
+
+
 def test_get_credential_manager_invalid():
     expected_result = None
     actual_result = get_credential_manager("myown")
@@ -125,7 +258,7 @@ def test_convert_fhir_cred_manager(patched_requests_with_reauth):
     }
     convert_to_fhir(**parameters)
     patched_requests_with_reauth.assert_called_with(
-        credential_manager=credential_manager,
+        cred_manager=credential_manager,
         url="some FHIR converter URL/convert-to-fhir",
         retry_count=3,
         request_type="POST",
@@ -136,6 +269,7 @@ def test_convert_fhir_cred_manager(patched_requests_with_reauth):
             "input_type": "hl7v2",
             "root_template": "ORU_R01",
         },
+        session=get_fhir_converter_session(),
     )
 
 
@@ -159,6 +293,7 @@ def test_convert_fhir_no_cred_manager(patched_requests_with_retryh):
             "input_type": "hl7v2",
             "root_template": "ORU_R01",
         },
+        session=get_fhir_converter_session(),
     )
 
 
@@ -232,3 +367,100 @@ def test_freeze_parsing_schema_helper():
     assert isinstance(output["fiz"], frozendict)
     assert isinstance(output["fiz"]["fiz"], frozendict)
     assert isinstance(output["foo"], str)
+
+
+def test_group_bundle_resources_and_build_resource_index():
+    practitioner = {"resourceType": "Practitioner", "id": "1"}
+    duplicate = {"resourceType": "Practitioner", "id": "1", "active": True}
+    organization = {"resourceType": "Organization", "id": "1"}
+    bundle = {
+        "resourceType": "Bundle",
+        "entry": [
+            {"resource": practitioner},
+            {"resource": organization},
+            {"resource": duplicate},
+            {"fullUrl": "urn:uuid:no-resource"},
+        ],
+    }
+
+    resources_by_type = group_bundle_resources(bundle)
+
+    assert resources_by_type == {
+        "Practitioner": [practitioner, duplicate],
+        "Organization": [organization],
+    }
+    assert build_resource_index(resources_by_type) == {
+        ("Practitioner", "1"): [practitioner, duplicate],
+        ("Organization", "1"): [organization],
+    }
+    assert group_bundle_resources({"resourceType": "Patient", "entry": []}) is None
+
+
+def test_extract_and_apply_parsers_resolves_references_through_index():
+    parsing_schema = freeze_parsing_schema(
+        {
+            "labs": {
+                "fhir_path": "Bundle.entry.resource.where(resourceType = "
+                "'Observation')",
+                "secondary_schema": {
+                    "performer": {
+                        "fhir_path": "Bundle.entry.resource.where(resourceType = "
+                        "'Organization').where(id = '#REF#').name",
+                        "reference_lookup": "Observation.performer.first().reference",
+                    },
+                    "performer_resource": {
+                        "fhir_path": "Bundle.entry.resource.where(resourceType = "
+                        "'Organization').where(id = '#REF#')",
+                        "reference_lookup": "Observation.performer.first().reference",
+                    },
+                    "performer_first_phone": {
+                        "fhir_path": "Bundle.entry.resource.where(resourceType = "
+                        "'Organization').where(id = '#REF#').telecom.value.first()"
+                        " | Bundle.entry.resource.where(id = '#REF#').id",
+                        "reference_lookup": "Observation.performer.first().reference",
+                    },
+                },
+            }
+        }
+    )
+    organization = {
+        "resourceType": "Organization",
+        "id": "lab",
+        "name": "Lab",
+        "telecom": [{"value": "555-0100"}],
+    }
+    bundle = {
+        "resourceType": "Bundle",
+        "entry": [
+            {
+                "resource": {
+                    "resourceType": "Observation",
+                    "performer": [{"reference": "Organization/lab"}],
+                }
+            },
+            {
+                "resource": {
+                    "resourceType": "Observation",
+                    "performer": [{"reference": "Organization/missing"}],
+                }
+            },
+            {"resource": organization},
+        ],
+    }
+
+    parsed_values = extract_and_apply_parsers(parsing_schema, bundle, mock.Mock())
+
+    assert parsed_values == {
+        "labs": [
+            {
+                "performer": "Lab",
+                "performer_resource": str(organization),
+                "performer_first_phone": "555-0100,lab",
+            },
+            {
+                "performer": None,
+                "performer_resource": None,
+                "performer_first_phone": None,
+            },
+        ]
+    }
@@ -1,8 +1,25 @@
+import gzip
+import io
+import os
+import zlib
+from collections.abc import Callable
 from pathlib import Path
 from typing import Literal
 
 from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional speedup
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstd support is optional
+    zstandard = None
 
 # create a class with the DIBBs default Creative Commons Zero v1.0 and
 # MIT license to be used by the BaseService class
@@ -32,6 +49,297 @@ class StatusResponse(BaseModel):
     status: Literal["OK"]
 
 
+# Content encodings the services can compress and decompress, in order of
+# preference when negotiating with a client
+SUPPORTED_CONTENT_ENCODINGS = (["zstd"] if zstandard else []) + ["gzip"]
+
+# Bodies smaller than this are not worth the cost of compressing
+MINIMUM_COMPRESSION_SIZE = 1024
+
+# The largest a compressed request body may be decompressed to, so that a small
+# body cannot expand to exhaust the service's memory; set the
+# MAX_DECOMPRESSED_REQUEST_SIZE environment variable to change it
+MAXIMUM_DECOMPRESSED_SIZE = int(
+    os.environ.get("MAX_DECOMPRESSED_REQUEST_SIZE", 256 * 1024 * 1024)
+)
+
+
+class DecompressedSizeError(ValueError):
+    """
+    Raised when a body decompresses to more than the allowed size.
+    """
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    A JSON response rendered with orjson when it is installed, which is
+    considerably faster than the standard library for large FHIR bundles.
+    Falls back to the standard JSON rendering for content orjson cannot
+    serialize.
+    """
+
+    def render(self, content) -> bytes:
+        """
+        Serializes the response content to JSON bytes.
+
+        :param content: The content of the response.
+        :return: The JSON-encoded content.
+        """
+        if orjson is not None:
+            try:
+                return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                pass
+        return super().render(content)
+
+
+def compress_content(content: bytes, encoding: str) -> bytes:
+    """
+    Compresses a request or response body with one of the supported content
+    encodings.
+
+    :param content: The body to compress.
+    :param encoding: The content encoding to apply, either `gzip` or `zstd`.
+    :return: The compressed body.
+    """
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor().compress(content)
+    if encoding == "gzip":
+        return gzip.compress(content, compresslevel=6)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def decompress_content(
+    content: bytes, encoding: str, max_size: int | None = None
+) -> bytes:
+    """
+    Decompresses a request or response body compressed with one of the
+    supported content encodings.
+
+    :param content: The body to decompress.
+    :param encoding: The content encoding of the body, either `gzip` or `zstd`.
+    :param max_size: Optionally, the most bytes the body may decompress to.
+      Decompression stops as soon as the limit is passed.
+    :raises DecompressedSizeError: If the body decompresses to more than
+      `max_size` bytes.
+    :return: The decompressed body.
+    """
+    if encoding == "zstd" and zstandard is not None:
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            io.BytesIO(content), read_across_frames=True
+        )
+    elif encoding == "gzip":
+        reader = gzip.GzipFile(fileobj=io.BytesIO(content))
+    else:
+        raise ValueError(f"Unsupported content encoding: {encoding}")
+    with reader:
+        if max_size is None:
+            return reader.read()
+        decompressed = reader.read(max_size + 1)
+    if len(decompressed) > max_size:
+        raise DecompressedSizeError(f"Body decompresses to more than {max_size} bytes.")
+    return decompressed
+
+
+def negotiate_content_encoding(accept_encoding: str) -> str | None:
+    """
+    Picks the preferred supported content encoding a client accepts, based on
+    the value of its `Accept-Encoding` header.
+
+    :param accept_encoding: The value of an `Accept-Encoding` header.
+    :return: The content encoding to use, or None if the client accepts none
+      of the supported encodings.
+    """
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip()] = quality
+    for encoding in SUPPORTED_CONTENT_ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class _StreamCompressor:
+    """
+    Incrementally compresses the chunks of a (possibly streamed) response
+    body, flushing after each chunk so streamed output stays incremental.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor().compressobj()
+        else:
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk: bytes, final: bool) -> bytes:
+        """
+        Compresses one chunk of the body.
+
+        :param chunk: The chunk of the body to compress.
+        :param final: Whether this is the last chunk of the body.
+        :return: The compressed bytes to send for this chunk.
+        """
+        data = self._compressor.compress(chunk)
+        if final:
+            return data + self._compressor.flush()
+        if self.encoding == "zstd":
+            return data + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return data + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+# The errors raised when decompressing a body that is not valid in its encoding
+MALFORMED_BODY_ERRORS = (OSError, EOFError, zlib.error) + (
+    (zstandard.ZstdError,) if zstandard is not None else ()
+)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that decompresses request bodies sent with a supported
+    `Content-Encoding` and compresses response bodies with the best encoding
+    the client lists in `Accept-Encoding`. Every response advertises the
+    request encodings the service accepts in its own `Accept-Encoding` header,
+    so callers can start compressing the bodies they send. Clients that send
+    and accept plain bodies are unaffected. Request bodies that decompress to
+    more than `maximum_decompressed_size` bytes are rejected with a `413`, and
+    bodies that are not valid in their encoding with a `400`.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = MINIMUM_COMPRESSION_SIZE,
+        maximum_decompressed_size: int = MAXIMUM_DECOMPRESSED_SIZE,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.maximum_decompressed_size = maximum_decompressed_size
+
+    async def __call__(self, scope, receive, send):
+        """
+        Handles one ASGI connection, applying compression to HTTP requests.
+        """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        request_encoding = headers.get("content-encoding", "").strip().lower()
+        if request_encoding not in ("", "identity"):
+            if request_encoding not in SUPPORTED_CONTENT_ENCODINGS:
+                response = PlainTextResponse(
+                    f"Unsupported Content-Encoding: {request_encoding}",
+                    status_code=415,
+                    headers={"Accept-Encoding": ", ".join(SUPPORTED_CONTENT_ENCODINGS)},
+                )
+                await response(scope, receive, send)
+                return
+            try:
+                scope, receive = await self._decompress_request(
+                    scope, receive, request_encoding
+                )
+            except DecompressedSizeError as error:
+                response = PlainTextResponse(str(error), status_code=413)
+                await response(scope, receive, send)
+                return
+            except MALFORMED_BODY_ERRORS:
+                response = PlainTextResponse(
+                    f"Malformed {request_encoding} request body", status_code=400
+                )
+                await response(scope, receive, send)
+                return
+
+        response_encoding = negotiate_content_encoding(
+            headers.get("accept-encoding", "")
+        )
+        await self.app(scope, receive, self._wrap_send(send, response_encoding))
+
+    async def _decompress_request(self, scope, receive, encoding: str):
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = decompress_content(
+            b"".join(chunks), encoding, self.maximum_decompressed_size
+        )
+
+        scope = dict(scope)
+        scope["headers"] = [
+            (name, value)
+            for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length")
+        ] + [(b"content-length", str(len(body)).encode("latin-1"))]
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return scope, replay_receive
+
+    def _wrap_send(self, send, encoding: str | None):
+        start_message = None
+        compressor = None
+
+        async def wrapped_send(message):
+            nonlocal start_message, compressor
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                response_headers = MutableHeaders(raw=start_message["headers"])
+                response_headers["Accept-Encoding"] = ", ".join(
+                    SUPPORTED_CONTENT_ENCODINGS
+                )
+                size = response_headers.get("content-length")
+                size = int(size) if size else (None if more_body else len(body))
+                if (
+                    encoding is None
+                    or "content-encoding" in response_headers
+                    or (size is not None and size < self.minimum_size)
+                ):
+                    await send(start_message)
+                    start_message = None
+                    await send(message)
+                    return
+                compressor = _StreamCompressor(encoding)
+                response_headers["Content-Encoding"] = encoding
+                response_headers.add_vary_header("Accept-Encoding")
+                body = compressor.compress(body, final=not more_body)
+                if more_body:
+                    del response_headers["Content-Length"]
+                else:
+                    response_headers["Content-Length"] = str(len(body))
+                await send(start_message)
+            else:
+                body = compressor.compress(body, final=not more_body)
+            await send(
+                {"type": "http.response.body", "body": body, "more_body": more_body}
+            )
+
+        return wrapped_send
+
+
 class BaseService:
     def __init__(
         self,
@@ -41,6 +349,7 @@ class BaseService:
         include_health_check_endpoint: bool = True,
         license_info: Literal["CreativeCommonsZero", "MIT"] = "CreativeCommonsZero",
         openapi_url: str = "/openapi.json",
+        lifespan: Callable | None = None,
     ):
         """
         Initialize a BaseService instance.
@@ -60,6 +369,9 @@ class BaseService:
           or other routers, this parameter should be set to
           "/{service-name}/openapi.json". If omitted, the parameter is set to the
           FastAPI default.
+        :param lifespan: Optionally, an async context manager factory that FastAPI
+          runs around the application's lifetime, used to set up and tear down
+          shared resources such as connection pools.
         """
         description = Path(description_path).read_text(encoding="utf-8")
         self.service_path = service_path
@@ -71,13 +383,15 @@ class BaseService:
             license_info=LICENSES[license_info],
             description=description,
             openapi_url=openapi_url,
+            default_response_class=FastJSONResponse,
+            lifespan=lifespan,
         )
 
     """
     Because this is a reusable class, middlewares and endpoints need to be
     added after the class is instantiated. This is done by calling the start
-    method, which in turn calls the add_path_rewrite_middleware and
-    add_health_check_endpoint methods.
+    method, which in turn calls the add_path_rewrite_middleware,
+    add_compression_middleware and add_health_check_endpoint methods.
     """
 
     def add_path_rewrite_middleware(self):
@@ -100,6 +414,15 @@ class BaseService:
                 request.scope["path"] = "/"
             return await call_next(request)
 
+    def add_compression_middleware(self):
+        """
+        Add middleware to the FastAPI instance that decompresses gzip or zstd
+        encoded request bodies and compresses response bodies for clients that
+        accept it. Large eICR documents and FHIR bundles then cost a fraction
+        of the bytes on every hop between services.
+        """
+        self.app.add_middleware(CompressionMiddleware)
+
     def add_health_check_endpoint(self):
         """
         Adds a health check endpoint to the web service.
@@ -122,6 +445,7 @@ class BaseService:
         :return: The FastAPI instance.
         """
         self.add_path_rewrite_middleware()
+        self.add_compression_middleware()
         if self.include_health_check_endpoint:
             self.add_health_check_endpoint()
         return self.app
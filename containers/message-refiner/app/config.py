@@ -14,6 +14,33 @@ class Settings(BaseSettings):
         description="The URL for the Trigger Code Reference service.",
         json_schema_extra={"env": "TRIGGER_CODE_REFERENCE_URL"},
     )
+    TCR_CACHE_TTL_SECONDS: float = Field(
+        description="How long the clinical services returned by the Trigger Code"
+        " Reference service for a condition are reused for.",
+        default=3600,
+        json_schema_extra={"env": "TCR_CACHE_TTL_SECONDS"},
+    )
+    TCR_CACHE_MAX_ENTRIES: int = Field(
+        description="How many conditions' clinical services are cached before the"
+        " least recently used are evicted.",
+        default=1024,
+        json_schema_extra={"env": "TCR_CACHE_MAX_ENTRIES"},
+    )
+    TCR_MAX_CONNECTIONS: int = Field(
+        description="How many connections to the Trigger Code Reference service may"
+        " be open at once.",
+        default=10,
+        json_schema_extra={"env": "TCR_MAX_CONNECTIONS"},
+    )
+    ERSD_VALUE_SETS_PATH: str | None = Field(
+        description="The path to the value sets of every condition in the eRSD"
+        " database, as written by the Trigger Code Reference service's"
+        " `python -m app.ersd`, to look up clinical services in, in-process,"
+        " rather than calling the service. Conditions not found in them are"
+        " still looked up in the service.",
+        default=None,
+        json_schema_extra={"env": "ERSD_VALUE_SETS_PATH"},
+    )
 
 
 @lru_cache
@@ -1,14 +1,28 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Mapping
+from contextlib import asynccontextmanager
 from pathlib import Path
+from types import MappingProxyType
 from typing import Annotated
 
 import httpx
 from fastapi import Query, Request, Response, status
 from fastapi.openapi.utils import get_openapi
+from fastapi.responses import StreamingResponse
+from lxml import etree
 
 from app.base_service import BaseService
 from app.config import get_settings
 from app.models import RefineECRResponse
-from app.refine import refine, validate_message, validate_sections_to_include
+from app.refine import (
+    StreamRefiner,
+    refine,
+    validate_message,
+    validate_sections_to_include,
+)
 from app.utils import create_clinical_services_dict, read_json_from_assets
 
 settings = get_settings()
@@ -16,6 +30,30 @@ TCR_ENDPOINT = (
     f"{settings['TRIGGER_CODE_REFERENCE_URL']}/get-value-sets?condition_code="
 )
 
+# Pooled async HTTP client for the Trigger Code Reference service, created
+# lazily on first use and reused across requests so connections stay alive
+_tcr_client: httpx.AsyncClient | None = None
+
+# Successful Trigger Code Reference responses, keyed by condition code, along
+# with the time each was fetched, from the least to the most recently used
+_clinical_services_cache: OrderedDict[str, tuple[float, httpx.Response]] = OrderedDict()
+
+# The value sets of every condition in the bundled eRSD database, keyed by
+# condition code, loaded on first use when `ERSD_VALUE_SETS_PATH` is set
+_bundled_value_sets: Mapping[str, dict] | None = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Loads the bundled eRSD value sets, if there are any, when the service starts,
+    and releases the pooled connections to the Trigger Code Reference service
+    when the service shuts down.
+    """
+    get_bundled_value_sets()
+    yield
+    await close_tcr_client()
+
 
 # Instantiate FastAPI via DIBBs' BaseService class
 app = BaseService(
@@ -24,6 +62,7 @@ app = BaseService(
     description_path=Path(__file__).parent.parent / "README.md",
     include_health_check_endpoint=False,
     openapi_url="/message-refiner/openapi.json",
+    lifespan=lifespan,
 ).start()
 
 
@@ -104,25 +143,41 @@ async def refine_ecr(
             + " Multiples can be delimited by a comma."
         ),
     ] = None,
+    stream: Annotated[
+        bool,
+        Query(
+            description="Whether to refine the eCR section by section and stream the"
+            + " refined XML back as it is written, which keeps memory use bounded for"
+            + " large eCRs."
+        ),
+    ] = False,
 ) -> Response:
     """
     This endpoint refines an incoming XML eCR message based on sections to include and/or trigger code
     conditions to include, based on the parameters included in the endpoint.
 
     The return will be a formatted, refined XML, limited to just the data specified.
+    With `stream` set, the eCR is never held in memory as a whole document tree:
+    each section is refined as soon as it has been read and the refined XML is
+    streamed back as it is written. A malformed eCR is then only rejected with a
+    `400` if the error is found before any of the refined XML has been written;
+    otherwise the response is cut short.
 
     ### Inputs and Outputs
     - :param refiner_input: The request object containing the XML input.
     - :param sections_to_include: The fields to include in the refined message.
     - :param conditions_to_include: The SNOMED condition codes to use to search for
       relevant clinical services in the eCR.
+    - :param stream: Whether to refine the eCR as a stream.
     - :return: The RefineeCRResponse, the refined XML as a string.
     """
-    data = await refiner_input.body()
-
-    validated_message, error_message = validate_message(data)
-    if error_message:
-        return Response(content=error_message, status_code=status.HTTP_400_BAD_REQUEST)
+    # A streamed eCR is read as it is refined, rather than up front
+    if not stream:
+        validated_message, error_message = validate_message(await refiner_input.body())
+        if error_message:
+            return Response(
+                content=error_message, status_code=status.HTTP_400_BAD_REQUEST
+            )
 
     sections = None
     if sections_to_include:
@@ -147,24 +202,168 @@ async def refine_ecr(
         # create a simple dictionary structure for refine.py to consume
         clinical_services = create_clinical_services_dict(clinical_services)
 
+    if stream:
+        refined_chunks = refine_request_stream(
+            refiner_input.stream(), sections, clinical_services
+        )
+        try:
+            first_chunk = await refined_chunks.__anext__()
+        except StopAsyncIteration:
+            first_chunk = b""
+        except etree.XMLSyntaxError:
+            return Response(
+                content="Invalid XML format.", status_code=status.HTTP_400_BAD_REQUEST
+            )
+        return StreamingResponse(
+            iterate_refined_chunks(first_chunk, refined_chunks),
+            media_type="application/xml",
+        )
+
     data = refine(validated_message, sections, clinical_services)
 
     return Response(content=data, media_type="application/xml")
 
 
-async def get_clinical_services(condition_codes: str) -> list[dict]:
+async def refine_request_stream(
+    chunks: AsyncIterator[bytes],
+    sections_to_include: list[str] | None,
+    clinical_services: dict[str, list[str]] | None,
+) -> AsyncIterator[bytes]:
+    """
+    Refines an eCR like `refine_stream`, but from the chunks of the request body
+    as they are received, so the body is never read into memory as a whole. The
+    chunks are refined on the event loop's thread, like a whole eCR is, rather
+    than in a thread pool, since lxml's parser and the elements it builds must
+    not be shared between threads.
+
+    :param chunks: An async iterator of the chunks of the request body.
+    :param sections_to_include: Optional list of section LOINC codes.
+    :param clinical_services: Optional dictionary of clinical service codes.
+    :raises etree.XMLSyntaxError: When the eCR is not well-formed.
+    :return: An async iterator of the encoded UTF-8 XML of the refined eCR.
+    """
+    refiner = StreamRefiner(sections_to_include, clinical_services)
+    async for chunk in chunks:
+        refined = refiner.feed(chunk)
+        if refined:
+            yield refined
+    refined = refiner.close()
+    if refined:
+        yield refined
+
+
+async def iterate_refined_chunks(
+    first_chunk: bytes, refined_chunks: AsyncIterator[bytes]
+) -> AsyncIterator[bytes]:
+    """
+    Yields the chunks of an eCR refined as a stream.
+
+    :param first_chunk: The first chunk, read before the response was started.
+    :param refined_chunks: An async iterator of the remaining chunks, from
+      `refine_request_stream`.
+    :return: An async iterator of the refined chunks.
+    """
+    yield first_chunk
+    async for chunk in refined_chunks:
+        yield chunk
+
+
+async def get_clinical_services(condition_codes: str) -> list[httpx.Response]:
     """
-    This a function that loops through the provided condition codes. For each
-    condition code provided, it calls the trigger-code-reference service to get
-    the API response for that condition.
+    This a function that looks up each of the provided condition codes in the
+    trigger-code-reference service. The lookups are made concurrently, and
+    conditions found in the bundled eRSD database or looked up recently are
+    answered in-process rather than by the service.
 
     :param condition_codes: SNOMED condition codes to look up in TCR service
-    :return: List of API responses to check
+    :return: List of API responses to check, in the order of the condition codes
     """
-    clinical_services_list = []
     conditions_list = condition_codes.split(",")
-    async with httpx.AsyncClient() as client:
-        for condition in conditions_list:
-            response = await client.get(TCR_ENDPOINT + condition)
-            clinical_services_list.append(response)
-    return clinical_services_list
+    return list(
+        await asyncio.gather(
+            *[
+                get_condition_clinical_services(condition)
+                for condition in conditions_list
+            ]
+        )
+    )
+
+
+async def get_condition_clinical_services(condition: str) -> httpx.Response:
+    """
+    Gets the trigger-code-reference service's response for a single condition.
+    When `ERSD_VALUE_SETS_PATH` is set and the condition is in the bundled eRSD
+    value sets, the response is made in-process instead. Successful responses
+    from the service are cached for `TCR_CACHE_TTL_SECONDS`, and once more than
+    `TCR_CACHE_MAX_ENTRIES` conditions are cached the least recently used are
+    evicted.
+
+    :param condition: The SNOMED condition code to look up.
+    :return: The API response for the condition.
+    """
+    bundled_value_sets = get_bundled_value_sets()
+    if bundled_value_sets is not None and condition in bundled_value_sets:
+        return httpx.Response(status.HTTP_200_OK, json=bundled_value_sets[condition])
+
+    cached = _clinical_services_cache.get(condition)
+    if cached is not None:
+        fetched, response = cached
+        if time.monotonic() - fetched <= settings["TCR_CACHE_TTL_SECONDS"]:
+            _clinical_services_cache.move_to_end(condition)
+            return response
+        del _clinical_services_cache[condition]
+
+    response = await get_tcr_client().get(TCR_ENDPOINT + condition)
+    if response.status_code == 200:
+        _clinical_services_cache[condition] = (time.monotonic(), response)
+        while len(_clinical_services_cache) > settings["TCR_CACHE_MAX_ENTRIES"]:
+            _clinical_services_cache.popitem(last=False)
+    return response
+
+
+def clear_clinical_services_cache() -> None:
+    """
+    Removes every condition's clinical services from the cache.
+    """
+    _clinical_services_cache.clear()
+
+
+def get_bundled_value_sets() -> Mapping[str, dict] | None:
+    """
+    Returns the bundled eRSD value sets, loading them on first use. They are
+    the `/get-value-sets` responses of the Trigger Code Reference service for
+    every condition, keyed by condition code.
+
+    :return: The value sets, or `None` if `ERSD_VALUE_SETS_PATH` is not set.
+    """
+    global _bundled_value_sets
+    if _bundled_value_sets is None and settings["ERSD_VALUE_SETS_PATH"]:
+        with open(settings["ERSD_VALUE_SETS_PATH"]) as value_sets_file:
+            _bundled_value_sets = MappingProxyType(json.load(value_sets_file))
+    return _bundled_value_sets
+
+
+def get_tcr_client() -> httpx.AsyncClient:
+    """
+    Returns the shared async HTTP client for the trigger-code-reference
+    service, creating it on first use.
+
+    :return: A pooled `httpx.AsyncClient`.
+    """
+    global _tcr_client
+    if _tcr_client is None or _tcr_client.is_closed:
+        _tcr_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=settings["TCR_MAX_CONNECTIONS"])
+        )
+    return _tcr_client
+
+
+async def close_tcr_client() -> None:
+    """
+    Closes the shared trigger-code-reference client and releases its
+    connections. Called when the application shuts down.
+    """
+    global _tcr_client
+    client, _tcr_client = _tcr_client, None
+    if client is not None:
+        await client.aclose()
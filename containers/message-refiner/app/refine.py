@@ -1,4 +1,6 @@
+import io
 import logging
+from collections.abc import Iterable, Iterator
 from typing import Optional, Union
 
 from lxml import etree
@@ -14,13 +16,32 @@ REFINER_DETAILS = read_json_from_assets("refiner_details.json")
 # extract section LOINC codes from the REFINER_DETAILS dictionary
 SECTION_LOINCS = list(REFINER_DETAILS["sections"].keys())
 
-# ready to use list of all trigger code templateIds for simpler XPath query construction
-TRIGGER_CODE_TEMPLATE_IDS = [
-    "2.16.840.1.113883.10.20.15.2.3.5",
-    "2.16.840.1.113883.10.20.15.2.3.3",
-    "2.16.840.1.113883.10.20.15.2.3.4",
-    "2.16.840.1.113883.10.20.15.2.3.2",
-]
+# set of all trigger code templateIds to match observations against
+TRIGGER_CODE_TEMPLATE_IDS = frozenset(
+    [
+        "2.16.840.1.113883.10.20.15.2.3.5",
+        "2.16.840.1.113883.10.20.15.2.3.3",
+        "2.16.840.1.113883.10.20.15.2.3.4",
+        "2.16.840.1.113883.10.20.15.2.3.2",
+    ]
+)
+
+NAMESPACES = {"hl7": "urn:hl7-org:v3"}
+
+# the <section> with a given LOINC code, passed as `$code`; compiled once rather
+# than on every call to `.xpath()`
+SECTION_BY_CODE_XPATH = ".//hl7:section[hl7:code[@code=$code]]"
+section_by_code_xpath = etree.XPath(SECTION_BY_CODE_XPATH, namespaces=NAMESPACES)
+
+# qualified tags of the elements that lead from the root of an eICR to its sections;
+# when refining a stream, these are written as they are opened and closed, and
+# everything within them is written whole as soon as it has been read
+STREAMED_ELEMENT_TAGS = ("{urn:hl7-org:v3}component", "{urn:hl7-org:v3}structuredBody")
+
+# qualified tags of the elements checked when matching observations
+OBSERVATION_TAG = "{urn:hl7-org:v3}observation"
+TEMPLATE_ID_TAG = "{urn:hl7-org:v3}templateId"
+CODE_TAG = "{urn:hl7-org:v3}code"
 
 
 def validate_message(raw_message: str) -> tuple[bytes | None, str]:
@@ -111,6 +132,212 @@ def refine(
         sections from the Trigger Code Reference Service.
     :return: The refined eICR XML document as a string.
     """
+    namespaces = {"hl7": "urn:hl7-org:v3"}
+    structured_body = validated_message.find(".//hl7:structuredBody", namespaces)
+
+    _refine_sections(
+        structured_body,
+        sections_to_include,
+        _get_clinical_services_codes(clinical_services),
+    )
+
+    return etree.tostring(validated_message, encoding="unicode")
+
+
+def refine_stream(
+    chunks: Iterable[bytes],
+    sections_to_include: Optional[list[str]] = None,
+    clinical_services: Optional[dict[str, list[str]]] = None,
+) -> Iterator[bytes]:
+    """
+    Refines an eICR XML document like `refine`, but reads and writes it incrementally
+    so that large documents can be refined with bounded memory. See `StreamRefiner`.
+
+    :param chunks: The eICR XML document, as an iterable of encoded chunks.
+    :param sections_to_include: Optional list of section LOINC codes, as in `refine`.
+    :param clinical_services: Optional dictionary of clinical service codes, as in
+        `refine`.
+    :raises etree.XMLSyntaxError: When the document is not well-formed; the output
+        yielded up to that point is incomplete.
+    :return: An iterator of the encoded UTF-8 XML of the refined eICR document.
+    """
+    refiner = StreamRefiner(sections_to_include, clinical_services)
+    for chunk in chunks:
+        refined = refiner.feed(chunk)
+        if refined:
+            yield refined
+    refined = refiner.close()
+    if refined:
+        yield refined
+
+
+class StreamRefiner:
+    """
+    Refines an eICR XML document as it is fed to it, chunk by chunk. The document
+    is parsed with an `etree.XMLPullParser`, and the refined document is written
+    with an `etree.xmlfile` writer: the root, the <component> holding the
+    <structuredBody> and the <structuredBody> itself are written as they are opened
+    and closed, while each of their other children, such as a header element or the
+    <component> holding a section, is refined and written as soon as it has been
+    read, then dropped. Only one such child is held in memory at a time, however
+    large the document is.
+
+    The refined document is the same as that of `refine`, apart from the namespace
+    declarations repeated on the elements written whole and the XML declaration,
+    except that a section code found in more than one section is refined in each
+    of them rather than in none.
+    """
+
+    def __init__(
+        self,
+        sections_to_include: Optional[list[str]] = None,
+        clinical_services: Optional[dict[str, list[str]]] = None,
+    ):
+        """
+        Initialize a StreamRefiner instance.
+
+        :param sections_to_include: Optional list of section LOINC codes, as in
+            `refine`.
+        :param clinical_services: Optional dictionary of clinical service codes, as
+            in `refine`.
+        """
+        self.sections_to_include = sections_to_include
+        self.clinical_services_codes = _get_clinical_services_codes(clinical_services)
+        self._parser = etree.XMLPullParser(events=("start", "end", "comment", "pi"))
+        self._output = io.BytesIO()
+        self._xml_file = etree.xmlfile(self._output, encoding="utf-8")
+        self._writer = self._xml_file.__enter__()
+        # the streamed elements that are open, along with the writer contexts
+        # that close them
+        self._open_elements: list[tuple[etree.Element, object]] = []
+        # the number of elements that have been opened but not yet closed
+        self._depth = 0
+        # the streamed element whose text, the streamed element whose tail and the
+        # element to be written whole that are yet to be written, since they are
+        # only complete once the next event has been read
+        self._pending_text: Optional[etree.Element] = None
+        self._pending_tail: Optional[etree.Element] = None
+        self._pending_element: Optional[etree.Element] = None
+
+    def feed(self, data: bytes) -> bytes:
+        """
+        Reads the next chunk of the eICR XML document.
+
+        :param data: The next chunk of the document.
+        :raises etree.XMLSyntaxError: When the document is not well-formed.
+        :return: The refined XML that could be written after reading the chunk.
+        """
+        self._parser.feed(data)
+        return self._handle_events()
+
+    def close(self) -> bytes:
+        """
+        Finishes reading the eICR XML document.
+
+        :raises etree.XMLSyntaxError: When the document is incomplete.
+        :return: The rest of the refined XML.
+        """
+        self._parser.close()
+        self._handle_events()
+        self._write_pending()
+        self._xml_file.__exit__(None, None, None)
+        return self._take_output()
+
+    def _handle_events(self) -> bytes:
+        for event, element in self._parser.read_events():
+            self._write_pending()
+            if event == "start":
+                self._start(element)
+            elif event == "end":
+                self._end(element)
+            elif self._is_streamed(element.getparent()):
+                # comments and processing instructions are complete when read
+                self._pending_element = element
+        self._writer.flush()
+        return self._take_output()
+
+    def _start(self, element: etree.Element) -> None:
+        parent = element.getparent()
+        if parent is None or (
+            self._is_streamed(parent)
+            and self._depth < len(STREAMED_ELEMENT_TAGS) + 1
+            and element.tag == STREAMED_ELEMENT_TAGS[self._depth - 1]
+        ):
+            if parent is None:
+                # the writer declares each namespace under one prefix only, so
+                # leave out any prefix duplicating the default namespace
+                nsmap = {
+                    prefix: uri
+                    for prefix, uri in element.nsmap.items()
+                    if prefix is None or uri != element.nsmap.get(None)
+                }
+            else:
+                nsmap = {
+                    prefix: uri
+                    for prefix, uri in element.nsmap.items()
+                    if parent.nsmap.get(prefix) != uri
+                }
+            context = self._writer.element(element.tag, element.attrib, nsmap=nsmap)
+            context.__enter__()
+            self._open_elements.append((element, context))
+            self._pending_text = element
+        self._depth += 1
+
+    def _end(self, element: etree.Element) -> None:
+        self._depth -= 1
+        if self._open_elements and self._open_elements[-1][0] is element:
+            _, context = self._open_elements.pop()
+            context.__exit__(None, None, None)
+            if element.getparent() is not None:
+                self._pending_tail = element
+        elif self._is_streamed(element.getparent()):
+            if element.getparent().tag == "{urn:hl7-org:v3}structuredBody":
+                _refine_sections(
+                    element, self.sections_to_include, self.clinical_services_codes
+                )
+            self._pending_element = element
+
+    def _is_streamed(self, element: Optional[etree.Element]) -> bool:
+        return any(element is opened for opened, _ in self._open_elements)
+
+    def _write_pending(self) -> None:
+        if self._pending_text is not None:
+            if self._pending_text.text:
+                self._writer.write(self._pending_text.text)
+            self._pending_text = None
+        if self._pending_tail is not None:
+            element, self._pending_tail = self._pending_tail, None
+            if element.tail:
+                self._writer.write(element.tail)
+            element.getparent().remove(element)
+        if self._pending_element is not None:
+            element, self._pending_element = self._pending_element, None
+            self._writer.write(element)
+            # drop the element now that it has been written
+            element.getparent().remove(element)
+
+    def _take_output(self) -> bytes:
+        output = self._output.getvalue()
+        self._output.seek(0)
+        self._output.truncate()
+        return output
+
+
+def _refine_sections(
+    element: etree.Element,
+    sections_to_include: Optional[list[str]],
+    clinical_services_codes: Optional[set[str]],
+) -> None:
+    """
+    Refines the sections within an element of an eICR's <structuredBody>, or the
+    <structuredBody> itself, in place, following the cases described in `refine`.
+
+    :param element: The element containing the sections to refine.
+    :param sections_to_include: Optional list of section LOINC codes for the sections
+        from the <structuredBody>.
+    :param clinical_services_codes: Optional set of clinical service codes to check
+        within sections, from `_get_clinical_services_codes`.
+    """
     # dictionary that will hold the section processing instructions
     # this is based on the combination of parameters passed to `refine`
     # as well as deails from REFINER_DETAILS
@@ -118,11 +345,8 @@ def refine(
         code: details for code, details in REFINER_DETAILS["sections"].items()
     }
 
-    namespaces = {"hl7": "urn:hl7-org:v3"}
-    structured_body = validated_message.find(".//hl7:structuredBody", namespaces)
-
     # case 2: if only sections_to_include is provided, remove these sections from section_processing
-    if sections_to_include is not None and clinical_services is None:
+    if sections_to_include is not None and clinical_services_codes is None:
         section_processing = {
             key: value
             for key, value in section_processing.items()
@@ -131,140 +355,82 @@ def refine(
 
     # process sections
     for code, details in section_processing.items():
-        section = _get_section_by_code(structured_body, code)
+        section = _get_section_by_code(element, code)
         if section is None:
             continue  # go to the next section if not found
 
         # case 4: search in sections_to_include for clinical_services; for sections
         # not in sections_to_include, search for templateIds
-        if sections_to_include is not None and clinical_services is not None:
+        if sections_to_include is not None and clinical_services_codes is not None:
             if code in sections_to_include:
-                combined_xpaths = _generate_combined_xpath(
-                    template_ids=TRIGGER_CODE_TEMPLATE_IDS,
-                    clinical_services_dict=clinical_services,
-                )
-                clinical_services_codes = [
-                    code for codes in clinical_services.values() for code in codes
-                ]
                 _process_section(
-                    section,
-                    combined_xpaths,
-                    namespaces,
-                    TRIGGER_CODE_TEMPLATE_IDS,
-                    clinical_services_codes,
+                    section, TRIGGER_CODE_TEMPLATE_IDS, clinical_services_codes
                 )
             else:
-                combined_xpaths = _generate_combined_xpath(
-                    template_ids=TRIGGER_CODE_TEMPLATE_IDS,
-                    clinical_services_dict={},
-                )
-                _process_section(
-                    section, combined_xpaths, namespaces, TRIGGER_CODE_TEMPLATE_IDS
-                )
+                _process_section(section, TRIGGER_CODE_TEMPLATE_IDS)
 
         # case 3: process all sections with clinical_services (no sections_to_include)
-        elif clinical_services is not None and sections_to_include is None:
-            combined_xpaths = _generate_combined_xpath(
-                template_ids=TRIGGER_CODE_TEMPLATE_IDS,
-                clinical_services_dict=clinical_services,
-            )
-            clinical_services_codes = [
-                code for codes in clinical_services.values() for code in codes
-            ]
+        elif clinical_services_codes is not None and sections_to_include is None:
             _process_section(
-                section,
-                combined_xpaths,
-                namespaces,
-                TRIGGER_CODE_TEMPLATE_IDS,
-                clinical_services_codes,
+                section, TRIGGER_CODE_TEMPLATE_IDS, clinical_services_codes
             )
 
         # case 1: no parameters, process all sections normally
         # case 2: process sections not in sections_to_include
         else:
-            combined_xpaths = _generate_combined_xpath(
-                template_ids=TRIGGER_CODE_TEMPLATE_IDS, clinical_services_dict={}
-            )
-            _process_section(
-                section, combined_xpaths, namespaces, TRIGGER_CODE_TEMPLATE_IDS
-            )
+            _process_section(section, TRIGGER_CODE_TEMPLATE_IDS)
 
     # TODO: there may be sections that are not standard but appear in an eICR that
     # we could either decide to add to the refiner_details.json or use this code
     # before returning the refined output that removes sections that are not required
-    for section in structured_body.findall(".//hl7:section", namespaces):
-        section_code = section.find(".//hl7:code", namespaces).get("code")
+    for section in element.findall(".//hl7:section", NAMESPACES):
+        section_code = section.find(".//hl7:code", NAMESPACES).get("code")
         if section_code not in SECTION_LOINCS:
             parent = section.getparent()
             parent.remove(section)
 
-    return etree.tostring(validated_message, encoding="unicode")
+
+def _get_clinical_services_codes(
+    clinical_services: Optional[dict[str, list[str]]],
+) -> Optional[set[str]]:
+    """
+    Collects the clinical service codes of every code system into one set, so that
+    each section is matched against a set rather than a query that grows with the
+    number of codes.
+
+    :param clinical_services: Optional dictionary of clinical service codes, keyed
+        by code system.
+    :return: The set of clinical service codes, or None if no clinical services
+        were provided.
+    """
+    if clinical_services is None:
+        return None
+    return {code for codes in clinical_services.values() for code in codes}
 
 
 def _process_section(
     section: etree.Element,
-    combined_xpaths: str,
-    namespaces: dict,
-    template_ids: list[str],
-    clinical_services_codes: Optional[list[str]] = None,
+    template_ids: set[str],
+    clinical_services_codes: Optional[set[str]] = None,
 ) -> None:
     """
-    Processes a section by checking for elements, finding observations,
-    cleaning up entries, and updating text.
+    Processes a section by finding matching observations, cleaning up entries,
+    and updating text. If no observations match, a minimal section is created.
 
     :param section: The section element to process.
-    :param combined_xpaths: The combined XPath expression for finding elements.
-    :param namespaces: The namespaces to use in XPath queries.
-    :param template_ids: The list of template IDs to check.
-    :param clinical_services_codes: Optional list of clinical service codes to check.
+    :param template_ids: The set of template IDs to check.
+    :param clinical_services_codes: Optional set of clinical service codes to check.
     :return: None
     """
-    check_elements = _are_elements_present(
-        section, "templateId", template_ids, namespaces
-    )
-    if clinical_services_codes:
-        check_elements |= _are_elements_present(
-            section, "code", clinical_services_codes, namespaces
-        )
-
-    if check_elements:
-        observations = _get_observations(section, combined_xpaths, namespaces)
-        if observations:
-            paths = [_find_path_to_entry(obs) for obs in observations]
-            _prune_unwanted_siblings(paths, observations)
-            _update_text_element(section, observations)
-        else:
-            _create_minimal_section(section)
+    observations = _get_observations(section, template_ids, clinical_services_codes)
+    if observations:
+        paths = [_find_path_to_entry(obs) for obs in observations]
+        _prune_unwanted_siblings(paths, observations)
+        _update_text_element(section, observations)
     else:
         _create_minimal_section(section)
 
 
-def _generate_combined_xpath(
-    template_ids: list[str], clinical_services_dict: dict[str, list[str]]
-) -> str:
-    """
-    Generate a combined XPath expression for templateIds and all codes across all systems, ensuring they are within 'observation' elements.
-    """
-    xpath_conditions = []
-
-    # add templateId conditions within <observation> elements if needed
-    if template_ids:
-        template_id_conditions = [
-            f'.//hl7:observation[hl7:templateId[@root="{tid}"]]' for tid in template_ids
-        ]
-        xpath_conditions.extend(template_id_conditions)
-
-    # add code conditions within <observation> elements
-    for codes in clinical_services_dict.values():
-        for code in codes:
-            code_conditions = f'.//hl7:observation[hl7:code[@code="{code}"]]'
-            xpath_conditions.append(code_conditions)
-
-    # combine all conditions into a single XPath query using the union operator
-    combined_xpath = " | ".join(xpath_conditions)
-    return combined_xpath
-
-
 def _get_section_by_code(
     structured_body: etree.Element,
     code: str,
@@ -278,75 +444,57 @@ def _get_section_by_code(
     :param namespaces: The namespaces to use when searching for elements and defaults to 'hl7'.
     :return: The <section> element of the section with the given LOINC code.
     """
-    xpath_query = f'.//hl7:section[hl7:code[@code="{code}"]]'
-    section = structured_body.xpath(xpath_query, namespaces=namespaces)
+    if namespaces == NAMESPACES:
+        section = section_by_code_xpath(structured_body, code=code)
+    else:
+        section = structured_body.xpath(
+            SECTION_BY_CODE_XPATH, namespaces=namespaces, code=code
+        )
     if section is not None and len(section) == 1:
         return section[0]
 
 
 def _get_observations(
     section: etree.Element,
-    combined_xpath: str,
-    namespaces: dict = {"hl7": "urn:hl7-org:v3"},
+    template_ids: set[str],
+    codes: Optional[set[str]] = None,
 ) -> list[etree.Element]:
     """
-    Get matching observations from a section or a callable returning a section based on combined XPath query.
+    Get the observations from a section that have either a <templateId> whose root is
+    one of the template IDs or a <code> whose code is one of the codes. The section is
+    walked once, so the cost does not depend on the number of template IDs or codes.
 
     :param section: The <section> element of the section to retrieve observations from.
-    :param combined_xpath: this will be either code values from the TCR or templateId root values in one combined XPath.
-    :param namespaces: The namespaces to use when searching for elements and defaults to 'hl7'.
-    :return: A list of matching <observation> elements.
+    :param template_ids: The set of templateId root values to match, such as the
+        trigger code template IDs.
+    :param codes: Optional set of code values to match, such as the clinical service
+        codes from the TCR.
+    :return: A list of matching <observation> elements in document order.
     """
-    # use a list to store the final list of matching observation elements
+    codes = codes or set()
     observations = []
-    # use a set to store elements for uniqueness; trigger code data _may_ match clinical services
-    seen = set()
 
-    # search once for matching elements using the combined XPath expression
-    matching_elements = section.xpath(combined_xpath, namespaces=namespaces)
-    for element in matching_elements:
-        if element not in seen:
-            seen.add(element)
-            observations.append(element)
+    for observation in section.iter(OBSERVATION_TAG):
+        for child in observation.iterchildren(TEMPLATE_ID_TAG, CODE_TAG):
+            if child.tag == TEMPLATE_ID_TAG:
+                if child.get("root") in template_ids:
+                    break
+            elif child.get("code") in codes:
+                break
+        else:
+            continue
+        observations.append(observation)
 
     # TODO: we are not currently checking the codeSystemName at this time. this is because
     # there is variation even within a single eICR in connection to the codeSystemName.
     # you may see both "LOINC" and "loinc.org" as well as "SNOMED" and "SNOMED CT" in the
-    # same message. dynamically altering the XPath with variant names adds complexity and computation;
-    # we _can_ post filter, which i would suggest as a function that uses this one as its input.
-    # this is why there are two main transformations of the response from the TCR; one that is a dictionary
-    # of code systems and codes and another that is a combined XPath for all codes. this way we
-    # loop less, search less, and aim for simplicity
+    # same message. we _can_ post filter, which i would suggest as a function that uses
+    # this one as its input; this is why the response from the TCR is transformed into a
+    # dictionary of code systems and codes rather than a flat list of codes
 
     return observations
 
 
-def _are_elements_present(
-    section: etree.Element,
-    search_type: str,
-    search_values: list[str],
-    namespaces: dict = {"hl7": "urn:hl7-org:v3"},
-) -> bool:
-    """
-    Checks if any of the specified elements are present in a section based on the search type and values.
-
-    :param section: The <section> element of the section to search within.
-    :param search_type: The type of search ('templateId' or 'code').
-    :param search_values: The list of values to search for (template IDs or codes).
-    :param namespaces: The namespaces to use when searching for elements and defaults to 'hl7'.
-    :return: True if any of the specified elements are present, False otherwise.
-    """
-    if search_type == "templateId":
-        xpath_queries = [
-            f'.//hl7:templateId[@root="{value}"]' for value in search_values
-        ]
-    elif search_type == "code":
-        xpath_queries = [f'.//hl7:code[@code="{value}"]' for value in search_values]
-
-    combined_xpath = " | ".join(xpath_queries)
-    return bool(section.xpath(combined_xpath, namespaces=namespaces))
-
-
 def _find_path_to_entry(element: etree.Element) -> list[etree.Element]:
     """
     Helper function to find the path from a given element to the parent <entry> element.
@@ -43,7 +43,7 @@ def create_clinical_services_dict(
     """
     Transform the original Trigger Code Reference API response to have keys as systems
     and values as lists of codes, while ensuring the systems are recognized and using their
-    shorthand names so that we can both dynamicall construct XPaths and post-filter matches
+    shorthand names so that we can both match codes in the eICR and post-filter matches
     to system name varients.
     """
     system_dict = {
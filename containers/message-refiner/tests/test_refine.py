@@ -2,18 +2,17 @@ import pathlib
 
 import pytest
 from app.refine import (
-    _are_elements_present,
     _create_minimal_section,
     _create_or_update_text_element,
     _extract_observation_data,
     _find_path_to_entry,
-    _generate_combined_xpath,
     _get_observations,
     _get_section_by_code,
     _process_section,
     _prune_unwanted_siblings,
     _update_text_element,
     refine,
+    refine_stream,
     validate_message,
     validate_sections_to_include,
 )
@@ -88,9 +87,10 @@ test_structured_body = test_clinical_document.find(
 encounters_section = _get_section_by_code(test_structured_body, "46240-8")
 results_section = _get_section_by_code(test_structured_body, "30954-2")
 social_history_section = _get_section_by_code(test_structured_body, "29762-2")
-chlymidia_xpath = './/hl7:observation[hl7:templateId[@root="2.16.840.1.113883.10.20.15.2.3.2"]] | .//hl7:observation[hl7:code[@code="53926-2"]]'
 chlamydia_observations = _get_observations(
-    section=results_section, combined_xpath=chlymidia_xpath
+    section=results_section,
+    template_ids={"2.16.840.1.113883.10.20.15.2.3.2"},
+    codes={"53926-2"},
 )
 chlamydia_observation = chlamydia_observations[2]
 
@@ -154,25 +154,6 @@ def test_validate_message():
     assert "Invalid XML format." in error_message
 
 
-def test_generate_combined_xpath():
-    template_ids = ["2.16.840.1.113883.10.20.15.2.3.2"]
-    clinical_services_dict = {
-        "loinc": ["95423-0", "96764-6"],
-        "snomed": ["138389411000119105", "1119302008"],
-    }
-
-    expected_xpath = (
-        './/hl7:observation[hl7:templateId[@root="2.16.840.1.113883.10.20.15.2.3.2"]] | '
-        './/hl7:observation[hl7:code[@code="95423-0"]] | '
-        './/hl7:observation[hl7:code[@code="96764-6"]] | '
-        './/hl7:observation[hl7:code[@code="138389411000119105"]] | '
-        './/hl7:observation[hl7:code[@code="1119302008"]]'
-    )
-
-    output = _generate_combined_xpath(template_ids, clinical_services_dict)
-    assert output == expected_xpath
-
-
 @pytest.mark.parametrize(
     "test_section_code, expected_section_code",
     [
@@ -212,20 +193,22 @@ def test_get_entries_for_section(section, expected_length):
 
 
 @pytest.mark.parametrize(
-    "section, combined_xpath, expected_length",
+    "section, template_ids, codes, expected_length",
     [
+        (results_section, set(TRIGGER_CODE_TEMPLATE_IDS), None, 3),
+        (results_section, {"2.16.840.1.113883.10.20.15.2.3.2"}, {"53926-2"}, 4),
+        # a large code set is matched without growing a query per code
         (
             results_section,
-            _generate_combined_xpath(
-                template_ids=TRIGGER_CODE_TEMPLATE_IDS, clinical_services_dict={}
-            ),
-            3,
+            set(),
+            {f"{number}-0" for number in range(5000)} | {"53926-2"},
+            2,
         ),
-        (results_section, chlymidia_xpath, 4),
+        (results_section, set(), {"non-existent-code"}, 0),
     ],
 )
-def test_get_observations(section, combined_xpath, expected_length):
-    observations = _get_observations(section, combined_xpath, NAMESPACES)
+def test_get_observations(section, template_ids, codes, expected_length):
+    observations = _get_observations(section, template_ids, codes)
     assert len(observations) == expected_length
 
     # check that all returned elements are <observation> elements
@@ -233,27 +216,6 @@ def test_get_observations(section, combined_xpath, expected_length):
         assert obs.tag.endswith("observation")
 
 
-@pytest.mark.parametrize(
-    "section, search_type, search_values, expected_result",
-    [
-        (
-            results_section,
-            "templateId",
-            ["2.16.840.1.113883.10.20.15.2.3.2", "non-existent-templateId"],
-            True,
-        ),
-        (results_section, "templateId", ["non-existent-templateId"], False),
-        (results_section, "code", ["53926-2", "non-existent-code"], True),
-        (results_section, "code", ["non-existent-code"], False),
-    ],
-)
-def test_are_elements_present(section, search_type, search_values, expected_result):
-    assert (
-        _are_elements_present(section, search_type, search_values, NAMESPACES)
-        == expected_result
-    )
-
-
 @pytest.mark.parametrize(
     "observation, expected_path",
     [
@@ -278,7 +240,7 @@ def test_find_path_to_entry(observation, expected_path):
 
 
 @pytest.mark.parametrize(
-    "xml_content, xpath, expected_entry_count",
+    "xml_content, codes, expected_entry_count",
     [
         (
             """
@@ -315,17 +277,17 @@ def test_find_path_to_entry(observation, expected_path):
           </entry>
         </section>
         """,
-            './/hl7:observation[hl7:code/@code="12345-6" or hl7:code/@code="67890-1"]',
+            {"12345-6", "67890-1"},
             2,
         ),
         # future test cases here if needed
     ],
 )
-def test_prune_unwanted_siblings(xml_content, xpath, expected_entry_count):
+def test_prune_unwanted_siblings(xml_content, codes, expected_entry_count):
     element = etree.fromstring(xml_content)
 
     # find matching observations
-    matching_observations = _get_observations(element, xpath, NAMESPACES)
+    matching_observations = _get_observations(element, set(), codes)
 
     # collect paths
     paths = [_find_path_to_entry(obs) for obs in matching_observations]
@@ -508,42 +470,26 @@ def test_create_minimal_section(section_xml, expected_section_xml):
 
 
 @pytest.mark.parametrize(
-    "combined_xpaths, clinical_services_codes, expected_in_results",
+    "clinical_services_codes, expected_in_results",
     [
         # test case 1: Process section with a match (Chlamydia code)
-        (
-            _generate_combined_xpath(
-                template_ids=TRIGGER_CODE_TEMPLATE_IDS,
-                clinical_services_dict={"loinc": ["53926-2"]},
-            ),
-            ["53926-2"],
-            True,
-        ),
+        ({"53926-2"}, True),
         # test case 2: Process section without a match (Zika code)
-        (
-            _generate_combined_xpath(
-                template_ids=TRIGGER_CODE_TEMPLATE_IDS,
-                clinical_services_dict={"loinc": ["85622-9"]},
-            ),
-            ["85622-9"],
-            False,
-        ),
+        ({"85622-9"}, False),
     ],
 )
-def test_process_section(combined_xpaths, clinical_services_codes, expected_in_results):
+def test_process_section(clinical_services_codes, expected_in_results):
     _process_section(
         section=results_section,
-        combined_xpaths=combined_xpaths,
-        namespaces=NAMESPACES,
-        template_ids=TRIGGER_CODE_TEMPLATE_IDS,
+        template_ids=set(TRIGGER_CODE_TEMPLATE_IDS),
         clinical_services_codes=clinical_services_codes,
     )
-    if expected_in_results:
-        assert _are_elements_present(results_section, "code", ["53926-2"], NAMESPACES)
-    else:
-        assert not _are_elements_present(
-            results_section, "code", ["53926-2"], NAMESPACES
+    assert (
+        bool(
+            results_section.xpath(".//hl7:code[@code='53926-2']", namespaces=NAMESPACES)
         )
+        == expected_in_results
+    )
 
 
 @pytest.mark.parametrize(
@@ -583,11 +529,49 @@ def test_refine(sections_to_include, conditions_to_include, expected_in_results)
     test_refined_results_section = _get_section_by_code(
         test_refined_structured_body, "30954-2"
     )
-    if expected_in_results:
-        assert _are_elements_present(
-            test_refined_results_section, "code", ["53926-2"], NAMESPACES
-        )
-    else:
-        assert not _are_elements_present(
-            test_refined_results_section, "code", ["53926-2"], NAMESPACES
+    assert (
+        bool(
+            test_refined_results_section.xpath(
+                ".//hl7:code[@code='53926-2']", namespaces=NAMESPACES
+            )
         )
+        == expected_in_results
+    )
+
+
+@pytest.mark.parametrize(
+    "sections_to_include, clinical_services, chunk_size",
+    [
+        (None, None, 1),
+        (None, {"loinc": ["53926-2"]}, 4096),
+        (["29762-2"], None, 7),
+        (["30954-2"], {"loinc": ["53926-2"]}, 1024 * 1024),
+    ],
+)
+def test_refine_stream(sections_to_include, clinical_services, chunk_size):
+    data = read_file_from_test_assets("message_refiner_test_eicr.xml").encode()
+    expected_output = refine(
+        etree.fromstring(data), sections_to_include, clinical_services
+    )
+
+    chunks = (
+        data[start : start + chunk_size] for start in range(0, len(data), chunk_size)
+    )
+    refined_chunks = list(refine_stream(chunks, sections_to_include, clinical_services))
+    # the refined XML is written as the document is read
+    if chunk_size < len(data):
+        assert len(refined_chunks) > 1
+
+    # the output matches that of refine, apart from namespace declarations
+    actual_output = b"".join(refined_chunks)
+    assert etree.tostring(
+        etree.fromstring(actual_output), method="c14n2", strip_text=True
+    ) == etree.tostring(
+        etree.fromstring(expected_output), method="c14n2", strip_text=True
+    )
+
+
+def test_refine_stream_invalid_xml():
+    data = read_file_from_test_assets("message_refiner_test_eicr.xml").encode()
+    with pytest.raises(etree.XMLSyntaxError):
+        b"".join(refine_stream([data[: len(data) // 2]]))
@@ -1,14 +1,22 @@
+import json
 import pathlib
 from unittest.mock import AsyncMock, Mock, patch
 
 import pytest
-from app.main import app, get_clinical_services
+from app.main import app, clear_clinical_services_cache, get_clinical_services
 from fastapi.testclient import TestClient
 from lxml import etree
 
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def clinical_services_cache():
+    clear_clinical_services_cache()
+    yield
+    clear_clinical_services_cache()
+
+
 def parse_file_from_test_assets(filename: str) -> etree.ElementTree:
     """
     Parses a file from the assets directory into an ElementTree.
@@ -127,6 +135,47 @@ def test_ecr_refiner():
     assert "Invalid XML format." in actual_response.content.decode()
 
 
+def test_ecr_refiner_stream():
+    for sections_to_include, expected_response in [
+        (None, refined_test_no_parameters),
+        ("29762-2", refined_test_eICR_social_history_only),
+        ("30954-2,29299-5", refined_test_eICR_labs_reason),
+    ]:
+        endpoint = "/ecr/?stream=true"
+        if sections_to_include:
+            endpoint += f"&sections_to_include={sections_to_include}"
+        actual_response = client.post(endpoint, content=test_eICR_xml)
+        assert actual_response.status_code == 200
+        assert actual_response.headers["content-type"] == "application/xml"
+
+        actual_flattened = [
+            i.tag for i in etree.fromstring(actual_response.content).iter()
+        ]
+        expected_flattened = [i.tag for i in expected_response.iter()]
+        assert actual_flattened == expected_flattened
+
+    # Test case: raw_message is invalid XML
+    actual_response = client.post("/ecr/?stream=true", content="invalid XML")
+    assert actual_response.status_code == 400
+    assert "Invalid XML format." in actual_response.content.decode()
+
+
+@patch("starlette.requests.Request.body", new_callable=AsyncMock)
+def test_ecr_refiner_stream_does_not_buffer_body(mock_body):
+    ecr = test_eICR_xml.encode()
+
+    def send_ecr():
+        # the eCR is sent in pieces, which are refined as they are received
+        for start in range(0, len(ecr), 4096):
+            yield ecr[start : start + 4096]
+
+    actual_response = client.post("/ecr/?stream=true", content=send_ecr())
+    assert actual_response.status_code == 200
+    actual_flattened = [i.tag for i in etree.fromstring(actual_response.content).iter()]
+    assert actual_flattened == [i.tag for i in refined_test_no_parameters.iter()]
+    mock_body.assert_not_called()
+
+
 @pytest.mark.asyncio
 @patch("httpx.AsyncClient.get", new_callable=AsyncMock)
 async def test_ecr_refiner_conditions(mock_get):
@@ -242,3 +291,85 @@ async def test_get_clinical_services_error(mock_get):
     condition_codes = "invalid_code"
     clinical_services = await get_clinical_services(condition_codes)
     assert clinical_services[0].status_code == 503
+
+
+@pytest.mark.asyncio
+@patch("httpx.AsyncClient.get", new_callable=AsyncMock)
+async def test_get_clinical_services_cache(mock_get):
+    def make_response(url):
+        response = Mock()
+        response.status_code = 503 if url.endswith("invalid_code") else 200
+        response.json.return_value = {"condition": url.split("=")[-1]}
+        return response
+
+    mock_get.side_effect = make_response
+
+    # each condition is looked up once, and the responses keep the codes' order
+    clinical_services = await get_clinical_services("240589008,840539006")
+    assert [response.json() for response in clinical_services] == [
+        {"condition": "240589008"},
+        {"condition": "840539006"},
+    ]
+    assert mock_get.await_count == 2
+
+    # repeated conditions are answered from the cache
+    clinical_services = await get_clinical_services("840539006,240589008")
+    assert [response.json() for response in clinical_services] == [
+        {"condition": "840539006"},
+        {"condition": "240589008"},
+    ]
+    assert mock_get.await_count == 2
+
+    # failed lookups are not cached
+    await get_clinical_services("invalid_code")
+    await get_clinical_services("invalid_code")
+    assert mock_get.await_count == 4
+
+    # the least recently used condition is evicted once the cache is full
+    with patch.dict("app.main.settings", {"TCR_CACHE_MAX_ENTRIES": 2}):
+        await get_clinical_services("186747009")
+        await get_clinical_services("240589008")
+        assert mock_get.await_count == 5
+        await get_clinical_services("840539006")
+        assert mock_get.await_count == 6
+
+    # expired entries are looked up again
+    with patch.dict("app.main.settings", {"TCR_CACHE_TTL_SECONDS": -1}):
+        await get_clinical_services("240589008")
+        assert mock_get.await_count == 7
+
+
+@pytest.mark.asyncio
+@patch("httpx.AsyncClient.get", new_callable=AsyncMock)
+async def test_get_clinical_services_bundled_value_sets(mock_get, tmp_path):
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.json.return_value = {"condition": "840539006"}
+    mock_get.return_value = mock_response
+
+    # the bundled value sets are the trigger-code-reference service's
+    # `/get-value-sets` responses, keyed by condition code
+    with open(
+        pathlib.Path(__file__).parent.parent.parent
+        / "trigger-code-reference"
+        / "assets"
+        / "sample_get_value_sets_responses.json"
+    ) as file:
+        tcr_response = json.load(file)["content"]["application/json"]["examples"][
+            "Simple value set retrieval"
+        ]["value"]
+    value_sets_path = tmp_path / "value-sets.json"
+    value_sets_path.write_text(json.dumps({"276197005": tcr_response}))
+
+    with (
+        patch.dict("app.main.settings", {"ERSD_VALUE_SETS_PATH": str(value_sets_path)}),
+        patch("app.main._bundled_value_sets", None),
+    ):
+        # conditions in the bundled value sets are looked up in-process, and
+        # others fall back to the trigger-code-reference service
+        clinical_services = await get_clinical_services("276197005,840539006")
+        assert [response.json() for response in clinical_services] == [
+            tcr_response,
+            {"condition": "840539006"},
+        ]
+        mock_get.assert_awaited_once()
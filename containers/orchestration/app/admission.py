@@ -0,0 +1,168 @@
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import HTTPException, status
+from opentelemetry import metrics
+
+from app.config import get_settings
+
+meter = metrics.get_meter("orchestration_admission_meter")
+
+admission_rejection_counter = meter.create_counter(
+    "admission_rejections",
+    description="The number of workflows and service requests turned away"
+    " because orchestration or a building block was saturated, by `limiter`"
+    " and the `status_code` returned.",
+)
+
+
+class ConcurrencyLimiter:
+    """
+    Bounds the number of concurrent operations of one kind. Once
+    `max_concurrency` operations are running, up to `max_queued` more may
+    wait up to `queue_timeout_seconds` for a free slot; any beyond that are
+    rejected immediately with a 429, and those that time out with a 503,
+    both carrying a `Retry-After` header so that callers back off instead of
+    piling up requests.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        max_queued: Optional[int],
+        queue_timeout_seconds: float,
+        retry_after_seconds: int,
+    ):
+        """
+        :param name: The name of the limiter, used in error messages and
+          metrics.
+        :param max_concurrency: The number of operations allowed to run at
+          once. Zero or less disables the limit.
+        :param max_queued: The number of operations allowed to wait for a
+          slot, or None for no limit.
+        :param queue_timeout_seconds: How long an operation may wait for a
+          slot before it is rejected.
+        :param retry_after_seconds: The value of the `Retry-After` header of
+          rejections.
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queued = max_queued
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.queued = 0
+        self._slots = (
+            asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+        )
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        """
+        Holds one of the limiter's slots for the duration of the context.
+
+        :raises HTTPException: With a status of 429 if the wait queue is
+          full, or 503 if no slot freed up in time.
+        """
+        if self._slots is None:
+            yield
+            return
+
+        if self._slots.locked():
+            if self.max_queued is not None and self.queued >= self.max_queued:
+                raise self._reject(
+                    status.HTTP_429_TOO_MANY_REQUESTS,
+                    f"Too many requests are waiting for {self.name}.",
+                )
+            self.queued += 1
+            try:
+                await asyncio.wait_for(
+                    self._slots.acquire(), timeout=self.queue_timeout_seconds
+                )
+            except asyncio.TimeoutError:
+                raise self._reject(
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                    f"Timed out waiting for {self.name} to free up capacity.",
+                )
+            finally:
+                self.queued -= 1
+        else:
+            await self._slots.acquire()
+
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    async def try_acquire(self) -> bool:
+        """
+        Takes one of the limiter's slots if one is free, without waiting or
+        queueing for it. A slot taken this way must be given back with
+        `release`.
+
+        :return: Whether a slot was taken.
+        """
+        if self._slots is None:
+            return True
+        if self._slots.locked():
+            return False
+        await self._slots.acquire()
+        return True
+
+    def release(self) -> None:
+        """
+        Gives back a slot taken with `try_acquire`.
+        """
+        if self._slots is not None:
+            self._slots.release()
+
+    def _reject(self, status_code: int, detail: str) -> HTTPException:
+        admission_rejection_counter.add(
+            1, {"limiter": self.name, "status_code": status_code}
+        )
+        return HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(self.retry_after_seconds)},
+        )
+
+
+@lru_cache
+def get_workflow_limiter() -> ConcurrencyLimiter:
+    """
+    Returns the limiter that admits workflows into orchestration, sized from
+    the service's settings.
+    """
+    settings = get_settings()
+    return ConcurrencyLimiter(
+        "orchestration",
+        settings["max_in_flight_workflows"],
+        settings["max_queued_workflows"],
+        settings["admission_queue_timeout_seconds"],
+        settings["admission_retry_after_seconds"],
+    )
+
+
+@lru_cache
+def get_service_limiter(service: str) -> ConcurrencyLimiter:
+    """
+    Returns the limiter that bounds the concurrent requests sent to a
+    building block, sized from the service's settings. Requests may queue
+    for a slot without bound, but only for as long as the admission queue
+    timeout allows.
+
+    :param service: The name of the service, as keyed in `SERVICE_URLS`.
+    """
+    settings = get_settings()
+    return ConcurrencyLimiter(
+        service,
+        settings["service_concurrency_limits"].get(
+            service, settings["service_max_concurrency"]
+        ),
+        None,
+        settings["admission_queue_timeout_seconds"],
+        settings["admission_retry_after_seconds"],
+    )
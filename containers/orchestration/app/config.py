@@ -1,4 +1,7 @@
+import tempfile
 from functools import lru_cache
+from pathlib import Path
+from typing import Literal
 
 from pydantic_settings import BaseSettings
 
@@ -16,6 +19,66 @@ class Settings(BaseSettings):
     ingestion_url: str
     trigger_code_reference_url: str
 
+    # Connection pool and timeout settings for the async HTTP clients used to
+    # call the building blocks. Each service gets its own pool so that one
+    # slow dependency cannot exhaust the connections available to the others.
+    service_max_connections: int = 100
+    service_max_keepalive_connections: int = 20
+    service_timeout_seconds: float = 120.0
+    service_connect_timeout_seconds: float = 5.0
+    # Optional per-service override of `service_max_connections`, given as a
+    # JSON object in the environment, e.g. '{"fhir_converter": 25}'
+    service_connection_limits: dict[str, int] = {}
+
+    # Admission control. At most `max_in_flight_workflows` workflows run at
+    # once, and at most `max_queued_workflows` more wait for a slot; each
+    # building block is likewise sent at most `service_max_concurrency`
+    # requests at once (overridable per service). Work that cannot be
+    # admitted within `admission_queue_timeout_seconds` is answered with a
+    # 503, and work beyond the queue with a 429, each with a Retry-After
+    # header. A limit of 0 disables it.
+    max_in_flight_workflows: int = 0
+    max_queued_workflows: int = 100
+    service_max_concurrency: int = 0
+    service_concurrency_limits: dict[str, int] = {}
+    admission_queue_timeout_seconds: float = 10.0
+    admission_retry_after_seconds: int = 5
+
+    # Hedged requests, for workflow steps that enable `hedge`. A step that
+    # does not set `hedge_delay_seconds` hedges once a request has taken
+    # longer than `hedge_percentile` of the last `hedge_latency_window`
+    # responses of its endpoint, or `hedge_default_delay_seconds` until
+    # `hedge_min_samples` responses have been seen.
+    hedge_percentile: float = 95.0
+    hedge_latency_window: int = 200
+    hedge_min_samples: int = 20
+    hedge_default_delay_seconds: float = 2.0
+
+    # Circuit breakers, for workflow steps that enable `circuit_breaker`.
+    # After this many consecutive failures of a service, requests to it fail
+    # fast for `circuit_breaker_reset_seconds`.
+    circuit_breaker_failure_threshold: int = 5
+    circuit_breaker_reset_seconds: float = 30.0
+
+    # The number of eCRs from a single bulk `/process-zip` upload that are run
+    # through the workflow at the same time.
+    bulk_max_concurrency: int = 4
+
+    # The number of files sent over a single `/process-ws` connection that
+    # are run through the workflow at the same time.
+    ws_max_concurrent_files: int = 4
+
+    # Optional cache of successful workflow results, so that duplicate
+    # submissions of a message to the same config are answered without
+    # calling the building blocks again.
+    result_cache_enabled: bool = False
+    result_cache_backend: Literal["sqlite", "memory"] = "sqlite"
+    result_cache_path: str = str(
+        Path(tempfile.gettempdir()) / "orchestration_result_cache.sqlite3"
+    )
+    result_cache_ttl_seconds: float = 3600.0
+    result_cache_max_entries: int = 10000
+
 
 @lru_cache
 def get_settings() -> dict:
@@ -197,6 +197,77 @@ def build_ingestion_dob_request(
         }
 
 
+def build_ingestion_standardize_bundle_request(
+    input_msg: str,
+    orchestration_request: OrchestrationRequest,
+    workflow_params: dict | None = None,
+) -> dict:
+    """
+    Helper function for constructing the output payload for an API call to
+    the DIBBs ingestion service's combined standardization endpoint, which
+    applies name, date of birth and phone standardization in a single
+    request. The workflow params select the standardizations to apply with
+    the keys `standardize_names`, `standardize_dob` and `standardize_phones`,
+    each mapping to that standardization's own parameters. If none of these
+    keys are given, all three standardizations are applied with their
+    default parameters.
+
+    :param input_msg: The data the user sent for workflow processing, as
+      a string.
+    :param orchestration_request: The request the client initially sent
+      to the orchestration service. This request bundles a number of
+      parameter settings into one dictionary that each handler can
+      accept for consistency.
+    :param workflow_params: Optionally, a set of configuration parameters
+      included in the workflow config for the standardization step of a
+      workflow.
+    :return: A dictionary ready to JSON-serialize as a payload to the
+      ingestion service.
+    """
+    with tracer.start_as_current_span(
+        "build_ingestion_standardize_bundle_request",
+        kind=trace.SpanKind(0),
+        attributes={
+            "message_type": orchestration_request.get("message_type"),
+            "data_type": orchestration_request.get("data_type"),
+            "workflow_params": str(workflow_params),
+        },
+    ) as handler_span:
+        # Default parameter values for each standardization
+        default_params = {
+            "standardize_names": {
+                "trim": "true",
+                "case": "upper",
+                "remove_numbers": "true",
+            },
+            "standardize_dob": {},
+            "standardize_phones": {},
+        }
+
+        # Initialize workflow_params as an empty dictionary if it's None
+        workflow_params = workflow_params or {}
+
+        operations = [
+            operation for operation in default_params if operation in workflow_params
+        ] or list(default_params)
+
+        handler_span.add_event(
+            "selecting standardization operations",
+            attributes={"operations": operations},
+        )
+
+        request = {
+            "data": input_msg,
+            "overwrite": workflow_params.get("overwrite", "true"),
+        }
+        for operation in operations:
+            request[operation] = {
+                **default_params[operation],
+                **(workflow_params.get(operation) or {}),
+            }
+        return request
+
+
 def build_geocoding_request(
     input_msg: str,
     orchestration_request: OrchestrationRequest,
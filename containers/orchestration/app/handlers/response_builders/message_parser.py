@@ -1,6 +1,6 @@
+from httpx import Response
 from opentelemetry import trace
 from opentelemetry.trace.status import StatusCode
-from requests import Response
 
 from app.handlers.ServiceHandlerResponse import ServiceHandlerResponse
 from app.handlers.tracer import tracer
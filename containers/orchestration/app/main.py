@@ -1,8 +1,13 @@
+import asyncio
 import json
 import logging
 import os
+import sqlite3
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Annotated
+from zipfile import BadZipFile
 
 from fastapi import (
     Body,
@@ -15,9 +20,11 @@ from fastapi import (
     WebSocketDisconnect,
     status,
 )
+from fastapi.responses import StreamingResponse
 from opentelemetry import metrics, trace
 from opentelemetry.trace.status import StatusCode
 
+from app.admission import get_workflow_limiter
 from app.base_service import BaseService
 from app.config import get_settings
 from app.constants import (
@@ -34,14 +41,17 @@ from app.models import (
     ProcessingConfigModel,
     PutConfigResponse,
 )
-from app.services import call_apis
+from app.result_cache import get_result_cache, make_cache_key
+from app.services import call_apis, close_http_clients
 from app.utils import (
     _combine_response_bundles,
     _socket_response_is_valid,
+    invalidate_processing_config,
     load_config_assets,
     load_json_from_binary,
     load_processing_config,
     unzip_http,
+    unzip_http_bulk,
     unzip_ws,
 )
 
@@ -66,12 +76,24 @@ process_counter = meter.create_counter(
     " status code for the process endpoint.",
 )
 
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Releases the pooled connections to the building blocks when the
+    service shuts down.
+    """
+    yield
+    await close_http_clients()
+
+
 # Instantiate FastAPI via PHDI's BaseService class
 app = BaseService(
     service_name="PHDI Orchestration",
     service_path="/orchestration",
     description_path=Path(__file__).parent.parent / "README.md",
     openapi_url="/orchestration/openapi.json",
+    lifespan=lifespan,
 ).start()
 
 
@@ -94,62 +116,285 @@ class WS_File:
         self.file = file
 
 
+# The workflow applied to files sent over `/process-ws` unless the client
+# names another
+DEFAULT_WS_CONFIG_FILE_NAME = "test-no-save.json"
+
+
+class _WebSocketChannel:
+    """
+    Sends the frames of one file processed over a `/process-ws` connection.
+    Every file on the connection shares the socket and one lock, so frames
+    of files processed concurrently interleave without overlapping. Frames
+    of a file sent with a `file_id` are tagged with it and with the `event`
+    they report.
+    """
+
+    def __init__(self, websocket: WebSocket, lock: asyncio.Lock, file_id=None):
+        self.websocket = websocket
+        self.lock = lock
+        self.file_id = file_id
+
+    @property
+    def client_state(self):
+        """
+        The state of the client side of the connection.
+        """
+        return self.websocket.client_state
+
+    @property
+    def application_state(self):
+        """
+        The state of the server side of the connection.
+        """
+        return self.websocket.application_state
+
+    async def send_text(self, text: str) -> None:
+        """
+        Sends the progress dump of a workflow step, as `call_apis` does after
+        each step.
+
+        :param text: The JSON-encoded progress of the file's workflow.
+        """
+        if self.file_id is not None:
+            text = (
+                f'{{"file_id": {json.dumps(self.file_id)}, "event": "progress", '
+                f'"progress": {text}}}'
+            )
+        async with self.lock:
+            await self.websocket.send_text(text)
+
+    async def send_json(self, event: str, content: dict) -> None:
+        """
+        Sends a frame about the file.
+
+        :param event: The event the frame reports, for tagged files.
+        :param content: The content of the frame.
+        """
+        if self.file_id is not None:
+            content = {"file_id": self.file_id, "event": event, **content}
+        async with self.lock:
+            await self.websocket.send_text(json.dumps(content))
+
+
 @app.websocket("/process-ws")
 async def process_message_endpoint_ws(
     websocket: WebSocket,
 ) -> OrchestrationResponse:
     """
-    Creates a websocket connection with the client and accepts a zipped XML file.
-    The file is processed by the building blocks according to the currently
-    loaded configuration and emits websocket updates to the client as each
-    processing step completes.
+    Creates a websocket connection with the client and accepts zipped XML
+    files. Each file is processed by the building blocks according to the
+    currently loaded configuration and emits websocket updates to the client
+    as each processing step completes.
+
+    A client may send a zip file on its own, in which case it is processed
+    before the next file is read. To send many files at once, the client
+    instead precedes each zip file with a JSON text frame tagging it with a
+    `file_id` (and optionally the `config_file_name` to apply). Tagged files
+    are processed concurrently, up to `ws_max_concurrent_files` per
+    connection, and every frame sent about one carries its `file_id` and an
+    `event`: `started` when processing begins, `progress` after each step,
+    and finally `result` or `error`. The config is loaded for each file, so
+    a config changed while the connection is open applies to later files.
 
     :param websocket:An instance of the WebSocket connection. It is used to communicate
       with the client, sending and receiving data in real-time.
     """
 
     await websocket.accept()
+    send_lock = asyncio.Lock()
+    file_slots = asyncio.Semaphore(get_settings()["ws_max_concurrent_files"])
+    file_tasks = set()
+    file_header = None
+
     try:
         while True:
-            file_bytes = await websocket.receive_bytes()
-            unzipped_data = unzip_ws(file_bytes)
-
-            # Hardcoded message_type for MVP
-            initial_input = {
-                "message_type": "ecr",
-                "message": unzipped_data.get("ecr"),
-                "rr_data": unzipped_data.get("rr"),
-            }
-            processing_config = load_processing_config("test-no-save.json")
-            response, responses = await call_apis(
-                config=processing_config, input=initial_input, websocket=websocket
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+
+            if frame.get("text") is not None:
+                try:
+                    file_header = _parse_ws_file_header(frame["text"])
+                except ValueError as error:
+                    await _WebSocketChannel(websocket, send_lock).send_json(
+                        "error", {"message": str(error)}
+                    )
+                continue
+
+            file_bytes = frame.get("bytes")
+            if file_header is None:
+                channel = _WebSocketChannel(websocket, send_lock)
+                try:
+                    await _process_ws_file(
+                        channel,
+                        load_processing_config(DEFAULT_WS_CONFIG_FILE_NAME),
+                        file_bytes,
+                    )
+                except HTTPException as error:
+                    # A file that failed, or was turned away because the
+                    # service is at capacity, leaves the connection open
+                    await channel.send_json(
+                        "error",
+                        {"status_code": error.status_code, "message": error.detail},
+                    )
+                except Exception as error:
+                    await channel.send_json(
+                        "error",
+                        {
+                            "status_code": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            "message": f"Orchestration service error: {error.__str__()}",
+                        },
+                    )
+                continue
+
+            # Stop reading the socket while the connection is at its limit,
+            # so that clients sending faster than files can be processed
+            # are slowed down rather than buffered in memory
+            await file_slots.acquire()
+            channel = _WebSocketChannel(websocket, send_lock, file_header["file_id"])
+            task = asyncio.create_task(
+                _process_tagged_ws_file(
+                    channel,
+                    file_header["config_file_name"],
+                    file_bytes,
+                )
             )
-            if _socket_response_is_valid(response=response):
-                # Parse and work with the API response data (JSON, XML, etc.)
-                api_data = response.json()  # Assuming the response is in JSON format
-                message = {
-                    "message": "Processing succeeded!",
-                    "processed_values": api_data,
-                }
-                await websocket.send_text(json.dumps(message))
+            file_tasks.add(task)
+            task.add_done_callback(file_tasks.discard)
+            task.add_done_callback(lambda _: file_slots.release())
+            file_header = None
     except WebSocketDisconnect:
         logger.error("The websocket disconnected")
     except Exception as e:
         logger.error("An error occurred:", e)
         if websocket:
-            await websocket.send_text(
-                json.dumps(
-                    {
-                        "message": "Something went wrong",
-                        "responses": None,
-                        "processed_values": "",
-                    }
+            async with send_lock:
+                await websocket.send_text(
+                    json.dumps(
+                        {
+                            "message": "Something went wrong",
+                            "responses": None,
+                            "processed_values": "",
+                        }
+                    )
                 )
-            )
     finally:
+        for task in file_tasks:
+            task.cancel()
+        await asyncio.gather(*file_tasks, return_exceptions=True)
         await websocket.close()
 
 
+def _parse_ws_file_header(text: str) -> dict:
+    """
+    Parses the text frame a client sends over `/process-ws` ahead of a
+    tagged file.
+
+    :param text: The content of the text frame.
+    :return: A dictionary holding the `file_id` of the file that follows and
+      the `config_file_name` to apply to it.
+    :raises ValueError: If the frame does not hold a JSON object with a
+      `file_id`.
+    """
+    try:
+        header = json.loads(text)
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("file_id") is None:
+        raise ValueError(
+            "Expected a JSON object with a `file_id` ahead of each tagged file."
+        )
+    return {
+        "file_id": header["file_id"],
+        "config_file_name": header.get("config_file_name", DEFAULT_WS_CONFIG_FILE_NAME),
+    }
+
+
+async def _process_ws_file(
+    channel: _WebSocketChannel, processing_config: dict, file_bytes: bytes
+) -> bool:
+    """
+    Applies a workflow to a zip file sent over `/process-ws`, streaming the
+    progress of each step and then the result to the client.
+
+    :param channel: The channel to send the file's frames through.
+    :param processing_config: The workflow config to apply.
+    :param file_bytes: The content of the zip file.
+    :return: Whether the workflow's result was sent.
+    """
+    unzipped_data = unzip_ws(file_bytes)
+
+    # Hardcoded message_type for MVP
+    initial_input = {
+        "message_type": "ecr",
+        "message": unzipped_data.get("ecr"),
+        "rr_data": unzipped_data.get("rr"),
+    }
+    async with get_workflow_limiter().acquire():
+        if channel.file_id is not None:
+            await channel.send_json("started", {})
+        response, responses = await call_apis(
+            config=processing_config, input=initial_input, websocket=channel
+        )
+    if not _socket_response_is_valid(response=response):
+        return False
+    # Parse and work with the API response data (JSON, XML, etc.)
+    api_data = response.json()  # Assuming the response is in JSON format
+    await channel.send_json(
+        "result",
+        {
+            "message": "Processing succeeded!",
+            "processed_values": api_data,
+        },
+    )
+    return True
+
+
+async def _process_tagged_ws_file(
+    channel: _WebSocketChannel,
+    config_file_name: str,
+    file_bytes: bytes,
+) -> None:
+    """
+    Applies a workflow to a tagged file sent over `/process-ws`. Failures are
+    reported to the client as an `error` frame for the file, leaving the
+    connection and the client's other files unaffected.
+    """
+    with tracer.start_as_current_span(
+        "process-ws-file",
+        kind=trace.SpanKind(0),
+        attributes={"file_id": str(channel.file_id)},
+    ) as file_span:
+        try:
+            if not await _process_ws_file(
+                channel, load_processing_config(config_file_name), file_bytes
+            ):
+                await channel.send_json(
+                    "error",
+                    {
+                        "status_code": status.HTTP_400_BAD_REQUEST,
+                        "message": "Processing failed: the message is not valid.",
+                    },
+                )
+        except asyncio.CancelledError:
+            raise
+        except HTTPException as error:
+            file_span.record_exception(error)
+            await channel.send_json(
+                "error", {"status_code": error.status_code, "message": error.detail}
+            )
+        except Exception as error:
+            file_span.record_exception(error)
+            await channel.send_json(
+                "error",
+                {
+                    "status_code": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    "message": f"Orchestration service error: {error.__str__()}",
+                },
+            )
+
+
 # TODO: This method needs request validation on message_type
 # Should make them into Field values and validate with Pydantic
 @app.post("/process-zip", status_code=200, responses=process_message_response_examples)
@@ -158,6 +403,7 @@ async def process_zip_endpoint(
     data_type: str = Form(None),
     config_file_name: str = Form(None),
     upload_file: UploadFile = File(None),
+    bulk: bool = Form(False),
 ) -> OrchestrationResponse:
     """
     This endpoint provides a wrapper function for unpacking an uploaded zip
@@ -166,6 +412,13 @@ async def process_zip_endpoint(
     two endpoints that can actually invoke and apply a config workflow to data
     and is meant to be used to process files.
 
+    In bulk mode, the uploaded zip file may hold any number of eICRs, each
+    with an optional RR alongside it. The eICRs are read from the archive one
+    at a time and run through the workflow concurrently, and the result for
+    each one is streamed back as a line of newline-delimited JSON holding the
+    eICR's path in the zip file (`file`), the workflow's `status_code`, and
+    its `response`.
+
     ### Inputs and Outputs
 
     - :param message_type: The type of stream of the uploaded file's underlying
@@ -175,9 +428,39 @@ async def process_zip_endpoint(
     - :param config_file_name: The name of the configuration file to load on
       the service's back-end, specifying the workflow to apply.
     - :param upload_file: A file containing clinical health care information.
+    - :param bulk: Whether the uploaded zip file holds many eCRs to process.
     - :return: A response holding whether the workflow application was
       successful as well as the results of the workflow.
     """
+    if bulk:
+        if upload_file.content_type != "application/zip":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Bulk processing requires a zip file.",
+            )
+        try:
+            load_processing_config(config_file_name)
+            ecr_data = unzip_http_bulk(upload_file)
+        except (FileNotFoundError, BadZipFile, IndexError) as error:
+            return Response(
+                content=json.dumps(
+                    {
+                        "message": error.__str__(),
+                        "processed_values": {},
+                    }
+                ),
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+        return StreamingResponse(
+            stream_workflow_results(
+                message_type,
+                data_type,
+                config_file_name,
+                ecr_data,
+            ),
+            media_type="application/x-ndjson",
+        )
+
     rr_content = None
     if upload_file.content_type == "application/zip":
         unzipped_file = unzip_http(upload_file)
@@ -203,6 +486,106 @@ async def process_zip_endpoint(
     return building_block_response
 
 
+async def stream_workflow_results(
+    message_type: str,
+    data_type: str,
+    config_file_name: str,
+    ecr_data: Iterator[dict],
+) -> AsyncIterator[bytes]:
+    """
+    Applies a workflow to every eCR from a bulk upload, keeping at most
+    `bulk_max_concurrency` of them in flight at once, and yields the result
+    of each as a line of newline-delimited JSON in the order they finish.
+
+    :param message_type: The type of data being supplied for orchestration.
+    :param data_type: The type of data of the passed-in messages.
+    :param config_file_name: The name of the workflow configuration file to
+      apply to each message.
+    :param ecr_data: An iterator of ECR data dictionaries, as returned by
+      `unzip_http_bulk`.
+    :return: An async iterator of encoded NDJSON lines.
+    """
+    max_concurrency = get_settings()["bulk_max_concurrency"]
+    pending = set()
+    exhausted = False
+    try:
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_concurrency:
+                # Reading from the archive blocks, so keep it off the event loop
+                next_ecr_data = await asyncio.to_thread(next, ecr_data, None)
+                if next_ecr_data is None:
+                    exhausted = True
+                    break
+                pending.add(
+                    asyncio.create_task(
+                        _apply_workflow_to_bulk_message(
+                            message_type, data_type, config_file_name, next_ecr_data
+                        )
+                    )
+                )
+            if not pending:
+                break
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield json.dumps(task.result()).encode("utf-8") + b"\n"
+    finally:
+        # The client may disconnect before every message has been processed
+        for task in pending:
+            task.cancel()
+
+
+async def _apply_workflow_to_bulk_message(
+    message_type: str,
+    data_type: str,
+    config_file_name: str,
+    ecr_data: dict,
+    step_sender: Callable[[dict, dict], Awaitable] = None,
+) -> dict:
+    """
+    Applies a workflow to a single eCR from a bulk upload and summarizes the
+    outcome, so that one failing message does not end the whole stream.
+    """
+    with tracer.start_as_current_span(
+        "process-zip-bulk-message",
+        kind=trace.SpanKind(0),
+        attributes={"file": ecr_data.get("file")},
+    ) as bulk_span:
+        try:
+            response = await apply_workflow_to_message(
+                message_type,
+                data_type,
+                config_file_name,
+                ecr_data.get("ecr"),
+                ecr_data.get("rr"),
+                step_sender=step_sender,
+            )
+        except HTTPException as error:
+            bulk_span.record_exception(error)
+            status_code, content = error.status_code, error.detail
+        except Exception as error:
+            bulk_span.record_exception(error)
+            status_code = 500
+            content = {
+                "message": f"Orchestration service error: {error.__str__()}",
+                "processed_values": {},
+            }
+        else:
+            status_code = response.status_code
+            try:
+                content = json.loads(response.body)
+            except ValueError:
+                content = response.body.decode("utf-8")
+
+    process_counter.add(1, {"status_code": status_code})
+    return {
+        "file": ecr_data.get("file"),
+        "status_code": status_code,
+        "response": content,
+    }
+
+
 @app.post(
     "/process-message", status_code=200, responses=process_message_response_examples
 )
@@ -267,6 +650,7 @@ async def apply_workflow_to_message(
     config_file_name: str,
     message: str,
     rr_content: str,
+    step_sender: Callable[[dict, dict], Awaitable] = None,
 ) -> Response:
     """
     Main orchestration function that applies a config-defined workflow to an
@@ -282,6 +666,8 @@ async def apply_workflow_to_message(
       or default configs directory on the service's disk space.
     :param message: The content of the supplied string of data.
     :param rr_content: The reportability response associated with the eCR.
+    :param step_sender: Optionally, the function that sends each workflow
+      step's request, in place of `send_step_request`.
     :return: Response of whether the workflow succeeded and what its outputs
       were.
     """
@@ -317,6 +703,35 @@ async def apply_workflow_to_message(
             )
             return response
 
+        # Answer duplicate submissions from the result cache, if enabled
+        result_cache = get_result_cache()
+        if result_cache is not None:
+            cache_key = make_cache_key(
+                message_type,
+                data_type,
+                config_file_name,
+                processing_config,
+                message,
+                rr_content,
+            )
+            try:
+                cached_response = await asyncio.to_thread(result_cache.get, cache_key)
+            except sqlite3.Error as error:
+                # An unavailable cache only costs the workflow its shortcut
+                logger.warning(f"Could not read the workflow result cache: {error}")
+                cached_response = None
+            wf_span.add_event(
+                "checked result cache",
+                attributes={"cache_hit": cached_response is not None},
+            )
+            if cached_response is not None:
+                wf_span.set_status(StatusCode(1))
+                return Response(
+                    content=cached_response["content"],
+                    media_type=cached_response["media_type"],
+                    status_code=cached_response["status_code"],
+                )
+
         # Compile the input to the other service endpoints and call them
         api_input = {
             "message_type": message_type,
@@ -326,11 +741,15 @@ async def apply_workflow_to_message(
         }
         wf_span.add_event("sending params to `call_apis`")
         try:
-            response, responses = await call_apis(
-                config=processing_config, input=api_input
-            )
+            async with get_workflow_limiter().acquire():
+                response, responses = await call_apis(
+                    config=processing_config,
+                    input=api_input,
+                    step_sender=step_sender,
+                )
         except HTTPException as error:
-            # These exceptions are purposefully created in call_apis to surface service errors
+            # These exceptions are purposefully created in call_apis to surface
+            # service errors, or by the limiters when orchestration is saturated
             raise error
         except Exception as error:
             # Handle internal exceptions
@@ -390,8 +809,23 @@ async def apply_workflow_to_message(
             case _:
                 workflow_content = response.text
 
+        workflow_response = Response(content=workflow_content, media_type=content_type)
+        if result_cache is not None:
+            try:
+                await asyncio.to_thread(
+                    result_cache.put,
+                    cache_key,
+                    workflow_response.status_code,
+                    content_type,
+                    workflow_response.body,
+                )
+            except sqlite3.Error as error:
+                # The workflow already succeeded, so a failure to cache its
+                # result must not fail the request
+                logger.warning(f"Could not write the workflow result cache: {error}")
+
         wf_span.set_status(StatusCode(1))
-        return Response(content=workflow_content, media_type=content_type)
+        return workflow_response
 
 
 def _filter_failed_responses(responses):
@@ -474,10 +908,13 @@ async def upload_config(
 
     # Convert Pydantic models to dicts so they can be serialized to JSON.
     for i in range(len(input.workflow["workflow"])):
-        input.workflow["workflow"][i] = input.workflow["workflow"][i].model_dump()
+        input.workflow["workflow"][i] = input.workflow["workflow"][i].model_dump(
+            exclude_none=True
+        )
 
     with open(file_path, "w") as file:
         json.dump(input.workflow, file, indent=4)
+    invalidate_processing_config(processing_config_name)
 
     if config_exists:
         return {"message": "Config updated successfully!"}
@@ -2,6 +2,8 @@ from typing import Literal, Optional, Union
 
 from pydantic import BaseModel, Field, model_validator
 
+from app.resilience import IDEMPOTENT_ENDPOINTS
+
 
 # Request and response models
 class OrchestrationRequest(BaseModel):
@@ -121,6 +123,43 @@ class WorkflowServiceStepModel(BaseModel):
     service: str
     endpoint: str
     params: Optional[dict] = None
+    name: Optional[str] = None
+    previous_response_to_param_mapping: Optional[dict[str, str]] = None
+    depends_on: Optional[list[str]] = Field(
+        description="The names of the steps this step waits on. Declaring "
+        "`depends_on` on any step runs the workflow as a dependency graph, where "
+        "steps that do not depend on each other are performed concurrently.",
+        default=None,
+    )
+    hedge: Optional[bool] = Field(
+        description="When `true`, if the service has not responded after a delay "
+        "based on its recent response times, the request is sent a second time and "
+        "the first response is used. Only allowed for endpoints that do not change "
+        "any data.",
+        default=None,
+    )
+    hedge_delay_seconds: Optional[float] = Field(
+        description="A fixed delay, in seconds, after which a hedged step's request "
+        "is sent again, instead of one based on recent response times.",
+        default=None,
+    )
+    circuit_breaker: Optional[bool] = Field(
+        description="When `true`, requests to the service fail fast while the "
+        "service's circuit breaker is open after repeated failures.",
+        default=None,
+    )
+
+    @model_validator(mode="after")
+    def validate_hedge_is_idempotent(self):
+        """
+        Validates that hedging is only enabled for endpoints that are safe
+        to call twice.
+        """
+        if self.hedge and self.endpoint.split("/")[-1] not in IDEMPOTENT_ENDPOINTS:
+            raise ValueError(
+                f"`hedge` cannot be enabled for the endpoint {self.endpoint}."
+            )
+        return self
 
 
 class ProcessingConfigModel(BaseModel):
@@ -0,0 +1,512 @@
+"""
+Runs orchestration workflows in library mode: instead of posting each step's
+request to a building block container over HTTP, the building blocks' own
+FastAPI endpoint functions are imported from their containers and called
+in-process on the same Python objects, skipping the JSON serialization and
+network hops between services. Messages are spread over a pool of worker
+processes, each of which loads the building blocks once.
+
+Run it from the orchestration container's directory with, e.g.,
+
+    python -m app.pipeline sample-fhir-test-config.json bundles/ \
+        --message-type fhir --data-type fhir > results.ndjson
+
+Each result is written as a line of newline-delimited JSON, in the same
+format as the bulk mode of the `/process-zip` endpoint.
+"""
+
+import argparse
+import asyncio
+import copy
+import importlib
+import inspect
+import json
+import logging
+import os
+import sys
+import typing
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+from zipfile import ZipFile, is_zipfile
+
+from fastapi import HTTPException, Response
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from httpx import Headers
+from opentelemetry import trace
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from app.main import _apply_workflow_to_bulk_message
+from app.services import send_step_request
+from app.utils import iter_ecr_data, load_processing_config
+
+tracer = trace.get_tracer("orchestration_pipeline_tracer")
+
+logger = logging.getLogger(__name__)
+
+# The directory, under the containers directory, of the building block that
+# serves each workflow service. Services without one (e.g. the eCR Viewer's
+# save endpoints) are still called over HTTP.
+SERVICE_CONTAINERS = {
+    "validation": "validation",
+    "ingestion": "ingestion",
+    "fhir_converter": "fhir-converter",
+    "message_parser": "message-parser",
+    "trigger_code_reference": "trigger-code-reference",
+}
+
+DEFAULT_CONTAINERS_DIR = Path(__file__).parent.parent.parent
+
+# The building block endpoints loaded in this process, keyed by service name
+# and endpoint path, and the event loop the workflows of this process run on
+_local_endpoints: dict[tuple[str, str], "InProcessEndpoint"] = {}
+_loaded_containers_dir: Optional[Path] = None
+_event_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class InProcessResponse:
+    """
+    The response of a building block endpoint called in-process. It offers
+    the parts of an `httpx.Response` that orchestration's response handlers
+    use, but `json()` returns the endpoint's result itself rather than
+    parsing a serialized copy of it. The result is only serialized if the
+    raw `content` of the response is read, with the response class the
+    route would have rendered it with over HTTP, so the bytes are the same.
+    """
+
+    def __init__(
+        self,
+        status_code: int,
+        headers: dict,
+        result=None,
+        content: Optional[bytes] = None,
+        response_class: type[Response] = JSONResponse,
+    ):
+        """
+        :param status_code: The status code of the response.
+        :param headers: The headers of the response.
+        :param result: The JSON-compatible result of the endpoint, if it
+          returned one.
+        :param content: The body of the response, if the endpoint returned a
+          response object rather than a result.
+        :param response_class: The class that renders the result as the
+          body of the response.
+        """
+        self.status_code = status_code
+        self.headers = Headers(headers)
+        self._result = result
+        self._content = content
+        self._response_class = response_class
+
+    @property
+    def content(self) -> bytes:
+        """
+        The body of the response, as bytes.
+        """
+        if self._content is None:
+            self._content = self._response_class(self._result).body
+        return self._content
+
+    @property
+    def text(self) -> str:
+        """
+        The body of the response, as text.
+        """
+        return self.content.decode("utf-8")
+
+    def json(self):
+        """
+        Returns the JSON body of the response. The object returned is the
+        endpoint's result, which later workflow steps may also be handed.
+        """
+        if self._content is not None and self._result is None:
+            self._result = json.loads(self._content)
+        return self._result
+
+
+class InProcessEndpoint:
+    """
+    Calls the function of a building block's FastAPI route directly, doing
+    the parts of FastAPI's request handling that the route relies on:
+    validating the request body into the route's input model, handing the
+    route a `Response` to set its status code on, serializing the result
+    with the route's response model, and turning validation errors and
+    HTTP exceptions into error responses.
+    """
+
+    def __init__(self, route: APIRoute):
+        """
+        :param route: The route of the endpoint.
+        :raises ValueError: If the endpoint takes parameters other than a
+          request body model and a `Response`.
+        """
+        self.route = route
+        self.body_param = None
+        self.response_param = None
+        hints = typing.get_type_hints(route.endpoint, include_extras=True)
+        for name in inspect.signature(route.endpoint).parameters:
+            annotation = hints.get(name)
+            if typing.get_origin(annotation) is typing.Annotated:
+                annotation = typing.get_args(annotation)[0]
+            if inspect.isclass(annotation) and issubclass(annotation, Response):
+                self.response_param = name
+            elif (
+                inspect.isclass(annotation)
+                and issubclass(annotation, BaseModel)
+                and self.body_param is None
+            ):
+                self.body_param = name
+                self.body_adapter = TypeAdapter(annotation)
+            else:
+                raise ValueError(
+                    f"Cannot call {route.path} in-process: unsupported "
+                    f"parameter '{name}'."
+                )
+        self.response_adapter = (
+            TypeAdapter(route.response_model) if route.response_model else None
+        )
+        self.response_class = route.response_class
+        if isinstance(self.response_class, DefaultPlaceholder):
+            self.response_class = self.response_class.value
+
+    async def __call__(self, request_body: dict) -> InProcessResponse:
+        """
+        Calls the endpoint with a request body.
+
+        :param request_body: The body of the request, as a dictionary.
+        :return: The endpoint's response.
+        """
+        kwargs = {}
+        sub_response = Response()
+        sub_response.status_code = None
+        del sub_response.headers["content-length"]
+        if self.response_param:
+            kwargs[self.response_param] = sub_response
+
+        try:
+            if self.body_param:
+                kwargs[self.body_param] = self.body_adapter.validate_python(
+                    request_body
+                )
+            if inspect.iscoroutinefunction(self.route.endpoint):
+                result = await self.route.endpoint(**kwargs)
+            else:
+                result = self.route.endpoint(**kwargs)
+        except ValidationError as error:
+            errors = [
+                {**detail, "loc": ("body", *detail["loc"])}
+                for detail in error.errors(include_url=False)
+            ]
+            return InProcessResponse(
+                422,
+                {"content-type": "application/json"},
+                jsonable_encoder({"detail": errors}),
+            )
+        except HTTPException as error:
+            return InProcessResponse(
+                error.status_code,
+                {"content-type": "application/json", **(error.headers or {})},
+                {"detail": error.detail},
+            )
+
+        if isinstance(result, Response):
+            return InProcessResponse(
+                result.status_code, dict(result.headers), content=result.body
+            )
+
+        if self.response_adapter is not None:
+            if isinstance(result, BaseModel):
+                result = result.model_dump(by_alias=True)
+            result = self.response_adapter.dump_python(
+                self.response_adapter.validate_python(result),
+                mode="json",
+                by_alias=True,
+            )
+        elif isinstance(result, BaseModel):
+            result = result.model_dump(mode="json", by_alias=True)
+        status_code = sub_response.status_code or self.route.status_code or 200
+        return InProcessResponse(
+            status_code,
+            {**sub_response.headers, "content-type": "application/json"},
+            result,
+            response_class=self.response_class,
+        )
+
+
+def load_container_app(container_dir: Path):
+    """
+    Imports the FastAPI app of a building block container. Every container
+    names its package `app`, as orchestration does, so the container's
+    modules are imported in place of orchestration's and then set aside,
+    leaving orchestration's own modules in place.
+
+    :param container_dir: The directory of the container.
+    :return: The container's FastAPI app.
+    """
+
+    def _pop_app_modules() -> dict:
+        return {
+            name: sys.modules.pop(name)
+            for name in list(sys.modules)
+            if name == "app" or name.startswith("app.")
+        }
+
+    orchestration_modules = _pop_app_modules()
+    sys.path.insert(0, str(container_dir))
+    try:
+        return importlib.import_module("app.main").app
+    finally:
+        sys.path.remove(str(container_dir))
+        _pop_app_modules()
+        sys.modules.update(orchestration_modules)
+
+
+def _iter_api_routes(routes: list) -> Iterator[APIRoute]:
+    for route in routes:
+        if isinstance(route, APIRoute):
+            yield route
+        else:
+            # Newer FastAPI releases keep included routers as nested routes
+            router = getattr(route, "original_router", route)
+            yield from _iter_api_routes(getattr(router, "routes", []))
+
+
+def load_local_endpoints(containers_dir: Path) -> dict:
+    """
+    Loads the POST endpoints of every building block whose container can be
+    found and imported. Building blocks that fail to load are logged and
+    left to be called over HTTP.
+
+    :param containers_dir: The directory holding the building block
+      containers.
+    :return: A dictionary of `InProcessEndpoint` objects, keyed by service
+      name and endpoint path.
+    """
+    endpoints = {}
+    for service, container in SERVICE_CONTAINERS.items():
+        container_dir = Path(containers_dir) / container
+        try:
+            container_app = load_container_app(container_dir)
+        except Exception as error:
+            logger.warning(
+                f"Calling {service} over HTTP; its container at {container_dir} "
+                f"could not be loaded: {error}"
+            )
+            continue
+        for route in _iter_api_routes(container_app.routes):
+            if "POST" not in route.methods:
+                continue
+            try:
+                endpoints[(service, route.path)] = InProcessEndpoint(route)
+            except ValueError as error:
+                logger.warning(f"Calling {service} over HTTP for {error}")
+    return endpoints
+
+
+async def send_step_in_process(step: dict, request_body: dict):
+    """
+    Sends the request of a compiled workflow step to its building block
+    in-process if the building block is loaded, or over HTTP otherwise. If
+    the message in the request is also read elsewhere in the workflow, the
+    request is copied first, since building blocks may modify their input.
+
+    :param step: The compiled workflow step, from `compile_workflow`.
+    :param request_body: The body of the request to send.
+    :return: The building block's response.
+    """
+    endpoint = _local_endpoints.get((step["service"], step["endpoint"]))
+    if endpoint is None:
+        return await send_step_request(step, request_body)
+
+    with tracer.start_as_current_span(
+        "call-building-block-in-process",
+        kind=trace.SpanKind(0),
+        attributes={"service": step["service"], "endpoint": step["endpoint"]},
+    ):
+        if step["message_is_shared"]:
+            request_body = copy.deepcopy(request_body)
+        return await endpoint(request_body)
+
+
+def initialize_worker(containers_dir: Path = DEFAULT_CONTAINERS_DIR) -> None:
+    """
+    Prepares the current process to run workflows in-process: loads the
+    building blocks and creates the event loop the workflows run on.
+
+    :param containers_dir: The directory holding the building block
+      containers.
+    """
+    global _loaded_containers_dir, _event_loop
+    containers_dir = Path(containers_dir)
+    if _loaded_containers_dir != containers_dir:
+        _local_endpoints.clear()
+        _local_endpoints.update(load_local_endpoints(containers_dir))
+        _loaded_containers_dir = containers_dir
+    if _event_loop is None:
+        _event_loop = asyncio.new_event_loop()
+
+
+def process_message(
+    message_type: str, data_type: str, config_file_name: str, ecr_data: dict
+) -> dict:
+    """
+    Applies a workflow to one message in the current process, which must
+    have been prepared with `initialize_worker`.
+
+    :param message_type: The type of data being supplied for orchestration.
+    :param data_type: The type of data of the message.
+    :param config_file_name: The name of the workflow configuration file.
+    :param ecr_data: The message, as a dictionary holding the name of the
+      `file` it came from, the message itself as `ecr`, and optionally its
+      `rr` data.
+    :return: A dictionary holding the message's `file`, the workflow's
+      `status_code`, and its `response`.
+    """
+    return _event_loop.run_until_complete(
+        _apply_workflow_to_bulk_message(
+            message_type,
+            data_type,
+            config_file_name,
+            ecr_data,
+            step_sender=send_step_in_process,
+        )
+    )
+
+
+def run_pipeline(
+    message_type: str,
+    data_type: str,
+    config_file_name: str,
+    messages: Iterable[dict],
+    processes: Optional[int] = None,
+    containers_dir: Path = DEFAULT_CONTAINERS_DIR,
+) -> Iterator[dict]:
+    """
+    Applies a workflow to many messages in-process, spread over a pool of
+    worker processes. Results are returned in the order of the messages,
+    and only a few messages per process are read ahead of the results.
+
+    :param message_type: The type of data being supplied for orchestration.
+    :param data_type: The type of data of the messages.
+    :param config_file_name: The name of the workflow configuration file to
+      apply to each message.
+    :param messages: The messages, as dictionaries holding the name of the
+      `file` each came from, the message itself as `ecr`, and optionally its
+      `rr` data, like those returned by `iter_ecr_data`.
+    :param processes: The number of worker processes. Defaults to the number
+      of CPUs; zero runs every message in the current process.
+    :param containers_dir: The directory holding the building block
+      containers.
+    :return: An iterator of results, one per message, as returned by
+      `process_message`.
+    :raises FileNotFoundError: If the workflow config cannot be found.
+    """
+    load_processing_config(config_file_name)
+    args = (message_type, data_type, config_file_name)
+
+    if processes == 0:
+        initialize_worker(containers_dir)
+        for ecr_data in messages:
+            yield process_message(*args, ecr_data)
+        return
+
+    processes = processes or os.cpu_count()
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=initialize_worker,
+        initargs=(containers_dir,),
+    ) as executor:
+        pending = deque()
+        for ecr_data in messages:
+            pending.append(executor.submit(process_message, *args, ecr_data))
+            if len(pending) >= processes * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_messages(paths: Iterable[Path], data_type: str) -> Iterator[dict]:
+    """
+    Reads messages to process from files. A zip file may hold many eICRs,
+    each with an optional RR alongside it, as in the bulk mode of the
+    `/process-zip` endpoint; a directory is read file by file; any other
+    file is a single message, parsed as JSON if the data type is `fhir`.
+
+    :param paths: The paths of the files and directories to read.
+    :param data_type: The type of data of the messages.
+    :return: An iterator of messages, in the format `run_pipeline` takes.
+    """
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            yield from read_messages(
+                sorted(file for file in path.rglob("*") if file.is_file()),
+                data_type,
+            )
+        elif is_zipfile(path):
+            with ZipFile(path) as zipfile:
+                for ecr_data in iter_ecr_data(zipfile):
+                    yield {**ecr_data, "file": f"{path}/{ecr_data['file']}"}
+        else:
+            message = path.read_text(encoding="utf-8")
+            if data_type == "fhir":
+                message = json.loads(message)
+            yield {"file": str(path), "ecr": message}
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """
+    Applies a workflow config to the messages named on the command line and
+    writes each message's result to stdout as a line of JSON.
+
+    :param argv: Optionally, the command line arguments to parse instead of
+      `sys.argv`.
+    """
+    parser = argparse.ArgumentParser(
+        description="Apply an orchestration workflow config to many messages, "
+        "calling the building blocks in-process."
+    )
+    parser.add_argument(
+        "config_file_name", help="The name of the workflow config to apply."
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        type=Path,
+        help="Message files, zip files of eICRs, or directories of them.",
+    )
+    parser.add_argument("--message-type", default="ecr")
+    parser.add_argument("--data-type", default="ecr")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="The number of worker processes (default: one per CPU).",
+    )
+    parser.add_argument(
+        "--containers-dir",
+        type=Path,
+        default=DEFAULT_CONTAINERS_DIR,
+        help="The directory holding the building block containers.",
+    )
+    args = parser.parse_args(argv)
+
+    results = run_pipeline(
+        args.message_type,
+        args.data_type,
+        args.config_file_name,
+        read_messages(args.inputs, args.data_type),
+        processes=args.processes,
+        containers_dir=args.containers_dir,
+    )
+    for result in results:
+        sys.stdout.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import asyncio
+import math
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import HTTPException, status
+from httpx import Response
+from opentelemetry import metrics
+
+from app.admission import ConcurrencyLimiter
+from app.config import get_settings
+
+meter = metrics.get_meter("orchestration_resilience_meter")
+
+hedged_request_counter = meter.create_counter(
+    "hedged_requests",
+    description="The number of hedged requests sent to a building block, by"
+    " whether the `primary` or the `hedge` request answered first.",
+)
+circuit_breaker_rejection_counter = meter.create_counter(
+    "circuit_breaker_rejections",
+    description="The number of requests to a building block that failed fast"
+    " because the service's circuit breaker was open.",
+)
+
+# Endpoints that only read their input, so sending the same request twice
+# is harmless and hedging is allowed
+IDEMPOTENT_ENDPOINTS = [
+    "validate",
+    "convert-to-fhir",
+    "standardize_names",
+    "standardize_dob",
+    "standardize_phones",
+    "standardize_bundle",
+    "stamp-condition-extensions",
+    "parse_message",
+    "fhir_to_phdc",
+]
+
+# Recent response times of each service endpoint, in seconds, from which
+# the delay before hedging a request is derived
+_latencies: dict[tuple[str, str], deque] = {}
+
+
+def record_latency(service: str, endpoint: str, seconds: float) -> None:
+    """
+    Records how long a service endpoint took to respond.
+
+    :param service: The name of the service.
+    :param endpoint: The endpoint of the service.
+    :param seconds: The time the endpoint took to respond.
+    """
+    latencies = _latencies.get((service, endpoint))
+    if latencies is None:
+        latencies = deque(maxlen=get_settings()["hedge_latency_window"])
+        _latencies[(service, endpoint)] = latencies
+    latencies.append(seconds)
+
+
+def get_hedge_delay(service: str, endpoint: str) -> float:
+    """
+    Works out how long to wait for a response from a service endpoint before
+    hedging the request: the `hedge_percentile` of its recent response times,
+    or `hedge_default_delay_seconds` until enough of them have been recorded.
+
+    :param service: The name of the service.
+    :param endpoint: The endpoint of the service.
+    :return: The delay before hedging, in seconds.
+    """
+    settings = get_settings()
+    latencies = sorted(_latencies.get((service, endpoint), ()))
+    if len(latencies) < settings["hedge_min_samples"]:
+        return settings["hedge_default_delay_seconds"]
+    rank = math.ceil(settings["hedge_percentile"] / 100 * len(latencies))
+    return latencies[max(rank, 1) - 1]
+
+
+async def send_hedged_request(
+    send_request: Callable[[], Awaitable[Response]],
+    delay: float,
+    attributes: dict,
+    limiter: Optional[ConcurrencyLimiter] = None,
+) -> Response:
+    """
+    Sends a request and, if no response has arrived after `delay` seconds,
+    sends it a second time, returning whichever response arrives first. If
+    one of the two requests fails, the other's result is used. Only safe for
+    idempotent requests.
+
+    :param send_request: A function that sends the request once.
+    :param delay: How long to wait for the first request before hedging.
+    :param attributes: The `service` and `endpoint` of the request, for
+      metrics.
+    :param limiter: Optionally, the limiter of the service the request is
+      sent to. The second request then takes a slot of its own, held until it
+      completes or is cancelled, and is not sent if no slot is free.
+    :return: The first response to arrive.
+    """
+    primary = asyncio.create_task(send_request())
+    names = {primary: "primary"}
+    pending = {primary}
+    error = None
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done and (limiter is None or await limiter.try_acquire()):
+            hedge = asyncio.create_task(send_request())
+            if limiter is not None:
+                hedge.add_done_callback(lambda _: limiter.release())
+            names[hedge] = "hedge"
+            pending.add(hedge)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    if len(names) > 1:
+                        hedged_request_counter.add(
+                            1, {**attributes, "winner": names[task]}
+                        )
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive failures of a building block. After
+    `failure_threshold` failures in a row, the circuit opens and requests
+    fail fast with a 503 for `reset_seconds`; the next request after that is
+    let through as a trial, which closes the circuit if it succeeds or opens
+    it again if it fails.
+    """
+
+    def __init__(self, service: str, failure_threshold: int, reset_seconds: float):
+        """
+        :param service: The name of the service the breaker protects.
+        :param failure_threshold: The number of consecutive failures that
+          opens the circuit.
+        :param reset_seconds: How long the circuit stays open.
+        """
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    def before_request(self) -> None:
+        """
+        Checks whether a request may be sent to the service.
+
+        :raises HTTPException: With a status of 503 if the circuit is open.
+        """
+        if self.opened_at is None:
+            return
+        remaining = self.opened_at + self.reset_seconds - time.monotonic()
+        if remaining <= 0 and not self.trial_in_progress:
+            self.trial_in_progress = True
+            return
+        circuit_breaker_rejection_counter.add(1, {"service": self.service})
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Service {self.service} is unavailable; its circuit breaker "
+            "is open.",
+            headers={"Retry-After": str(max(math.ceil(remaining), 1))},
+        )
+
+    def abandon_request(self) -> None:
+        """
+        Records a request that was cancelled before the service answered, so
+        that a cancelled trial request does not keep the circuit open.
+        """
+        self.trial_in_progress = False
+
+    def record_success(self) -> None:
+        """
+        Records a request the service answered, closing the circuit.
+        """
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    def record_failure(self) -> None:
+        """
+        Records a request the service failed, opening the circuit once the
+        failure threshold is reached or a trial request fails.
+        """
+        self.failures += 1
+        if self.trial_in_progress or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.trial_in_progress = False
+
+
+@lru_cache
+def get_circuit_breaker(service: str) -> CircuitBreaker:
+    """
+    Returns the circuit breaker of a building block, configured from the
+    service's settings.
+
+    :param service: The name of the service, as keyed in `SERVICE_URLS`.
+    """
+    settings = get_settings()
+    return CircuitBreaker(
+        service,
+        settings["circuit_breaker_failure_threshold"],
+        settings["circuit_breaker_reset_seconds"],
+    )
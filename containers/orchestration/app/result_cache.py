@@ -0,0 +1,251 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Union
+
+from opentelemetry import metrics
+
+from app.config import get_settings
+
+meter = metrics.get_meter("orchestration_result_cache_meter")
+
+result_cache_counter = meter.create_counter(
+    "workflow_result_cache_lookups",
+    description="The number of workflow result cache lookups, by whether the"
+    " lookup was a `hit` or a `miss`.",
+)
+
+
+class WorkflowResultCache(ABC):
+    """
+    Stores the final responses of successful workflows so that a duplicate
+    submission of the same message to the same config can be answered without
+    calling any building blocks. Entries expire after `ttl_seconds`, and once
+    the cache holds more than `max_entries` the oldest entries are evicted.
+
+    This class defines the interface of a cache backend; subclasses decide
+    where the entries are kept. Backends may block on I/O, so callers on the
+    event loop should run them in a thread.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Looks up a cached workflow response, recording whether it was found.
+
+        :param key: The cache key of the workflow, from `make_cache_key`.
+        :return: The cached response, as a dictionary with `status_code`,
+          `media_type` and `content` keys, or None if there is no live entry.
+        """
+        entry = self._get(key)
+        result_cache_counter.add(1, {"result": "hit" if entry else "miss"})
+        return entry
+
+    @abstractmethod
+    def put(self, key: str, status_code: int, media_type: str, content: bytes):
+        """
+        Stores the response of a workflow.
+
+        :param key: The cache key of the workflow, from `make_cache_key`.
+        :param status_code: The status code of the workflow's response.
+        :param media_type: The media type of the workflow's response.
+        :param content: The body of the workflow's response.
+        """
+        pass  # pragma: no cover
+
+    @abstractmethod
+    def clear(self):
+        """
+        Removes every entry from the cache.
+        """
+        pass  # pragma: no cover
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[dict]:
+        pass  # pragma: no cover
+
+
+class MemoryWorkflowResultCache(WorkflowResultCache):
+    """
+    A workflow result cache held in process memory, for single-instance
+    deployments and local development.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        super().__init__(ttl_seconds, max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key: str, status_code: int, media_type: str, content: bytes):
+        """
+        Stores the response of a workflow.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (
+                time.time(),
+                {
+                    "status_code": status_code,
+                    "media_type": media_type,
+                    "content": content,
+                },
+            )
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes every entry from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, response = entry
+            if time.time() - created > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            return response
+
+
+class SQLiteWorkflowResultCache(WorkflowResultCache):
+    """
+    A workflow result cache kept in a local SQLite database, so that cached
+    results survive restarts and can be shared by the workers of one host.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int, path: str):
+        super().__init__(ttl_seconds, max_entries)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS workflow_results ("
+            "key TEXT PRIMARY KEY, created REAL NOT NULL, status_code INTEGER, "
+            "media_type TEXT, content BLOB)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS workflow_results_created "
+            "ON workflow_results (created)"
+        )
+        self._connection.commit()
+
+    def put(self, key: str, status_code: int, media_type: str, content: bytes):
+        """
+        Stores the response of a workflow, evicting expired entries and, if
+        the cache is full, the oldest ones.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO workflow_results VALUES (?, ?, ?, ?, ?)",
+                (key, now, status_code, media_type, content),
+            )
+            self._connection.execute(
+                "DELETE FROM workflow_results WHERE created < ?",
+                (now - self.ttl_seconds,),
+            )
+            self._connection.execute(
+                "DELETE FROM workflow_results WHERE key IN (SELECT key FROM "
+                "workflow_results ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        """
+        Removes every entry from the cache.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM workflow_results")
+
+    def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT status_code, media_type, content FROM workflow_results "
+                "WHERE key = ? AND created >= ?",
+                (key, time.time() - self.ttl_seconds),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"status_code": row[0], "media_type": row[1], "content": row[2]}
+
+
+@lru_cache
+def get_result_cache() -> Optional[WorkflowResultCache]:
+    """
+    Creates the workflow result cache selected by the service's settings.
+
+    :return: The workflow result cache, or None if caching is disabled.
+    """
+    settings = get_settings()
+    if not settings["result_cache_enabled"]:
+        return None
+    ttl_seconds = settings["result_cache_ttl_seconds"]
+    max_entries = settings["result_cache_max_entries"]
+    match settings["result_cache_backend"]:
+        case "memory":
+            return MemoryWorkflowResultCache(ttl_seconds, max_entries)
+        case "sqlite":
+            return SQLiteWorkflowResultCache(
+                ttl_seconds, max_entries, settings["result_cache_path"]
+            )
+    raise ValueError(
+        f"Unknown result cache backend: {settings['result_cache_backend']}"
+    )
+
+
+def make_cache_key(
+    message_type: str,
+    data_type: str,
+    config_file_name: str,
+    processing_config: dict,
+    message: Union[dict, str],
+    rr_content: Optional[str],
+) -> str:
+    """
+    Computes the cache key of a workflow run from a digest of its input
+    message and RR data, the name of the config applied, and the config's
+    version, which is a digest of the config's content so that uploading a
+    new version of a config invalidates the results cached for the old one.
+
+    :param message_type: The type of data being supplied for orchestration.
+    :param data_type: The type of data of the passed-in message.
+    :param config_file_name: The name of the workflow configuration file.
+    :param processing_config: The loaded workflow configuration.
+    :param message: The content of the message.
+    :param rr_content: The reportability response associated with the eCR.
+    :return: The hex digest identifying the workflow run.
+    """
+    message_digest = hashlib.sha256()
+    for content in (message, rr_content):
+        if isinstance(content, dict):
+            content = json.dumps(content, sort_keys=True)
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        message_digest.update(hashlib.sha256(content or b"").digest())
+
+    config_version = hashlib.sha256(
+        json.dumps(processing_config, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+    key = json.dumps(
+        [
+            message_digest.hexdigest(),
+            message_type,
+            data_type,
+            config_file_name,
+            config_version,
+        ]
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
@@ -1,11 +1,23 @@
+import asyncio
 import json
 import os
+import time
+from collections import Counter, OrderedDict
+from collections.abc import Awaitable, Callable
 
-import requests
+import httpx
 from fastapi import HTTPException, Response, WebSocket
-from opentelemetry import trace
+from opentelemetry import metrics, trace
 from opentelemetry.trace.status import StatusCode
 
+from app.admission import get_service_limiter
+from app.base_service import (
+    MINIMUM_COMPRESSION_SIZE,
+    compress_content,
+    negotiate_content_encoding,
+    orjson,
+)
+from app.config import get_settings
 from app.handlers.request_builders.ecr_viewer import build_save_fhir_data_body
 from app.handlers.request_builders.fhir_converter import build_fhir_converter_request
 from app.handlers.request_builders.ingestion import (
@@ -13,6 +25,7 @@ from app.handlers.request_builders.ingestion import (
     build_ingestion_dob_request,
     build_ingestion_name_request,
     build_ingestion_phone_request,
+    build_ingestion_standardize_bundle_request,
     build_validation_request,
 )
 from app.handlers.request_builders.message_parser import (
@@ -37,10 +50,46 @@ from app.handlers.response_builders.trigger_code_reference import (
 )
 from app.handlers.ServiceHandlerResponse import ServiceHandlerResponse
 from app.models import OrchestrationRequest
+from app.resilience import (
+    IDEMPOTENT_ENDPOINTS,
+    get_circuit_breaker,
+    get_hedge_delay,
+    record_latency,
+    send_hedged_request,
+)
 from app.utils import format_service_url
 
 # Integrate services tracer with automatic instrumentation context
 tracer = trace.get_tracer("orchestration_services.py_tracer")
+meter = metrics.get_meter("orchestration_services_meter")
+
+# Configure per-step metrics, attributed by the `service` and `endpoint` called
+service_request_duration_histogram = meter.create_histogram(
+    "service_request_duration",
+    unit="s",
+    description="The time taken by a building block to respond to a request"
+    " from a workflow step.",
+)
+service_request_size_histogram = meter.create_histogram(
+    "service_request_size",
+    unit="By",
+    description="The size of the uncompressed JSON body sent to a building block.",
+)
+service_response_size_histogram = meter.create_histogram(
+    "service_response_size",
+    unit="By",
+    description="The size of the decompressed body returned by a building block.",
+)
+service_requests_in_flight = meter.create_up_down_counter(
+    "service_requests_in_flight",
+    description="The number of requests currently awaiting a building block.",
+)
+workflow_step_wait_histogram = meter.create_histogram(
+    "workflow_step_wait_duration",
+    unit="s",
+    description="The time a workflow step spent queued, waiting for the steps"
+    " it depends on, before its request was sent.",
+)
 
 # Locations of the various services the service will delegate
 SERVICE_URLS = {
@@ -63,6 +112,7 @@ ENDPOINT_TO_REQUEST_BODY = {
     "standardize_names": build_ingestion_name_request,
     "standardize_dob": build_ingestion_dob_request,
     "standardize_phones": build_ingestion_phone_request,
+    "standardize_bundle": build_ingestion_standardize_bundle_request,
     "stamp-condition-extensions": build_stamp_condition_extensions_request,
     "parse_message": build_message_parser_message_request,
     "fhir_to_phdc": build_message_parser_phdc_request,
@@ -75,23 +125,203 @@ ENDPOINT_TO_RESPONSE = {
     "standardize_names": unpack_ingestion_standardization,
     "standardize_dob": unpack_ingestion_standardization,
     "standardize_phones": unpack_ingestion_standardization,
+    "standardize_bundle": unpack_ingestion_standardization,
     "stamp-condition-extensions": unpack_stamp_condition_extensions_response,
     "parse_message": unpack_parsed_message_response,
     "fhir_to_phdc": unpack_fhir_to_phdc_response,
     "save-fhir-data": unpack_save_fhir_data_response,
 }
 
+# Services whose responses do not update the message handed to later steps
+MESSAGE_PRESERVING_SERVICES = ["validation", "save_bundle"]
+# Services that persist data, which in a dependency-graph workflow also wait on
+# every preceding step in VALIDATING_SERVICES
+SIDE_EFFECT_SERVICES = ["save_bundle", "save_metadata"]
+# Services that only check the message, rather than produce data later steps use
+VALIDATING_SERVICES = ["validation"]
+
+
+# Pooled async HTTP clients, one per downstream service, created lazily
+# on first use and reused across requests so connections stay alive
+_http_clients: dict[str, httpx.AsyncClient] = {}
+
+# The request body encoding each service has advertised that it accepts
+_service_request_encodings: dict[str, str] = {}
+
+
+def get_http_client(service: str) -> httpx.AsyncClient:
+    """
+    Returns the shared async HTTP client for a DIBBs building block,
+    creating it on first use. Each service gets its own connection pool,
+    sized from the service settings, so that a slow building block can
+    only tie up its own connections.
+
+    :param service: The name of the service, as keyed in `SERVICE_URLS`.
+    :return: A pooled `httpx.AsyncClient` for the service.
+    """
+    client = _http_clients.get(service)
+    if client is None or client.is_closed:
+        settings = get_settings()
+        max_connections = settings["service_connection_limits"].get(
+            service, settings["service_max_connections"]
+        )
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=min(
+                    max_connections, settings["service_max_keepalive_connections"]
+                ),
+            ),
+            timeout=httpx.Timeout(
+                settings["service_timeout_seconds"],
+                connect=settings["service_connect_timeout_seconds"],
+            ),
+        )
+        _http_clients[service] = client
+    return client
+
+
+async def close_http_clients() -> None:
+    """
+    Closes every pooled HTTP client and releases its connections. Called
+    when the application shuts down.
+    """
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    for client in clients:
+        await client.aclose()
+
 
-def post_request(url: str, payload: dict) -> Response:
+def _serialize_payload(payload: dict) -> bytes:
+    """
+    Serializes a request payload to JSON bytes, using orjson when it is
+    installed since it is much faster on large FHIR bundles.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(payload).encode("utf-8")
+
+
+async def post_request(
+    url: str, payload: dict, service: str | None = None, endpoint: str | None = None
+) -> Response:
     """
     Helper function to post an API request to a particular endpoint using
-    the `requests` module.
+    the pooled async client of the service being called. Responses are
+    decompressed transparently. Once a service has advertised the request
+    encodings it accepts (through the `Accept-Encoding` header of its
+    responses), large request bodies sent to it are compressed as well;
+    services that never advertise any are always sent plain JSON.
 
     :param url: The full URL of the endpoint to-hit.
     :param payload: The body of the Request object, as a dictionary.
+    :param service: The name of the service being called, which selects
+      the connection pool to use.
+    :param endpoint: The endpoint being called, used to attribute the
+      request's metrics. Defaults to the path of the URL.
+    :return: A Response object from the posted endpoint.
+    """
+    service = service or "default"
+    attributes = {"service": service, "endpoint": endpoint or httpx.URL(url).path}
+    content = _serialize_payload(payload)
+    service_request_size_histogram.record(len(content), attributes)
+
+    service_requests_in_flight.add(1, attributes)
+    started = time.perf_counter()
+    status_code = "error"
+    try:
+        response = await _send_request_content(url, content, service)
+        status_code = str(response.status_code)
+    finally:
+        duration = time.perf_counter() - started
+        service_requests_in_flight.add(-1, attributes)
+        service_request_duration_histogram.record(
+            duration, {**attributes, "status_code": status_code}
+        )
+    record_latency(service, attributes["endpoint"], duration)
+    service_response_size_histogram.record(len(response.content), attributes)
+    return response
+
+
+async def _send_request_content(url: str, content: bytes, service: str) -> Response:
+    """
+    Posts a serialized JSON body to a service, compressing it if the service
+    has advertised an encoding it accepts, and learns the encodings the
+    service advertises in its response.
+    """
+    client = get_http_client(service)
+    headers = {"Content-Type": "application/json"}
+
+    encoding = _service_request_encodings.get(service)
+    if encoding and len(content) >= MINIMUM_COMPRESSION_SIZE:
+        response = await client.post(
+            url,
+            content=compress_content(content, encoding),
+            headers={**headers, "Content-Encoding": encoding},
+        )
+        if response.status_code != 415:
+            return response
+        # The service no longer accepts compressed bodies, so stop sending them
+        _service_request_encodings.pop(service, None)
+
+    response = await client.post(url, content=content, headers=headers)
+    advertised = negotiate_content_encoding(response.headers.get("accept-encoding", ""))
+    if advertised:
+        _service_request_encodings[service] = advertised
+    return response
+
+
+async def send_step_request(step: dict, request_body: dict) -> Response:
+    """
+    Posts the request of a compiled workflow step to its service, applying
+    the step's hedging and circuit breaking options. A service's circuit
+    breaker counts responses with a 5xx status and connection failures as
+    failures.
+
+    :param step: The compiled workflow step, from `compile_workflow`.
+    :param request_body: The body of the request to post.
     :return: A Response object from the posted endpoint.
     """
-    return requests.post(url, json=payload)
+    service = step["service"]
+    endpoint = step["endpoint"]
+    breaker = get_circuit_breaker(service) if step["circuit_breaker"] else None
+    if breaker is not None:
+        breaker.before_request()
+
+    def send_request():
+        return post_request(step["service_url"], request_body, service, endpoint)
+
+    try:
+        if step["hedge"]:
+            delay = step["hedge_delay_seconds"]
+            if delay is None:
+                delay = get_hedge_delay(service, endpoint)
+            response = await send_hedged_request(
+                send_request,
+                delay,
+                {"service": service, "endpoint": endpoint},
+                get_service_limiter(service),
+            )
+        else:
+            response = await send_request()
+    except httpx.TransportError:
+        if breaker is not None:
+            breaker.record_failure()
+        raise
+    except asyncio.CancelledError:
+        if breaker is not None:
+            breaker.abandon_request()
+        raise
+
+    if breaker is not None:
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+    return response
 
 
 async def _send_websocket_dump(
@@ -148,48 +378,237 @@ async def _send_websocket_dump(
         return progress_dict
 
 
+def resolve_step_dependencies(workflow: list[dict]) -> list[dict]:
+    """
+    Works out the order in which the steps of a workflow config may run.
+    By default, each step depends on the step before it and the workflow
+    runs strictly in sequence. If any step declares a `depends_on` list of
+    step names, the workflow is instead run as a dependency graph: steps
+    with an explicit `depends_on` wait only on those steps, while every
+    other step has its dependencies inferred from the message it reads
+    (the most recent preceding step that updates the message) and from
+    its `previous_response_to_param_mapping`. Steps that save data also
+    wait on the validation steps before them, so nothing is persisted for
+    a message that failed validation.
+
+    :param workflow: The list of steps in a workflow config.
+    :return: A list with one entry per step, holding the indices of the
+      steps it depends on (`depends_on`), the index of the step whose
+      output is its input message (`message_source`, or None for the
+      original message), and the index of the step each previous response
+      mapping reads from (`response_sources`).
+    """
+    run_as_graph = any(step.get("depends_on") is not None for step in workflow)
+    plan = []
+    for index, step in enumerate(workflow):
+        preceding_names = {
+            workflow[i].get("name", workflow[i]["service"]): i for i in range(index)
+        }
+
+        def _find_step(name: str) -> int:
+            if name not in preceding_names:
+                raise ValueError(
+                    f"Step {index} of the workflow references '{name}', but no "
+                    "preceding step has that name."
+                )
+            return preceding_names[name]
+
+        response_sources = {
+            name: _find_step(name)
+            for name in (step.get("previous_response_to_param_mapping") or {})
+        }
+
+        if not run_as_graph:
+            depends_on = {index - 1} if index > 0 else set()
+        elif step.get("depends_on") is not None:
+            depends_on = {_find_step(name) for name in step["depends_on"]}
+        else:
+            depends_on = set()
+            updaters = [
+                i
+                for i in range(index)
+                if workflow[i]["service"] not in MESSAGE_PRESERVING_SERVICES
+            ]
+            if updaters:
+                depends_on.add(updaters[-1])
+            if step["service"] in SIDE_EFFECT_SERVICES:
+                depends_on |= {
+                    i
+                    for i in range(index)
+                    if workflow[i]["service"] in VALIDATING_SERVICES
+                }
+        depends_on |= set(response_sources.values())
+
+        # A step reads the message produced by the latest updating step
+        # among everything it (transitively) waits on
+        ancestors = set(depends_on)
+        for i in depends_on:
+            ancestors |= plan[i]["ancestors"]
+        updating_ancestors = [
+            i
+            for i in ancestors
+            if workflow[i]["service"] not in MESSAGE_PRESERVING_SERVICES
+        ]
+        plan.append(
+            {
+                "depends_on": depends_on,
+                "ancestors": ancestors,
+                "message_source": max(updating_ancestors, default=None),
+                "response_sources": response_sources,
+            }
+        )
+    return plan
+
+
+def compile_workflow(config: dict) -> dict:
+    """
+    Compiles a workflow config into the plan `call_apis` executes: each step
+    has its handlers, service URL and dependency structure resolved up front,
+    so none of it is redone for each message.
+
+    Each step also records whether the message it receives is read anywhere
+    else (`message_is_shared`): by another step, or through the response of
+    the step that produced it, which later steps and the workflow's outputs
+    may read. A step run in-process that modifies its input in place must
+    then work on a copy of it.
+
+    :param config: The config-driven workflow extracted from a JSON file.
+    :return: A dictionary holding the compiled `steps` of the workflow, in
+      order, and the `config_description` used to annotate traces.
+    """
+    workflow = config.get("workflow", [])
+    plan = resolve_step_dependencies(workflow)
+    message_readers = Counter(step_plan["message_source"] for step_plan in plan)
+    read_responses = {
+        index for step_plan in plan for index in step_plan["response_sources"].values()
+    }
+    output_names = set(config.get("outputs") or [])
+    steps = []
+    for step, step_plan in zip(workflow, plan):
+        message_source = step_plan["message_source"]
+        endpoint = step["endpoint"]
+        endpoint_name = endpoint.split("/")[-1]
+        if step.get("hedge") and endpoint_name not in IDEMPOTENT_ENDPOINTS:
+            raise ValueError(f"`hedge` cannot be enabled for the endpoint {endpoint}.")
+        steps.append(
+            {
+                **step_plan,
+                "name": step.get("name", step["service"]),
+                "service": step["service"],
+                "endpoint": endpoint,
+                "endpoint_name": endpoint_name,
+                "service_url": format_service_url(
+                    SERVICE_URLS[step["service"]], endpoint
+                ),
+                "request_body_func": ENDPOINT_TO_REQUEST_BODY[endpoint_name],
+                "response_func": ENDPOINT_TO_RESPONSE[endpoint_name],
+                "params": step.get("params") or {},
+                "previous_response_to_param_mapping": step.get(
+                    "previous_response_to_param_mapping", None
+                ),
+                "hedge": bool(step.get("hedge")),
+                "hedge_delay_seconds": step.get("hedge_delay_seconds"),
+                "circuit_breaker": bool(step.get("circuit_breaker")),
+                "message_is_shared": message_readers[message_source] > 1
+                or (
+                    message_source is not None
+                    and (
+                        message_source in read_responses
+                        or workflow[message_source].get("name") in output_names
+                    )
+                ),
+            }
+        )
+    return {"steps": steps, "config_description": str(config)}
+
+
+# Compiled workflows, keyed by the identity of the config they were compiled
+# from. `load_processing_config` returns the same config object until the
+# config's file changes, so a reloaded config is compiled afresh.
+_compiled_workflows: OrderedDict[int, tuple[dict, dict]] = OrderedDict()
+COMPILED_WORKFLOW_CACHE_SIZE = 128
+
+
+def get_compiled_workflow(config: dict) -> dict:
+    """
+    Returns the compiled plan of a workflow config, compiling it on first
+    use. The most recently used plans are kept.
+
+    :param config: The config-driven workflow extracted from a JSON file.
+    :return: The compiled workflow, as returned by `compile_workflow`.
+    """
+    cached = _compiled_workflows.get(id(config))
+    if cached is not None and cached[0] is config:
+        _compiled_workflows.move_to_end(id(config))
+        return cached[1]
+    compiled_workflow = compile_workflow(config)
+    _compiled_workflows[id(config)] = (config, compiled_workflow)
+    while len(_compiled_workflows) > COMPILED_WORKFLOW_CACHE_SIZE:
+        _compiled_workflows.popitem(last=False)
+    return compiled_workflow
+
+
 async def call_apis(
-    config: dict, input: OrchestrationRequest, websocket: WebSocket = None
+    config: dict,
+    input: OrchestrationRequest,
+    websocket: WebSocket = None,
+    step_sender: Callable[[dict, dict], Awaitable[Response]] = None,
 ) -> tuple:
     """
-    Asynchronous function that loops over each step in a provided workflow
-    config and performs each service step. The function builds a request
-    packet for each step, posts to the appropriate API, then unpacks the
-    service response. If the response is valid and has data, it is passed
-    to the next service as input. If the response was unsuccessful, the
-    function communicates errors to the caller.
+    Asynchronous function that performs each service step in a provided
+    workflow config. The function builds a request packet for each step,
+    posts to the appropriate API, then unpacks the service response. If the
+    response is valid and has data, it is passed to the steps that depend on
+    it as input. Steps run in sequence unless the config declares step
+    dependencies, in which case independent steps run concurrently (see
+    `resolve_step_dependencies`). If a response was unsuccessful, the
+    function communicates the error of the earliest failing step to the
+    caller.
 
     :param config: The config-driven workflow extracted from a JSON file.
     :param input: The original request to the orchestration service.
     :param websocket: Optionally, a socket to which to stream input
       bytes on the service's progress and results.
+    :param step_sender: Optionally, the function that sends each step's
+      request and returns its response, in place of `send_step_request`.
     :return: A tuple holding the concluding status code of the orchestration
       service, as well as each step's response along the way.
     """
+    compiled_workflow = get_compiled_workflow(config)
     with tracer.start_as_current_span(
         "call-apis",
         kind=trace.SpanKind(0),
         attributes={
-            "config": str(config),
+            "config": compiled_workflow["config_description"],
             "message_type": input.get("message_type"),
             "data_type": input.get("data_type"),
         },
     ) as call_span:
         call_span.add_event("unpacking input parameters")
-        workflow = config.get("workflow", [])
-        current_message = input.get("message")
-        response = current_message
-        responses = {}
+        workflow = compiled_workflow["steps"]
+        step_responses = {}
+        step_messages = {}
         # For websocket json dumps
         progress_dict = {}
-        for step in workflow:
+        websocket_lock = asyncio.Lock()
+
+        async def _run_step(index: int) -> None:
+            queued = time.perf_counter()
+            step = workflow[index]
+            if step["depends_on"]:
+                await asyncio.wait([tasks[i] for i in step["depends_on"]])
+                if any(tasks[i].cancelled() for i in step["depends_on"]) or any(
+                    tasks[i].exception() for i in step["depends_on"]
+                ):
+                    raise asyncio.CancelledError()
+
             service = step["service"]
             endpoint = step["endpoint"]
-            endpoint_name = endpoint.split("/")[-1]
-            params = step.get("params", {})
-            previous_response_to_param_mapping = step.get(
-                "previous_response_to_param_mapping", None
-            )
+            endpoint_name = step["endpoint_name"]
+            params = dict(step["params"])
+            previous_response_to_param_mapping = step[
+                "previous_response_to_param_mapping"
+            ]
             call_span.add_event(
                 "formatting parameters for service " + service,
                 attributes={
@@ -200,13 +619,13 @@ async def call_apis(
                     "previous_response_to_param_mapping": _param_dict_to_str(
                         previous_response_to_param_mapping
                     ),
+                    "depends_on": [str(i) for i in sorted(step["depends_on"])],
                 },
             )
 
-            service_url = format_service_url(SERVICE_URLS[service], endpoint)
-
-            request_body_func = ENDPOINT_TO_REQUEST_BODY[endpoint_name]
-            response_func = ENDPOINT_TO_RESPONSE[endpoint_name]
+            service_url = step["service_url"]
+            request_body_func = step["request_body_func"]
+            response_func = step["response_func"]
             call_span.add_event(
                 "packaging data to building block handler",
                 attributes={
@@ -217,21 +636,33 @@ async def call_apis(
 
             if previous_response_to_param_mapping:
                 for k, v in previous_response_to_param_mapping.items():
-                    params[v] = responses[k]
+                    params[v] = step_responses[step["response_sources"][k]]
+            message_source = step["message_source"]
+            current_message = (
+                input.get("message")
+                if message_source is None
+                else step_messages[message_source]
+            )
             request_body = request_body_func(current_message, input, params)
-            call_span.add_event("posting to `service_url` " + service_url)
-            response = post_request(service_url, request_body)
+            async with get_service_limiter(service).acquire():
+                workflow_step_wait_histogram.record(
+                    time.perf_counter() - queued,
+                    {"service": service, "endpoint": endpoint},
+                )
+                call_span.add_event("posting to `service_url` " + service_url)
+                response = await (step_sender or send_step_request)(step, request_body)
             call_span.add_event("response received from building block")
             service_response = response_func(response)
 
             if websocket:
-                progress_dict = await _send_websocket_dump(
-                    endpoint_name,
-                    response,
-                    service_response,
-                    progress_dict,
-                    websocket,
-                )
+                async with websocket_lock:
+                    await _send_websocket_dump(
+                        endpoint_name,
+                        response,
+                        service_response,
+                        progress_dict,
+                        websocket,
+                    )
 
             if service_response.status_code != 200:
                 call_span.record_exception(
@@ -264,13 +695,51 @@ async def call_apis(
                 )
 
             # Validation and save_bundle do not contain any updates to the data
-            if service not in ["validation", "save_bundle"]:
+            if service not in MESSAGE_PRESERVING_SERVICES:
                 call_span.add_event(
                     "updating input data with building block modifications"
                 )
-                current_message = service_response.msg_content
-            name = step.get("name", service)
-            responses[name] = response
+                step_messages[index] = service_response.msg_content
+            step_responses[index] = response
+
+        tasks = [
+            asyncio.create_task(_run_step(index)) for index in range(len(workflow))
+        ]
+        task_indices = {task: index for index, task in enumerate(tasks)}
+
+        # When a step fails, steps later in the workflow are cancelled, but
+        # earlier steps still finish so the reported error is the same one a
+        # sequential run would have raised
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_EXCEPTION
+                )
+                failed = [
+                    task_indices[task]
+                    for task in done
+                    if not task.cancelled() and task.exception() is not None
+                ]
+                if failed:
+                    for task in pending:
+                        if task_indices[task] > min(failed):
+                            task.cancel()
+        finally:
+            # If `call_apis` itself is cancelled, no step is left running
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        for task in tasks:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+        responses = {}
+        for index, step in enumerate(workflow):
+            responses[step["name"]] = step_responses[index]
+        response = (
+            step_responses[len(workflow) - 1] if workflow else input.get("message")
+        )
         call_span.set_status(StatusCode(1))
         return (response, responses)
 
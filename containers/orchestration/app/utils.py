@@ -2,7 +2,7 @@ import io
 import json
 import os
 import pathlib
-from functools import cache
+from collections.abc import Iterator
 from pathlib import Path
 from typing import Optional
 from zipfile import ZipFile
@@ -19,38 +19,71 @@ env_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
 
-@cache
+# Loaded configs, keyed by name, along with the path and modification time
+# of the file each was loaded from
+_processing_configs: dict[str, tuple[Path, int, dict]] = {}
+
+
 def load_processing_config(config_name: str) -> dict:
     """
     Load a processing config given its name. Look in the 'custom_configs/' directory
     first. If no custom configs match the provided name, check the configs provided by
     default with this service in the 'default_configs/' directory.
 
+    Loaded configs are cached, and are reloaded when the file they were read
+    from changes (or a custom config starts shadowing a default one), so
+    configs can be updated without restarting the service. The same config
+    object is returned until it is reloaded, which lets callers cache work
+    derived from it.
+
     If necessary, it will also replace .env variables.
 
     :param config_name: Name of config file
     :param path: The path to an extraction config file.
     :return: A dictionary containing the extraction config.
     """
-    custom_config_path = Path(__file__).parent / "custom_configs" / config_name
-    try:
-        with open(custom_config_path) as file:
-            processing_config = json.load(file)
-    except FileNotFoundError:
+    for config_path in (
+        Path(__file__).parent / "custom_configs" / config_name,
+        Path(__file__).parent / "default_configs" / config_name,
+    ):
         try:
-            default_config_path = (
-                Path(__file__).parent / "default_configs" / config_name
-            )
-            with open(default_config_path) as file:
+            modified_time = config_path.stat().st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+
+        cached = _processing_configs.get(config_name)
+        if cached is not None and cached[:2] == (config_path, modified_time):
+            return cached[2]
+        try:
+            with open(config_path) as file:
                 processing_config = json.load(file)
         except FileNotFoundError:
-            raise FileNotFoundError(
-                f"A config with the name '{config_name}' could not be found."
-            )
+            continue
+
+        # Replace placeholders with environment variable values
+        replace_env_var_placeholders(processing_config)
+        _processing_configs[config_name] = (
+            config_path,
+            modified_time,
+            processing_config,
+        )
+        return processing_config
 
-    # Replace placeholders with environment variable values
-    replace_env_var_placeholders(processing_config)
-    return processing_config
+    _processing_configs.pop(config_name, None)
+    raise FileNotFoundError(
+        f"A config with the name '{config_name}' could not be found."
+    )
+
+
+def invalidate_processing_config(config_name: str) -> None:
+    """
+    Drops a config from the cache of loaded configs, so that it is read from
+    disk the next time it is used. Called when a config is uploaded, since
+    file modification times may be too coarse to notice a quick rewrite.
+
+    :param config_name: Name of config file
+    """
+    _processing_configs.pop(config_name, None)
 
 
 def replace_env_var_placeholders(config: dict) -> None:
@@ -101,6 +134,20 @@ def unzip_http(upload_file: UploadFile) -> dict:
     return search_for_ecr_data(zipped_file)
 
 
+def unzip_http_bulk(upload_file: UploadFile) -> Iterator[dict]:
+    """
+    Opens an uploaded zip file holding many eCRs and lazily yields each eICR,
+    along with its RR if present. The archive is read in place from the
+    upload's spooled file rather than copied into memory, and each message is
+    only read once it is requested.
+
+    :param upload_file: The uploaded zip file.
+    :return: An iterator of ECR data dictionaries from the zip file.
+    """
+    zipped_file = ZipFile(upload_file.file, "r")
+    return iter_ecr_data(zipped_file)
+
+
 def load_json_from_binary(upload_file: UploadFile) -> dict:
     """
     Helper method to transform a buffered IO of bytes into a json dictionary.
@@ -135,6 +182,38 @@ def search_for_ecr_data(valid_zipfile: ZipFile) -> dict:
     return return_data
 
 
+def iter_ecr_data(valid_zipfile: ZipFile) -> Iterator[dict]:
+    """
+    Finds every eICR in a valid zip file and returns an iterator that reads
+    them, one at a time, along with the RR sharing the eICR's file name prefix
+    (e.g. `123/CDA_RR.xml` for `123/CDA_eICR.xml`), if there is one.
+
+    :param valid_zipfile: A ZipFile object to search within.
+    :return: An iterator of dictionaries, each containing the eICR's path in
+      the zip file as 'file', its 'ecr' data, and its 'rr' data if present.
+    """
+    file_names = [
+        file for file in valid_zipfile.namelist() if not file.startswith("__MACOSX/")
+    ]
+    ecr_references = [file for file in file_names if file.endswith("CDA_eICR.xml")]
+    if not ecr_references:
+        raise IndexError("There is no eICR in this zip file.")
+    rr_references = set(file for file in file_names if file.endswith("CDA_RR.xml"))
+
+    def read_ecr_data() -> Iterator[dict]:
+        for ecr_reference in ecr_references:
+            ecr_data = {
+                "file": ecr_reference,
+                "ecr": valid_zipfile.read(ecr_reference).decode("utf-8"),
+            }
+            rr_reference = ecr_reference.removesuffix("CDA_eICR.xml") + "CDA_RR.xml"
+            if rr_reference in rr_references:
+                ecr_data["rr"] = valid_zipfile.read(rr_reference).decode("utf-8")
+            yield ecr_data
+
+    return read_ecr_data()
+
+
 def search_for_file_in_zip(filename: str, zipfile: ZipFile) -> Optional[str]:
     """
     Searches for a file by name within a zip file.
@@ -0,0 +1,459 @@
+"""
+Measures the overhead the orchestration service adds on top of the building
+blocks it calls. Every service in `SERVICE_URLS` is replaced by a stub, run in
+a separate process so its cost is not counted, that answers each endpoint
+with a canned response of a configurable size after a configurable delay.
+The orchestration app is then driven in-process at a fixed concurrency with
+each default config, and the CPU time, throughput and serialization cost of
+orchestration are reported.
+
+Run from the `containers/orchestration` directory:
+
+    python -m benchmark.main --requests 200 --concurrency 8
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import time
+from pathlib import Path
+
+ORCHESTRATION_DIR = Path(__file__).resolve().parent.parent
+ASSETS_DIR = ORCHESTRATION_DIR / "tests" / "assets"
+DEFAULT_CONFIGS_DIR = ORCHESTRATION_DIR / "app" / "default_configs"
+
+# The environment variable holding the URL of each service in `SERVICE_URLS`
+SERVICE_URL_VARIABLES = {
+    "validation": "VALIDATION_URL",
+    "ingestion": "INGESTION_URL",
+    "fhir_converter": "FHIR_CONVERTER_URL",
+    "message_parser": "MESSAGE_PARSER_URL",
+    "trigger_code_reference": "TRIGGER_CODE_REFERENCE_URL",
+    "ecr_viewer": "ECR_VIEWER_URL",
+}
+
+
+def make_bundle(payload_bytes: int) -> dict:
+    """
+    Builds a FHIR bundle whose JSON encoding is roughly `payload_bytes` long.
+
+    :param payload_bytes: The approximate size of the bundle, in bytes.
+    :return: The bundle.
+    """
+    bundle = {"resourceType": "Bundle", "type": "batch", "entry": []}
+    size = len(json.dumps(bundle))
+    while size < payload_bytes:
+        entry = {
+            "fullUrl": f"urn:uuid:{len(bundle['entry'])}",
+            "resource": {
+                "resourceType": "Observation",
+                "id": str(len(bundle["entry"])),
+                "status": "final",
+                "valueString": "x" * 800,
+            },
+        }
+        bundle["entry"].append(entry)
+        size += len(json.dumps(entry)) + 2
+    return bundle
+
+
+def make_stub_app(latency_seconds: float, payload_bytes: int):
+    """
+    Builds an ASGI app standing in for a building block. Each endpoint
+    answers with the response its orchestration handler expects, keyed by
+    the last segment of the request path.
+
+    :param latency_seconds: How long the stub waits before responding.
+    :param payload_bytes: The approximate size of the bundles returned.
+    :return: The stub app.
+    """
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse, Response
+    from starlette.routing import Route
+
+    bundle = make_bundle(payload_bytes)
+    responses = {
+        "validate": {
+            "message_valid": True,
+            "validation_results": {"errors": [], "warnings": [], "information": []},
+        },
+        "convert-to-fhir": {"response": {"FhirResource": bundle}},
+        "stamp-condition-extensions": {"extended_bundle": bundle},
+        "parse_message": {"parsed_values": {"eicr_id": "benchmark"}},
+        "save-fhir-data": {"message": "Success. Saved FHIR bundle."},
+    }
+    phdc = b"<ClinicalDocument>" + b"x" * payload_bytes + b"</ClinicalDocument>"
+    rendered = {
+        endpoint: JSONResponse(content).body for endpoint, content in responses.items()
+    }
+    rendered_bundle = JSONResponse({"bundle": bundle}).body
+
+    async def handle(request: Request) -> Response:
+        await request.body()
+        await asyncio.sleep(latency_seconds)
+        endpoint = request.url.path.rstrip("/").split("/")[-1]
+        if endpoint == "fhir_to_phdc":
+            return Response(phdc, media_type="application/xml")
+        return Response(
+            rendered.get(endpoint, rendered_bundle), media_type="application/json"
+        )
+
+    async def health(request: Request) -> Response:
+        return JSONResponse({"status": "OK"})
+
+    return Starlette(
+        routes=[
+            Route("/", health, methods=["GET"]),
+            Route("/{path:path}", handle, methods=["POST"]),
+        ]
+    )
+
+
+def run_stub_services(ports: dict, latencies: dict, payload_bytes: int) -> None:
+    """
+    Serves a stub app for each service on its port until the process is
+    terminated.
+
+    :param ports: The port of each service.
+    :param latencies: The latency, in seconds, of each service.
+    :param payload_bytes: The approximate size of the bundles returned.
+    """
+    import uvicorn
+
+    async def serve():
+        servers = [
+            uvicorn.Server(
+                uvicorn.Config(
+                    make_stub_app(latencies[service], payload_bytes),
+                    host="127.0.0.1",
+                    port=port,
+                    log_level="warning",
+                )
+            )
+            for service, port in ports.items()
+        ]
+        await asyncio.gather(*(server.serve() for server in servers))
+
+    asyncio.run(serve())
+
+
+def find_free_port() -> int:
+    """
+    Finds a free local TCP port.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_inputs(config_name: str, config: dict) -> dict:
+    """
+    Chooses the message to send to each orchestration endpoint for a config,
+    based on the input its first step expects.
+
+    :param config_name: The name of the config.
+    :param config: The config.
+    :return: The `/process-message` request body, and the `/process-zip` form
+      fields and file if the config takes eCRs.
+    """
+    first_service = config["workflow"][0]["service"] if config["workflow"] else None
+    if first_service not in ("validation", "fhir_converter"):
+        bundle = json.loads((ASSETS_DIR / "patient_bundle.json").read_text())
+        return {
+            "message": {
+                "message_type": "fhir",
+                "data_type": "fhir",
+                "config_file_name": config_name,
+                "message": bundle,
+            }
+        }
+    if "hl7" in config_name:
+        return {
+            "message": {
+                "message_type": "elr",
+                "data_type": "hl7",
+                "config_file_name": config_name,
+                "message": (ASSETS_DIR / "hl7_with_msh_3_set.hl7").read_text(),
+            }
+        }
+    return {
+        "message": {
+            "message_type": "ecr",
+            "data_type": "ecr",
+            "config_file_name": config_name,
+            "message": (ASSETS_DIR / "CDA_eICR.xml").read_text(),
+        },
+        "zip": {
+            "data": {
+                "message_type": "ecr",
+                "data_type": "zip",
+                "config_file_name": config_name,
+            },
+            "file": (ASSETS_DIR / "eICR_RR_combo.zip").read_bytes(),
+        },
+    }
+
+
+class SerializationTimer:
+    """
+    Accumulates the time orchestration spends serializing request bodies
+    and parsing response bodies, by wrapping the functions that do so.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+
+    def wrap(self, function):
+        """
+        Wraps a function so the time spent in it is accumulated.
+        """
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - started
+
+        return timed
+
+
+async def drive(
+    client, endpoint: str, inputs: dict, requests: int, concurrency: int
+) -> dict:
+    """
+    Sends `requests` requests to an orchestration endpoint, `concurrency` at
+    a time, and measures them.
+
+    :param client: An HTTP client bound to the orchestration app.
+    :param endpoint: The endpoint to drive, `/process-message` or
+      `/process-zip`.
+    :param inputs: The inputs for the endpoint, from `make_inputs`.
+    :param requests: The number of requests to send.
+    :param concurrency: The number of requests in flight at once.
+    :return: The latency of each request, the number of failed requests,
+      and the wall-clock and CPU time taken.
+    """
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def send() -> None:
+        if endpoint == "/process-zip":
+            zip_input = inputs["zip"]
+            return await client.post(
+                endpoint,
+                data=zip_input["data"],
+                files={
+                    "upload_file": ("ecr.zip", zip_input["file"], "application/zip")
+                },
+            )
+        return await client.post(endpoint, json=inputs["message"])
+
+    async def worker() -> None:
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                response = await send()
+                if response.status_code != 200:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    wall_started = time.perf_counter()
+    cpu_started = time.process_time()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {
+        "latencies": latencies,
+        "errors": errors,
+        "wall_seconds": time.perf_counter() - wall_started,
+        "cpu_seconds": time.process_time() - cpu_started,
+    }
+
+
+async def run_benchmarks(args) -> list[dict]:
+    """
+    Benchmarks every default config against the stub services.
+
+    :param args: The parsed command line arguments.
+    :return: One result per config and endpoint.
+    """
+    import httpx
+
+    # Importing the app reads the service URLs, so the environment is set first
+    from app import services
+    from app.main import app
+    from app.services import compile_workflow
+
+    timer = SerializationTimer()
+    services._serialize_payload = timer.wrap(services._serialize_payload)
+    httpx.Response.json = timer.wrap(httpx.Response.json)
+
+    transport = httpx.ASGITransport(app=app)
+    results = []
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://orchestration", timeout=None
+    ) as client:
+        for config_path in sorted(DEFAULT_CONFIGS_DIR.glob("*.json")):
+            config_name = config_path.name
+            if args.configs and config_name not in args.configs:
+                continue
+            config = json.loads(config_path.read_text())
+            try:
+                compile_workflow(config)
+            except (KeyError, ValueError) as error:
+                results.append(
+                    {"config": config_name, "skipped": f"invalid config: {error!r}"}
+                )
+                continue
+
+            inputs = make_inputs(config_name, config)
+            endpoints = ["/process-message"] + (
+                ["/process-zip"] if "zip" in inputs else []
+            )
+            for endpoint in endpoints:
+                await drive(client, endpoint, inputs, args.warmup, args.concurrency)
+                timer.seconds = 0.0
+                measured = await drive(
+                    client, endpoint, inputs, args.requests, args.concurrency
+                )
+                latencies = sorted(measured["latencies"])
+                results.append(
+                    {
+                        "config": config_name,
+                        "endpoint": endpoint,
+                        "requests": args.requests,
+                        "errors": measured["errors"],
+                        "throughput_per_second": args.requests
+                        / measured["wall_seconds"],
+                        "p50_ms": 1000 * statistics.median(latencies),
+                        "p95_ms": 1000
+                        * latencies[max(int(0.95 * len(latencies)) - 1, 0)],
+                        "cpu_ms_per_request": 1000
+                        * measured["cpu_seconds"]
+                        / args.requests,
+                        "serialization_ms_per_request": 1000
+                        * timer.seconds
+                        / args.requests,
+                    }
+                )
+    await services.close_http_clients()
+    return results
+
+
+def print_results(results: list[dict]) -> None:
+    """
+    Prints the benchmark results as a table.
+    """
+    columns = [
+        ("config", "config", "{}"),
+        ("endpoint", "endpoint", "{}"),
+        ("errors", "errors", "{}"),
+        ("req/s", "throughput_per_second", "{:.1f}"),
+        ("p50 ms", "p50_ms", "{:.1f}"),
+        ("p95 ms", "p95_ms", "{:.1f}"),
+        ("cpu ms/req", "cpu_ms_per_request", "{:.2f}"),
+        ("serde ms/req", "serialization_ms_per_request", "{:.2f}"),
+    ]
+    rows = [[heading for heading, _, _ in columns]]
+    skipped = []
+    for result in results:
+        if "skipped" in result:
+            skipped.append(f"{result['config']}: {result['skipped']}")
+            continue
+        rows.append([fmt.format(result[key]) for _, key, fmt in columns])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+    for line in skipped:
+        print(f"skipped {line}")
+
+
+def parse_args():
+    """
+    Parses the command line arguments of the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=5.0,
+        help="The latency of every stub service.",
+    )
+    parser.add_argument(
+        "--service-latency-ms",
+        action="append",
+        default=[],
+        metavar="SERVICE=MS",
+        help="Overrides the latency of one stub service, e.g. fhir_converter=50.",
+    )
+    parser.add_argument(
+        "--payload-bytes",
+        type=int,
+        default=50_000,
+        help="The approximate size of the bundles the stub services return.",
+    )
+    parser.add_argument(
+        "--config",
+        dest="configs",
+        action="append",
+        default=[],
+        help="Only benchmark this default config (may be repeated).",
+    )
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    return parser.parse_args()
+
+
+def main():
+    """
+    Starts the stub services, runs the benchmark and reports the results.
+    """
+    args = parse_args()
+    latencies = {service: args.latency_ms / 1000 for service in SERVICE_URL_VARIABLES}
+    for override in args.service_latency_ms:
+        service, milliseconds = override.split("=")
+        latencies[service] = float(milliseconds) / 1000
+
+    ports = {service: find_free_port() for service in SERVICE_URL_VARIABLES}
+    for service, variable in SERVICE_URL_VARIABLES.items():
+        os.environ[variable] = f"http://127.0.0.1:{ports[service]}"
+
+    stubs = multiprocessing.get_context("spawn").Process(
+        target=run_stub_services,
+        args=(ports, latencies, args.payload_bytes),
+        daemon=True,
+    )
+    stubs.start()
+    try:
+        import httpx
+
+        for port in ports.values():
+            for _ in range(100):
+                try:
+                    httpx.get(f"http://127.0.0.1:{port}/")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.1)
+
+        results = asyncio.run(run_benchmarks(args))
+    finally:
+        stubs.terminate()
+        stubs.join()
+
+    print_results(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
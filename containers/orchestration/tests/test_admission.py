@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from app.admission import ConcurrencyLimiter
+from fastapi import HTTPException
+
+
+def test_concurrency_limiter_without_limit():
+    limiter = ConcurrencyLimiter("test", 0, 0, 1.0, 5)
+
+    async def run():
+        async with limiter.acquire():
+            async with limiter.acquire():
+                return True
+
+    assert asyncio.run(run())
+
+
+def test_concurrency_limiter_queues_until_slot_frees():
+    limiter = ConcurrencyLimiter("test", 1, 1, 1.0, 5)
+    order = []
+
+    async def work(name):
+        async with limiter.acquire():
+            order.append(f"{name} started")
+            await asyncio.sleep(0.01)
+            order.append(f"{name} finished")
+
+    async def run():
+        await asyncio.gather(work("first"), work("second"))
+
+    asyncio.run(run())
+    assert order == [
+        "first started",
+        "first finished",
+        "second started",
+        "second finished",
+    ]
+    assert limiter.queued == 0
+
+
+def test_concurrency_limiter_rejects_when_queue_full():
+    limiter = ConcurrencyLimiter("test", 1, 0, 1.0, 5)
+
+    async def run():
+        async with limiter.acquire():
+            async with limiter.acquire():
+                pass
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 429
+    assert error.value.headers == {"Retry-After": "5"}
+
+
+def test_concurrency_limiter_rejects_after_queue_timeout():
+    limiter = ConcurrencyLimiter("test", 1, None, 0.01, 2)
+
+    async def run():
+        async with limiter.acquire():
+            async with limiter.acquire():
+                pass
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 503
+    assert error.value.headers == {"Retry-After": "2"}
+    assert limiter.queued == 0
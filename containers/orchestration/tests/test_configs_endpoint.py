@@ -111,3 +111,35 @@ def test_upload_config_already_exists():
         Path(__file__).parent.parent / "app" / "custom_configs" / test_config_name
     )
     processing_config.unlink()
+
+
+def test_upload_config_overwrite_is_served_immediately():
+    test_config_name = "test_config_reload.json"
+    request_body = {
+        "workflow": {
+            "workflow": [
+                {
+                    "service": "ingestion",
+                    "endpoint": "/fhir/harmonization/standardization/standardize_names",
+                }
+            ]
+        }
+    }
+    client.put(f"/configs/{test_config_name}", json=request_body)
+    response = client.get(f"/configs/{test_config_name}")
+    assert response.json()["workflow"] == request_body["workflow"]
+
+    # Overwrite the config; the new version is served without a restart
+    request_body["workflow"]["workflow"][0]["endpoint"] = (
+        "/fhir/harmonization/standardization/standardize_phones"
+    )
+    request_body["overwrite"] = True
+    client.put(f"/configs/{test_config_name}", json=request_body)
+    response = client.get(f"/configs/{test_config_name}")
+    assert response.json()["workflow"] == request_body["workflow"]
+
+    # Delete the test config to avoid conflicts with other tests.
+    processing_config = (
+        Path(__file__).parent.parent / "app" / "custom_configs" / test_config_name
+    )
+    processing_config.unlink()
@@ -9,6 +9,7 @@ from app.handlers.request_builders.ingestion import (
     build_ingestion_dob_request,
     build_ingestion_name_request,
     build_ingestion_phone_request,
+    build_ingestion_standardize_bundle_request,
     build_validation_request,
 )
 from app.handlers.request_builders.message_parser import (
@@ -364,6 +365,48 @@ def test_build_ingestion_dob_request():
     }
 
 
+def test_build_ingestion_standardize_bundle_request():
+    input_msg = json.load(
+        open(Path(__file__).parent / "assets" / "patient_bundle.json")
+    )
+    orchestration_request = input_msg
+
+    # Test with no workflow_params
+    result = build_ingestion_standardize_bundle_request(
+        input_msg, orchestration_request
+    )
+    assert result == {
+        "data": input_msg,
+        "overwrite": "true",
+        "standardize_names": {
+            "trim": "true",
+            "case": "upper",
+            "remove_numbers": "true",
+        },
+        "standardize_dob": {},
+        "standardize_phones": {},
+    }
+
+    # Test with a subset of operations and their params
+    workflow_params = {
+        "standardize_names": {"case": "lower"},
+        "standardize_dob": {"format": "%m/%d/%Y"},
+    }
+    result = build_ingestion_standardize_bundle_request(
+        input_msg, orchestration_request, workflow_params
+    )
+    assert result == {
+        "data": input_msg,
+        "overwrite": "true",
+        "standardize_names": {
+            "trim": "true",
+            "case": "lower",
+            "remove_numbers": "true",
+        },
+        "standardize_dob": {"format": "%m/%d/%Y"},
+    }
+
+
 def test_build_geocoding_request():
     input_msg = json.load(
         open(Path(__file__).parent / "assets" / "patient_bundle.json")
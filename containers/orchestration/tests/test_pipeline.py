@@ -0,0 +1,170 @@
+import asyncio
+import copy
+import json
+from pathlib import Path
+
+import httpx
+import pytest
+from app.main import _apply_workflow_to_bulk_message
+from app.pipeline import (
+    DEFAULT_CONTAINERS_DIR,
+    SERVICE_CONTAINERS,
+    initialize_worker,
+    load_container_app,
+    read_messages,
+    run_pipeline,
+    send_step_in_process,
+)
+from app.services import get_compiled_workflow
+from app.utils import load_processing_config
+
+ASSETS_DIR = Path(__file__).parent / "assets"
+CUSTOM_CONFIGS_DIR = Path(__file__).parent.parent / "app" / "custom_configs"
+
+# A workflow whose outputs read the responses of steps whose output is also
+# the input of later steps, which modify their input in place
+SHARED_MESSAGE_CONFIG = {
+    "workflow": [
+        {
+            "name": "names",
+            "service": "ingestion",
+            "endpoint": "/fhir/harmonization/standardization/standardize_names",
+        },
+        {
+            "name": "phones",
+            "service": "ingestion",
+            "endpoint": "/fhir/harmonization/standardization/standardize_phones",
+        },
+        {
+            "name": "dob",
+            "service": "ingestion",
+            "endpoint": "/fhir/harmonization/standardization/standardize_dob",
+            "params": {"dob_format": ""},
+        },
+    ],
+    "outputs": ["names", "phones"],
+}
+
+
+@pytest.fixture(scope="module")
+def container_apps():
+    initialize_worker()
+    return {
+        service: load_container_app(DEFAULT_CONTAINERS_DIR / container)
+        for service, container in SERVICE_CONTAINERS.items()
+    }
+
+
+@pytest.fixture
+def shared_message_config():
+    config_path = CUSTOM_CONFIGS_DIR / "test_pipeline_shared_message.json"
+    config_path.write_text(json.dumps(SHARED_MESSAGE_CONFIG))
+    yield config_path.name
+    config_path.unlink()
+
+
+def _run_over_http(container_apps, config_file_name, ecr_data):
+    async def send_over_http(step, request_body):
+        transport = httpx.ASGITransport(app=container_apps[step["service"]])
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            return await client.post(step["endpoint"], json=request_body)
+
+    return asyncio.run(
+        _apply_workflow_to_bulk_message(
+            "fhir", "fhir", config_file_name, ecr_data, step_sender=send_over_http
+        )
+    )
+
+
+@pytest.mark.parametrize("processes", [0, 2])
+def test_run_pipeline_matches_http_pipeline(container_apps, processes):
+    messages = list(
+        read_messages(
+            [
+                ASSETS_DIR / "patient_bundle.json",
+                ASSETS_DIR / "demo_phdc_conversion_bundle.json",
+            ],
+            "fhir",
+        )
+    )
+    expected = [
+        _run_over_http(container_apps, "sample-fhir-test-config.json", ecr_data)
+        for ecr_data in messages
+    ]
+
+    results = list(
+        run_pipeline(
+            "fhir",
+            "fhir",
+            "sample-fhir-test-config.json",
+            messages,
+            processes=processes,
+        )
+    )
+
+    assert [result["status_code"] for result in results] == [200, 200]
+    assert results == expected
+
+
+def test_run_pipeline_copies_shared_messages(container_apps, shared_message_config):
+    bundle = json.loads((ASSETS_DIR / "patient_bundle.json").read_text())
+    expected = _run_over_http(
+        container_apps, shared_message_config, {"file": "bundle", "ecr": bundle}
+    )
+
+    results = list(
+        run_pipeline(
+            "fhir",
+            "fhir",
+            shared_message_config,
+            [{"file": "bundle", "ecr": bundle}],
+            processes=0,
+        )
+    )
+
+    assert results == [expected]
+    steps = get_compiled_workflow(load_processing_config(shared_message_config))[
+        "steps"
+    ]
+    assert [step["message_is_shared"] for step in steps] == [False, True, True]
+
+
+def test_send_step_in_process_reports_invalid_requests(container_apps):
+    step = get_compiled_workflow(
+        load_processing_config("sample-fhir-test-config.json")
+    )["steps"][0]
+    request_body = {"data": {"not": "fhir"}}
+    expected = _run_over_http_step(container_apps, step, request_body)
+
+    response = asyncio.run(send_step_in_process(step, request_body))
+
+    assert response.status_code == expected.status_code == 422
+    assert response.json() == expected.json()
+    assert response.content == expected.content
+
+
+def test_send_step_in_process_renders_content_as_http(container_apps):
+    step = get_compiled_workflow(
+        load_processing_config("sample-fhir-test-config.json")
+    )["steps"][0]
+    bundle = json.loads((ASSETS_DIR / "patient_bundle.json").read_text())
+    request_body = {"data": bundle}
+    expected = _run_over_http_step(container_apps, step, copy.deepcopy(request_body))
+
+    response = asyncio.run(send_step_in_process(step, request_body))
+
+    assert response.status_code == expected.status_code == 200
+    assert response.content == expected.content
+
+
+def _run_over_http_step(container_apps, step, request_body):
+    async def send():
+        transport = httpx.ASGITransport(app=container_apps[step["service"]])
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            return await client.post(step["endpoint"], json=request_body)
+
+    return asyncio.run(send())
@@ -1,9 +1,17 @@
+import asyncio
+import io
 import json
+import sqlite3
 from pathlib import Path
 from unittest import mock
+from zipfile import ZipFile
 
+import httpx
 import pytest
+from app.admission import ConcurrencyLimiter
 from app.main import app
+from app.result_cache import MemoryWorkflowResultCache
+from fastapi import HTTPException, Response
 from fastapi.testclient import TestClient
 
 client = TestClient(app)
@@ -176,6 +184,102 @@ def test_process_message_fhir_data(patched_post_request):
     assert actual_response.status_code == 200
 
 
+@mock.patch("app.services.post_request")
+@mock.patch("app.main.get_result_cache")
+def test_process_message_duplicate_served_from_result_cache(
+    patched_get_result_cache, patched_post_request
+):
+    patched_get_result_cache.return_value = MemoryWorkflowResultCache(60.0, 10)
+    request = {
+        "message_type": "fhir",
+        "data_type": "fhir",
+        "config_file_name": "sample-fhir-test-config.json",
+        "message": {"foo": "bar"},
+    }
+    ingestion_post_request = mock.Mock()
+    ingestion_post_request.status_code = 200
+    ingestion_post_request.headers = {"content-type": "application/json"}
+    ingestion_post_request.json.return_value = {
+        "bundle": {"bundle_type": "batch", "placeholder_id": "abcdefg", "entry": []}
+    }
+    message_parser_post_request = mock.Mock()
+    message_parser_post_request.status_code = 200
+    message_parser_post_request.headers = {"content-type": "application/json"}
+    message_parser_post_request.json.return_value = {
+        "parsed_values": {"placeholder_key": "placeholder_value"}
+    }
+    patched_post_request.side_effect = [
+        ingestion_post_request,
+        ingestion_post_request,
+        ingestion_post_request,
+        message_parser_post_request,
+    ]
+    first_response = client.post("/process-message", json=request)
+    assert first_response.status_code == 200
+    assert patched_post_request.call_count == 4
+
+    duplicate_response = client.post("/process-message", json=request)
+    assert duplicate_response.status_code == 200
+    assert duplicate_response.json() == first_response.json()
+    assert patched_post_request.call_count == 4
+
+
+@mock.patch("app.services.post_request")
+@mock.patch("app.main.get_result_cache")
+def test_process_message_succeeds_when_result_cache_fails(
+    patched_get_result_cache, patched_post_request
+):
+    result_cache = mock.Mock()
+    result_cache.get.side_effect = sqlite3.OperationalError("database is locked")
+    result_cache.put.side_effect = sqlite3.OperationalError("database is locked")
+    patched_get_result_cache.return_value = result_cache
+    request = {
+        "message_type": "fhir",
+        "data_type": "fhir",
+        "config_file_name": "sample-fhir-test-config.json",
+        "message": {"foo": "bar"},
+    }
+    ingestion_post_request = mock.Mock()
+    ingestion_post_request.status_code = 200
+    ingestion_post_request.headers = {"content-type": "application/json"}
+    ingestion_post_request.json.return_value = {
+        "bundle": {"bundle_type": "batch", "placeholder_id": "abcdefg", "entry": []}
+    }
+    message_parser_post_request = mock.Mock()
+    message_parser_post_request.status_code = 200
+    message_parser_post_request.headers = {"content-type": "application/json"}
+    message_parser_post_request.json.return_value = {
+        "parsed_values": {"placeholder_key": "placeholder_value"}
+    }
+    patched_post_request.side_effect = [
+        ingestion_post_request,
+        ingestion_post_request,
+        ingestion_post_request,
+        message_parser_post_request,
+    ]
+    actual_response = client.post("/process-message", json=request)
+    assert actual_response.status_code == 200
+    assert result_cache.put.call_count == 1
+
+
+@mock.patch("app.main.get_workflow_limiter")
+def test_process_message_rejected_when_saturated(patched_get_workflow_limiter):
+    limiter = ConcurrencyLimiter("orchestration", 1, 0, 1.0, 5)
+    # Every slot is taken and no request may queue
+    limiter._slots = asyncio.Semaphore(0)
+    patched_get_workflow_limiter.return_value = limiter
+    request = {
+        "message_type": "fhir",
+        "data_type": "fhir",
+        "config_file_name": "sample-fhir-test-config.json",
+        "message": {"foo": "bar"},
+    }
+
+    actual_response = client.post("/process-message", json=request)
+    assert actual_response.status_code == 429
+    assert actual_response.headers["retry-after"] == "5"
+
+
 def test_process_message_input_validation():
     request = {
         "processing_config": test_config,
@@ -368,6 +472,106 @@ def test_process_zip_with_empty_zip():
         assert "There is no eICR in this zip file." in error_message
 
 
+@mock.patch("app.main.apply_workflow_to_message")
+def test_process_zip_bulk_streams_ndjson_results(patched_apply_workflow):
+    archive = io.BytesIO()
+    with ZipFile(archive, "w") as zipfile:
+        for ecr_id in ["1", "2", "3"]:
+            zipfile.writestr(f"{ecr_id}/CDA_eICR.xml", f"<eicr-{ecr_id}/>")
+        zipfile.writestr("1/CDA_RR.xml", "<rr-1/>")
+
+    async def apply_workflow(
+        message_type, data_type, config, message, rr_content, step_sender=None
+    ):
+        if message == "<eicr-2/>":
+            raise HTTPException(status_code=400, detail="Validation failed")
+        return Response(
+            content=json.dumps({"message": "Processing succeeded!", "rr": rr_content}),
+            media_type="application/json",
+        )
+
+    patched_apply_workflow.side_effect = apply_workflow
+    form_data = {
+        "message_type": "ecr",
+        "data_type": "zip",
+        "config_file_name": "sample-orchestration-config.json",
+        "bulk": "true",
+    }
+    files = {"upload_file": ("file.zip", archive.getvalue(), "application/zip")}
+
+    actual_response = client.post("/process-zip", data=form_data, files=files)
+    assert actual_response.status_code == 200
+    assert actual_response.headers["content-type"] == "application/x-ndjson"
+    results = sorted(
+        (json.loads(line) for line in actual_response.text.splitlines()),
+        key=lambda result: result["file"],
+    )
+    assert results == [
+        {
+            "file": "1/CDA_eICR.xml",
+            "status_code": 200,
+            "response": {"message": "Processing succeeded!", "rr": "<rr-1/>"},
+        },
+        {"file": "2/CDA_eICR.xml", "status_code": 400, "response": "Validation failed"},
+        {
+            "file": "3/CDA_eICR.xml",
+            "status_code": 200,
+            "response": {"message": "Processing succeeded!", "rr": None},
+        },
+    ]
+
+
+def test_process_zip_bulk_requires_zip_file():
+    form_data = {
+        "message_type": "fhir",
+        "data_type": "fhir",
+        "config_file_name": "sample-orchestration-config.json",
+        "bulk": "true",
+    }
+    files = {"upload_file": ("bundle.json", b"{}", "application/json")}
+
+    actual_response = client.post("/process-zip", data=form_data, files=files)
+    assert actual_response.status_code == 400
+    assert actual_response.json() == {"detail": "Bulk processing requires a zip file."}
+
+
+def test_process_zip_bulk_without_ecr():
+    archive = io.BytesIO()
+    with ZipFile(archive, "w") as zipfile:
+        zipfile.writestr("1/CDA_RR.xml", "<rr-1/>")
+    form_data = {
+        "message_type": "ecr",
+        "data_type": "zip",
+        "config_file_name": "sample-orchestration-config.json",
+        "bulk": "true",
+    }
+    files = {"upload_file": ("file.zip", archive.getvalue(), "application/zip")}
+
+    actual_response = client.post("/process-zip", data=form_data, files=files)
+    assert actual_response.status_code == 400
+    assert actual_response.json() == {
+        "message": "There is no eICR in this zip file.",
+        "processed_values": {},
+    }
+
+
+def test_process_zip_bulk_invalid_zip_file():
+    form_data = {
+        "message_type": "ecr",
+        "data_type": "zip",
+        "config_file_name": "sample-orchestration-config.json",
+        "bulk": "true",
+    }
+    files = {"upload_file": ("file.zip", b"not a zip file", "application/zip")}
+
+    actual_response = client.post("/process-zip", data=form_data, files=files)
+    assert actual_response.status_code == 400
+    assert actual_response.json() == {
+        "message": "File is not a zip file",
+        "processed_values": {},
+    }
+
+
 def test_process_zip_invalid_config():
     with open(
         Path(__file__).parent / "assets" / "eICR_RR_combo.zip",
@@ -386,3 +590,166 @@ def test_process_zip_invalid_config():
             "message": "A config with the name 'non_existent_schema.json' could not be found.",  # noqa
             "processed_values": {},
         }
+
+
+def _zip_ecr(ecr: str) -> bytes:
+    archive = io.BytesIO()
+    with ZipFile(archive, "w") as zipfile:
+        zipfile.writestr("CDA_eICR.xml", ecr)
+    return archive.getvalue()
+
+
+def _fake_ws_call_apis(running: dict):
+    async def call_apis(config, input, websocket):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        try:
+            await asyncio.sleep(0.05)
+            await websocket.send_text(json.dumps({"validate": {"status": "success"}}))
+            if input["message"] == "<eicr-fail/>":
+                raise HTTPException(status_code=400, detail="Validation failed")
+            response = httpx.Response(200, json={"ecr": input["message"]})
+            return response, {"validate": response}
+        finally:
+            running["now"] -= 1
+
+    return call_apis
+
+
+@mock.patch("app.main.load_processing_config", return_value={"workflow": []})
+@mock.patch("app.main.call_apis")
+def test_process_ws_processes_tagged_files_concurrently(
+    patched_call_apis, patched_load_processing_config
+):
+    running = {"now": 0, "max": 0}
+    patched_call_apis.side_effect = _fake_ws_call_apis(running)
+
+    with client.websocket_connect("/process-ws") as websocket:
+        for file_id in ["a", "b"]:
+            websocket.send_text(json.dumps({"file_id": file_id}))
+            websocket.send_bytes(_zip_ecr(f"<eicr-{file_id}/>"))
+        frames = [websocket.receive_json() for _ in range(6)]
+
+    assert running["max"] == 2
+    # The config is loaded for each file, so changes to it are picked up
+    assert patched_load_processing_config.call_args_list == [
+        mock.call("test-no-save.json"),
+        mock.call("test-no-save.json"),
+    ]
+    for file_id in ["a", "b"]:
+        assert [frame for frame in frames if frame["file_id"] == file_id] == [
+            {"file_id": file_id, "event": "started"},
+            {
+                "file_id": file_id,
+                "event": "progress",
+                "progress": {"validate": {"status": "success"}},
+            },
+            {
+                "file_id": file_id,
+                "event": "result",
+                "message": "Processing succeeded!",
+                "processed_values": {"ecr": f"<eicr-{file_id}/>"},
+            },
+        ]
+
+
+@mock.patch("app.main.get_settings", return_value={"ws_max_concurrent_files": 1})
+@mock.patch("app.main.load_processing_config", return_value={"workflow": []})
+@mock.patch("app.main.call_apis")
+def test_process_ws_reports_tagged_file_errors_and_continues(
+    patched_call_apis, patched_load_processing_config, patched_get_settings
+):
+    running = {"now": 0, "max": 0}
+    patched_call_apis.side_effect = _fake_ws_call_apis(running)
+
+    with client.websocket_connect("/process-ws") as websocket:
+        websocket.send_text("not a header")
+        assert websocket.receive_json() == {
+            "message": "Expected a JSON object with a `file_id` ahead of each "
+            "tagged file."
+        }
+        for file_id, ecr in [(1, "<eicr-fail/>"), (2, "<eicr-ok/>")]:
+            websocket.send_text(json.dumps({"file_id": file_id}))
+            websocket.send_bytes(_zip_ecr(ecr))
+        frames = [websocket.receive_json() for _ in range(6)]
+
+    assert running["max"] == 1
+    assert frames[2] == {
+        "file_id": 1,
+        "event": "error",
+        "status_code": 400,
+        "message": "Validation failed",
+    }
+    assert frames[5]["event"] == "result"
+
+
+@mock.patch("app.main.load_processing_config", return_value={"workflow": []})
+@mock.patch("app.main.call_apis")
+def test_process_ws_untagged_file(patched_call_apis, patched_load_processing_config):
+    running = {"now": 0, "max": 0}
+    patched_call_apis.side_effect = _fake_ws_call_apis(running)
+
+    with client.websocket_connect("/process-ws") as websocket:
+        websocket.send_bytes(_zip_ecr("<eicr-a/>"))
+        frames = [websocket.receive_json() for _ in range(2)]
+
+    assert frames == [
+        {"validate": {"status": "success"}},
+        {"message": "Processing succeeded!", "processed_values": {"ecr": "<eicr-a/>"}},
+    ]
+
+
+@mock.patch("app.main.get_workflow_limiter")
+@mock.patch("app.main.load_processing_config", return_value={"workflow": []})
+@mock.patch("app.main.call_apis")
+def test_process_ws_untagged_file_rejected_when_saturated(
+    patched_call_apis, patched_load_processing_config, patched_get_workflow_limiter
+):
+    running = {"now": 0, "max": 0}
+    patched_call_apis.side_effect = _fake_ws_call_apis(running)
+    limiter = ConcurrencyLimiter("orchestration", 1, 0, 1.0, 5)
+    # Every slot is taken and no file may queue
+    limiter._slots = asyncio.Semaphore(0)
+    patched_get_workflow_limiter.return_value = limiter
+
+    with client.websocket_connect("/process-ws") as websocket:
+        websocket.send_bytes(_zip_ecr("<eicr-a/>"))
+        rejected = websocket.receive_json()
+
+        # the connection stays open for the next file
+        limiter._slots = asyncio.Semaphore(1)
+        websocket.send_bytes(_zip_ecr("<eicr-b/>"))
+        frames = [websocket.receive_json() for _ in range(2)]
+
+    assert rejected["status_code"] == 429
+    assert frames[1] == {
+        "message": "Processing succeeded!",
+        "processed_values": {"ecr": "<eicr-b/>"},
+    }
+
+
+@mock.patch("app.main.load_processing_config", return_value={"workflow": []})
+@mock.patch("app.main.call_apis")
+def test_process_ws_untagged_file_error_leaves_tagged_files(
+    patched_call_apis, patched_load_processing_config
+):
+    running = {"now": 0, "max": 0}
+    patched_call_apis.side_effect = _fake_ws_call_apis(running)
+
+    with client.websocket_connect("/process-ws") as websocket:
+        websocket.send_text(json.dumps({"file_id": "a"}))
+        websocket.send_bytes(_zip_ecr("<eicr-a/>"))
+        # an untagged file that is not a zip file
+        websocket.send_bytes(b"not a zip file")
+        frames = [websocket.receive_json() for _ in range(4)]
+
+    assert {
+        "status_code": 500,
+        "message": "Orchestration service error: File is not a zip file",
+    } in frames
+    assert frames[-1] == {
+        "file_id": "a",
+        "event": "result",
+        "message": "Processing succeeded!",
+        "processed_values": {"ecr": "<eicr-a/>"},
+    }
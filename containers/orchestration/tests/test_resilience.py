@@ -0,0 +1,132 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from app.admission import ConcurrencyLimiter
+from app.models import WorkflowServiceStepModel
+from app.resilience import (
+    CircuitBreaker,
+    _latencies,
+    get_hedge_delay,
+    record_latency,
+    send_hedged_request,
+)
+from fastapi import HTTPException
+
+
+def test_get_hedge_delay_uses_percentile_of_recent_latencies():
+    assert get_hedge_delay("validation", "/validate") == 2.0
+    for latency in range(1, 101):
+        record_latency("validation", "/validate", latency / 100)
+    assert get_hedge_delay("validation", "/validate") == 0.95
+    _latencies.clear()
+
+
+def make_request(responses: list):
+    """
+    Returns a function sending requests that each answer with the next of
+    `responses`, given as (delay, result) pairs.
+    """
+    responses = iter(responses)
+
+    async def send_request():
+        delay, result = next(responses)
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return send_request
+
+
+def test_send_hedged_request_returns_fast_primary_without_hedging():
+    send_request = mock.Mock(side_effect=make_request([(0, "primary")]))
+    response = asyncio.run(send_hedged_request(send_request, 1.0, {}))
+    assert response == "primary"
+    assert send_request.call_count == 1
+
+
+def test_send_hedged_request_uses_first_response_after_hedging():
+    send_request = make_request([(1.0, "primary"), (0, "hedge")])
+    assert asyncio.run(send_hedged_request(send_request, 0.01, {})) == "hedge"
+
+
+def test_send_hedged_request_survives_one_failed_request():
+    send_request = make_request([(0.05, "primary"), (0, ValueError("failed"))])
+    assert asyncio.run(send_hedged_request(send_request, 0.01, {})) == "primary"
+
+    send_request = make_request(
+        [(0.02, ValueError("first")), (0.05, ValueError("second"))]
+    )
+    with pytest.raises(ValueError, match="first"):
+        asyncio.run(send_hedged_request(send_request, 0.01, {}))
+
+
+def test_send_hedged_request_takes_its_own_slot():
+    limiter = ConcurrencyLimiter("test", 2, None, 1.0, 5)
+
+    async def run():
+        # the caller holds a slot for the primary request, so the hedge takes
+        # the other one, and gives it back once it is cancelled
+        async with limiter.acquire():
+            send_request = make_request([(0.05, "primary"), (1.0, "hedge")])
+            hedging = asyncio.create_task(
+                send_hedged_request(send_request, 0.01, {}, limiter)
+            )
+            await asyncio.sleep(0.03)
+            assert limiter._slots.locked()
+            response = await hedging
+            await asyncio.sleep(0.01)
+            assert not limiter._slots.locked()
+            return response
+
+    assert asyncio.run(run()) == "primary"
+
+
+def test_send_hedged_request_skips_hedge_without_free_slot():
+    limiter = ConcurrencyLimiter("test", 1, None, 1.0, 5)
+
+    async def run():
+        async with limiter.acquire():
+            send_request = mock.Mock(side_effect=make_request([(0.05, "primary")]))
+            response = await send_hedged_request(send_request, 0.01, {}, limiter)
+            assert send_request.call_count == 1
+            return response
+
+    assert asyncio.run(run()) == "primary"
+
+
+def test_circuit_breaker_opens_and_recovers():
+    breaker = CircuitBreaker("fhir_converter", failure_threshold=2, reset_seconds=30)
+    with mock.patch("app.resilience.time.monotonic", return_value=100.0):
+        breaker.before_request()
+        breaker.record_failure()
+        breaker.before_request()
+        breaker.record_failure()
+        with pytest.raises(HTTPException) as error:
+            breaker.before_request()
+    assert error.value.status_code == 503
+    assert error.value.headers == {"Retry-After": "30"}
+
+    # After the reset period, a single trial request is let through
+    with mock.patch("app.resilience.time.monotonic", return_value=131.0):
+        breaker.before_request()
+        with pytest.raises(HTTPException):
+            breaker.before_request()
+        breaker.record_failure()
+        with pytest.raises(HTTPException):
+            breaker.before_request()
+
+    with mock.patch("app.resilience.time.monotonic", return_value=162.0):
+        breaker.before_request()
+        breaker.record_success()
+        breaker.before_request()
+    assert breaker.failures == 0
+
+
+def test_workflow_step_hedge_requires_idempotent_endpoint():
+    WorkflowServiceStepModel(service="validation", endpoint="/validate", hedge=True)
+    with pytest.raises(ValueError, match="cannot be enabled"):
+        WorkflowServiceStepModel(
+            service="save_bundle", endpoint="/api/save-fhir-data", hedge=True
+        )
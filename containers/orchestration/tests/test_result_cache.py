@@ -0,0 +1,86 @@
+from unittest import mock
+
+import pytest
+from app.result_cache import (
+    MemoryWorkflowResultCache,
+    SQLiteWorkflowResultCache,
+    make_cache_key,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_cache(request, tmp_path):
+    def make(ttl_seconds=60.0, max_entries=10):
+        if request.param == "memory":
+            return MemoryWorkflowResultCache(ttl_seconds, max_entries)
+        return SQLiteWorkflowResultCache(
+            ttl_seconds, max_entries, str(tmp_path / "cache.sqlite3")
+        )
+
+    return make
+
+
+def test_result_cache_round_trip(make_cache):
+    cache = make_cache()
+    assert cache.get("key") is None
+    cache.put("key", 200, "application/json", b'{"foo": "bar"}')
+    assert cache.get("key") == {
+        "status_code": 200,
+        "media_type": "application/json",
+        "content": b'{"foo": "bar"}',
+    }
+    cache.clear()
+    assert cache.get("key") is None
+
+
+def test_result_cache_expires_entries(make_cache):
+    cache = make_cache(ttl_seconds=10.0)
+    with mock.patch("app.result_cache.time.time", return_value=1000.0):
+        cache.put("key", 200, "application/json", b"{}")
+    with mock.patch("app.result_cache.time.time", return_value=1005.0):
+        assert cache.get("key") is not None
+    with mock.patch("app.result_cache.time.time", return_value=1011.0):
+        assert cache.get("key") is None
+
+
+def test_result_cache_evicts_oldest_entries(make_cache):
+    cache = make_cache(max_entries=2)
+    for index, key in enumerate(["first", "second", "third"]):
+        with mock.patch("app.result_cache.time.time", return_value=1000.0 + index):
+            cache.put(key, 200, "application/json", b"{}")
+    with mock.patch("app.result_cache.time.time", return_value=1003.0):
+        assert cache.get("first") is None
+        assert cache.get("second") is not None
+        assert cache.get("third") is not None
+
+
+@mock.patch("app.result_cache.result_cache_counter")
+def test_result_cache_records_hits_and_misses(patched_counter):
+    cache = MemoryWorkflowResultCache(60.0, 10)
+    cache.get("key")
+    cache.put("key", 200, "application/json", b"{}")
+    cache.get("key")
+    assert patched_counter.add.call_args_list == [
+        mock.call(1, {"result": "miss"}),
+        mock.call(1, {"result": "hit"}),
+    ]
+
+
+def test_make_cache_key():
+    config = {"workflow": [{"service": "validation", "endpoint": "/validate"}]}
+    key = make_cache_key("ecr", "ecr", "config.json", config, "<eicr/>", "<rr/>")
+    assert key == make_cache_key(
+        "ecr", "ecr", "config.json", dict(config), "<eicr/>", "<rr/>"
+    )
+    assert key != make_cache_key("ecr", "ecr", "config.json", config, "<eicr/>", None)
+    assert key != make_cache_key("ecr", "ecr", "other.json", config, "<eicr/>", "<rr/>")
+    assert key != make_cache_key(
+        "ecr", "ecr", "config.json", {"workflow": []}, "<eicr/>", "<rr/>"
+    )
+    # RR data is hashed separately so it cannot be confused with the message
+    assert make_cache_key("ecr", "ecr", "c", config, "ab", "c") != make_cache_key(
+        "ecr", "ecr", "c", config, "a", "bc"
+    )
+    assert make_cache_key("fhir", "fhir", "c", config, {"a": 1, "b": 2}, None) == (
+        make_cache_key("fhir", "fhir", "c", config, {"b": 2, "a": 1}, None)
+    )
@@ -0,0 +1,353 @@
+import asyncio
+import gzip
+import json
+from unittest import mock
+
+import httpx
+import pytest
+from app.resilience import CircuitBreaker
+from app.services import (
+    ENDPOINT_TO_REQUEST_BODY,
+    ENDPOINT_TO_RESPONSE,
+    _http_clients,
+    _service_request_encodings,
+    call_apis,
+    close_http_clients,
+    get_compiled_workflow,
+    get_http_client,
+    post_request,
+    resolve_step_dependencies,
+    send_step_request,
+)
+from app.utils import load_processing_config
+from fastapi import HTTPException
+
+
+def test_get_http_client_is_pooled_per_service():
+    validation_client = get_http_client("validation")
+    assert get_http_client("validation") is validation_client
+    assert get_http_client("fhir_converter") is not validation_client
+    asyncio.run(close_http_clients())
+    assert _http_clients == {}
+    assert validation_client.is_closed
+
+
+@mock.patch("app.services.get_settings")
+def test_get_http_client_applies_service_connection_limits(patched_get_settings):
+    patched_get_settings.return_value = {
+        "service_max_connections": 100,
+        "service_max_keepalive_connections": 20,
+        "service_timeout_seconds": 30.0,
+        "service_connect_timeout_seconds": 2.0,
+        "service_connection_limits": {"fhir_converter": 5},
+    }
+    client = get_http_client("fhir_converter")
+    pool = client._transport._pool
+    assert pool._max_connections == 5
+    assert pool._max_keepalive_connections == 5
+    assert client.timeout.read == 30.0
+    assert client.timeout.connect == 2.0
+    asyncio.run(close_http_clients())
+
+
+def test_post_request_compresses_once_service_advertises_encoding():
+    received = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        encoding = request.headers.get("content-encoding")
+        body = gzip.decompress(request.content) if encoding else request.content
+        received.append((encoding, json.loads(body)))
+        return httpx.Response(200, json={}, headers={"Accept-Encoding": "gzip"})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    payload = {"message": "x" * 2048}
+    with mock.patch("app.services.get_http_client", return_value=client):
+        asyncio.run(post_request("http://validation/validate", payload, "validation"))
+        asyncio.run(post_request("http://validation/validate", payload, "validation"))
+        asyncio.run(post_request("http://validation/validate", {}, "validation"))
+    assert received == [(None, payload), ("gzip", payload), (None, {})]
+    _service_request_encodings.clear()
+
+
+def test_post_request_falls_back_to_plain_body_on_415():
+    received = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        encoding = request.headers.get("content-encoding")
+        received.append(encoding)
+        if encoding:
+            return httpx.Response(415)
+        return httpx.Response(200, json={})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    _service_request_encodings["validation"] = "gzip"
+    with mock.patch("app.services.get_http_client", return_value=client):
+        response = asyncio.run(
+            post_request(
+                "http://validation/validate", {"message": "x" * 2048}, "validation"
+            )
+        )
+    assert response.status_code == 200
+    assert received == ["gzip", None]
+    assert "validation" not in _service_request_encodings
+
+
+@mock.patch("app.services.service_requests_in_flight")
+@mock.patch("app.services.service_response_size_histogram")
+@mock.patch("app.services.service_request_size_histogram")
+@mock.patch("app.services.service_request_duration_histogram")
+def test_post_request_records_metrics(
+    patched_duration, patched_request_size, patched_response_size, patched_in_flight
+):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=b'{"valid": true}')
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    with mock.patch("app.services.get_http_client", return_value=client):
+        asyncio.run(
+            post_request(
+                "http://validation/validate",
+                {"message": "x"},
+                "validation",
+                "/validate",
+            )
+        )
+
+    attributes = {"service": "validation", "endpoint": "/validate"}
+    patched_request_size.record.assert_called_once_with(
+        len(b'{"message":"x"}'), attributes
+    )
+    patched_response_size.record.assert_called_once_with(15, attributes)
+    assert patched_in_flight.add.call_args_list == [
+        mock.call(1, attributes),
+        mock.call(-1, attributes),
+    ]
+    duration, duration_attributes = patched_duration.record.call_args.args
+    assert duration >= 0
+    assert duration_attributes == {**attributes, "status_code": "200"}
+
+
+validation_step = {"service": "validation", "endpoint": "/validate"}
+conversion_step = {"service": "fhir_converter", "endpoint": "/convert-to-fhir"}
+stamp_step = {
+    "name": "stamped_ecr",
+    "service": "trigger_code_reference",
+    "endpoint": "/stamp-condition-extensions",
+}
+parse_step = {
+    "name": "metadata_values",
+    "service": "message_parser",
+    "endpoint": "/parse_message",
+}
+save_step = {
+    "service": "save_bundle",
+    "endpoint": "/api/save-fhir-data",
+    "previous_response_to_param_mapping": {
+        "metadata_values": "metadata",
+        "stamped_ecr": "fhirBundle",
+    },
+}
+
+
+def test_get_compiled_workflow_resolves_steps_once():
+    config = {"workflow": [validation_step, conversion_step]}
+    compiled_workflow = get_compiled_workflow(config)
+    assert get_compiled_workflow(config) is compiled_workflow
+    # An equal but reloaded config is compiled afresh
+    assert get_compiled_workflow(dict(config)) is not compiled_workflow
+
+    validation, conversion = compiled_workflow["steps"]
+    assert validation["name"] == "validation"
+    assert validation["endpoint_name"] == "validate"
+    assert validation["service_url"].endswith("/validate")
+    assert validation["request_body_func"] is ENDPOINT_TO_REQUEST_BODY["validate"]
+    assert validation["response_func"] is ENDPOINT_TO_RESPONSE["validate"]
+    assert conversion["depends_on"] == {0}
+    assert conversion["params"] == {}
+
+
+def test_resolve_step_dependencies_sequential_by_default():
+    plan = resolve_step_dependencies(
+        [validation_step, conversion_step, stamp_step, parse_step, save_step]
+    )
+    assert [step["depends_on"] for step in plan] == [set(), {0}, {1}, {2}, {2, 3}]
+    assert [step["message_source"] for step in plan] == [None, None, 1, 2, 3]
+    assert plan[4]["response_sources"] == {"metadata_values": 3, "stamped_ecr": 2}
+
+
+def test_resolve_step_dependencies_as_graph():
+    plan = resolve_step_dependencies(
+        [
+            validation_step,
+            {**conversion_step, "depends_on": []},
+            stamp_step,
+            parse_step,
+            {**save_step, "depends_on": ["stamped_ecr"]},
+        ]
+    )
+    # Conversion reads the original message, so it runs alongside validation;
+    # the save waits on its explicit and mapped dependencies only
+    assert [step["depends_on"] for step in plan] == [
+        set(),
+        set(),
+        {1},
+        {2},
+        {2, 3},
+    ]
+    assert [step["message_source"] for step in plan] == [None, None, 1, 2, 3]
+
+
+def test_resolve_step_dependencies_side_effects_wait_on_validation():
+    plan = resolve_step_dependencies(
+        [
+            validation_step,
+            {**conversion_step, "depends_on": []},
+            {"service": "save_bundle", "endpoint": "/api/save-fhir-data"},
+            parse_step,
+        ]
+    )
+    # the save waits on validation and the message it saves, but not on the
+    # parse, which runs alongside it
+    assert plan[2]["depends_on"] == {0, 1}
+    assert plan[3]["depends_on"] == {1}
+
+
+@pytest.mark.parametrize(
+    "config_name",
+    ["bundle-metadata-core.json", "bundle-metadata-extended.json"],
+)
+def test_resolve_step_dependencies_bundle_metadata_configs_are_a_chain(config_name):
+    workflow = load_processing_config(config_name)["workflow"]
+    # Even with dependencies inferred from the data each step reads, every step
+    # of these configs needs the one before it: the ingestion steps each
+    # rework the converted bundle, and the parsing schema reads the condition
+    # names that stamping writes into the RR observations
+    plan = resolve_step_dependencies([{**workflow[0], "depends_on": []}, *workflow[1:]])
+    assert [step["depends_on"] for step in plan] == [
+        set(),
+        {0},
+        {1},
+        {2},
+        {3},
+        {4},
+    ]
+    assert plan[5]["message_source"] == 4
+
+
+def test_resolve_step_dependencies_unknown_name():
+    with pytest.raises(ValueError):
+        resolve_step_dependencies(
+            [{**parse_step, "previous_response_to_param_mapping": {"nope": "x"}}]
+        )
+
+
+def _mock_response(json_body):
+    response = mock.Mock()
+    response.status_code = 200
+    response.json.return_value = json_body
+    return response
+
+
+def test_call_apis_runs_independent_steps_concurrently():
+    in_flight = []
+    max_in_flight = []
+
+    async def fake_post_request(url, payload, service=None, endpoint=None):
+        in_flight.append(url)
+        max_in_flight.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(url)
+        if service == "validation":
+            return _mock_response({"validation_results": [], "message_valid": True})
+        return _mock_response({"response": {"FhirResource": {"entry": []}}})
+
+    config = {"workflow": [validation_step, {**conversion_step, "depends_on": []}]}
+    request = {"message_type": "ecr", "data_type": "ecr", "message": "<xml/>"}
+    with mock.patch("app.services.post_request", side_effect=fake_post_request):
+        response, responses = asyncio.run(call_apis(config, request))
+
+    assert max(max_in_flight) == 2
+    assert list(responses) == ["validation", "fhir_converter"]
+    assert response is responses["fhir_converter"]
+
+
+def test_call_apis_reports_earliest_failing_step():
+    async def fake_post_request(url, payload, service=None, endpoint=None):
+        if service == "validation":
+            await asyncio.sleep(0.01)
+            return _mock_response(
+                {"validation_results": ["bad"], "message_valid": False}
+            )
+        failed = mock.Mock()
+        failed.status_code = 500
+        failed.text = "converter failed"
+        return failed
+
+    config = {"workflow": [validation_step, {**conversion_step, "depends_on": []}]}
+    request = {"message_type": "ecr", "data_type": "ecr", "message": "<xml/>"}
+    with mock.patch("app.services.post_request", side_effect=fake_post_request):
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(call_apis(config, request))
+
+    assert error.value.status_code == 400
+    assert "validation" in error.value.detail
+
+
+def test_call_apis_cancels_steps_when_cancelled():
+    cancelled_steps = []
+
+    async def fake_post_request(url, payload, service=None, endpoint=None):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled_steps.append(service)
+            raise
+
+    config = {"workflow": [validation_step, {**conversion_step, "depends_on": []}]}
+    request = {"message_type": "ecr", "data_type": "ecr", "message": "<xml/>"}
+
+    async def cancel_call_apis():
+        call = asyncio.create_task(call_apis(config, request))
+        await asyncio.sleep(0.01)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        # the steps have been cancelled by the time `call_apis` returns
+        assert sorted(cancelled_steps) == ["fhir_converter", "validation"]
+
+    with mock.patch("app.services.post_request", side_effect=fake_post_request):
+        asyncio.run(cancel_call_apis())
+
+
+@mock.patch("app.services.get_circuit_breaker")
+def test_send_step_request_trips_circuit_breaker(patched_get_circuit_breaker):
+    patched_get_circuit_breaker.return_value = CircuitBreaker("validation", 2, 30)
+    step = {
+        **get_compiled_workflow({"workflow": [validation_step]})["steps"][0],
+        "circuit_breaker": True,
+    }
+    failed_response = mock.Mock(status_code=500)
+    with mock.patch("app.services.post_request", return_value=failed_response) as post:
+        for _ in range(2):
+            assert asyncio.run(send_step_request(step, {})) is failed_response
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(send_step_request(step, {}))
+    assert error.value.status_code == 503
+    assert post.call_count == 2
+
+
+def test_send_step_request_hedges_with_fixed_delay():
+    step = {
+        **get_compiled_workflow({"workflow": [validation_step]})["steps"][0],
+        "hedge": True,
+        "hedge_delay_seconds": 0.01,
+    }
+    responses = iter([1.0, 0])
+
+    async def fake_post_request(url, payload, service=None, endpoint=None):
+        delay = next(responses)
+        await asyncio.sleep(delay)
+        return delay
+
+    with mock.patch("app.services.post_request", side_effect=fake_post_request):
+        assert asyncio.run(send_step_request(step, {})) == 0
@@ -1,3 +1,4 @@
+import io
 import json
 import os
 from pathlib import Path
@@ -7,6 +8,8 @@ from zipfile import ZipFile
 import pytest
 from app.utils import (
     _combine_response_bundles,
+    invalidate_processing_config,
+    iter_ecr_data,
     load_processing_config,
     replace_env_var_placeholders,
     search_for_ecr_data,
@@ -25,6 +28,33 @@ def test_load_processing_config_success():
     assert config == test_config
 
 
+def test_load_processing_config_reloads_changed_file():
+    config_name = "test_config_mtime.json"
+    config_path = Path(__file__).parent.parent / "app" / "custom_configs" / config_name
+    config_path.write_text(json.dumps({"workflow": []}))
+    try:
+        config = load_processing_config(config_name)
+        assert config == {"workflow": []}
+        # Unchanged configs are served from the cache
+        assert load_processing_config(config_name) is config
+
+        config_path.write_text(json.dumps({"workflow": [{"service": "validation"}]}))
+        modified_time = config_path.stat().st_mtime_ns + 1_000_000_000
+        os.utime(config_path, ns=(modified_time, modified_time))
+        assert load_processing_config(config_name) == {
+            "workflow": [{"service": "validation"}]
+        }
+
+        # Invalidated configs are re-read even if their mtime did not change
+        reloaded = load_processing_config(config_name)
+        invalidate_processing_config(config_name)
+        assert load_processing_config(config_name) is not reloaded
+    finally:
+        config_path.unlink()
+    with pytest.raises(FileNotFoundError):
+        load_processing_config(config_name)
+
+
 def test_replace_env_var_placeholders():
     # Setup a test config with known placeholders
     test_config = {
@@ -80,6 +110,31 @@ def test_search_for_ecr_data_eicr_not_found_fails():
     assert "There is no eICR in this zip file." in error_message
 
 
+def test_iter_ecr_data_pairs_each_eicr_with_its_rr():
+    archive = io.BytesIO()
+    with ZipFile(archive, "w") as zipfile:
+        zipfile.writestr("first/CDA_eICR.xml", "<first-eicr/>")
+        zipfile.writestr("first/CDA_RR.xml", "<first-rr/>")
+        zipfile.writestr("__MACOSX/first/._CDA_eICR.xml", "metadata")
+        zipfile.writestr("second_CDA_eICR.xml", "<second-eicr/>")
+        zipfile.writestr("third_CDA_eICR.xml", "<third-eicr/>")
+        zipfile.writestr("third_CDA_RR.xml", "<third-rr/>")
+
+    assert list(iter_ecr_data(ZipFile(archive))) == [
+        {"file": "first/CDA_eICR.xml", "ecr": "<first-eicr/>", "rr": "<first-rr/>"},
+        {"file": "second_CDA_eICR.xml", "ecr": "<second-eicr/>"},
+        {"file": "third_CDA_eICR.xml", "ecr": "<third-eicr/>", "rr": "<third-rr/>"},
+    ]
+
+
+def test_iter_ecr_data_eicr_not_found_fails():
+    zipfile_without_eicr = ZipFile(Path(__file__).parent / "assets" / "no_eicr.zip")
+
+    with pytest.raises(IndexError) as indexError:
+        iter_ecr_data(zipfile_without_eicr)
+    assert "There is no eICR in this zip file." in str(indexError.value)
+
+
 mock_response = Mock(spec=Response)
 mock_response.status_code = 200
 mock_response.json = Mock(return_value={"foo": "bar"})
@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+from collections.abc import Mapping
+from contextlib import closing
+from types import MappingProxyType
+from typing import Optional
+
+# The eRSD database built by `seed-scripts/seed-ersd-database.py`
+ERSD_DB_PATH = "seed-scripts/ersd.db"
+
+# The GEM crosswalk only relates ICD-10 codes to ICD-9 codes, so the ICD-9 codes
+# are given the system they are reported under
+ICD9_SYSTEM = "http://hl7.org/fhir/sid/icd-9-cm"
+
+# Every code of every value set of every condition, along with the ICD-9 codes
+# each ICD-10 code is crosswalked to, if any
+CODE_SETS_QUERY = """
+SELECT
+    c.id AS condition_code,
+    vs.type AS valueset_type,
+    cs.code_system AS system,
+    cs.code AS code,
+    cw.icd9_code AS icd9_code
+FROM
+    conditions c
+JOIN
+    condition_to_valueset cv ON c.id = cv.condition_id
+JOIN
+    valuesets vs ON cv.valueset_id = vs.id
+JOIN
+    valueset_to_concept vc ON vs.id = vc.valueset_id
+JOIN
+    concepts cs ON vc.concept_id = cs.id
+LEFT JOIN
+    icd_crosswalk cw ON cs.gem_formatted_code = cw.icd10_code
+"""
+
+CodeSetIndex = Mapping[str, Mapping[str, Mapping[str, frozenset[str]]]]
+
+# The index of the eRSD database, along with the modification time of the
+# database it was loaded from
+_code_set_index: tuple[int, CodeSetIndex] | None = None
+
+logger = logging.getLogger(__name__)
+
+
+def load_code_set_index(db_path: str) -> CodeSetIndex:
+    """
+    Reads the clinical services of every condition in an eRSD database into
+    memory, so that conditions can be looked up without querying the
+    database for every lookup. The database is opened read-only.
+
+    :param db_path: The path to the eRSD database.
+    :return: A read-only mapping of SNOMED condition code to value set type to
+      code system to the codes in that system, with the ICD-9 codes crosswalked
+      from the condition's ICD-10 codes under the ICD-9 system.
+    """
+    index = {}
+    with closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as conn:
+        for condition_code, valueset_type, system, code, icd9_code in conn.execute(
+            CODE_SETS_QUERY
+        ):
+            systems = index.setdefault(condition_code, {}).setdefault(valueset_type, {})
+            if code is not None:
+                systems.setdefault(system, set()).add(code)
+            if icd9_code:
+                systems.setdefault(ICD9_SYSTEM, set()).add(icd9_code)
+
+    return MappingProxyType(
+        {
+            condition_code: MappingProxyType(
+                {
+                    valueset_type: MappingProxyType(
+                        {system: frozenset(codes) for system, codes in systems.items()}
+                    )
+                    for valueset_type, systems in valueset_types.items()
+                }
+            )
+            for condition_code, valueset_types in index.items()
+        }
+    )
+
+
+def get_value_sets(code_set_index: CodeSetIndex, condition_code: str) -> Optional[dict]:
+    """
+    Gets the value sets of a condition from a code set index, in the shape the
+    `/get-value-sets` endpoint returns them.
+
+    :param code_set_index: The index, from `load_code_set_index`.
+    :param condition_code: The SNOMED condition code to look up.
+    :return: A dictionary with value set type as the key and a list of the codes
+      of each code system as the value, or `None` if the condition is not in the
+      index.
+    """
+    valueset_types = code_set_index.get(condition_code)
+    if valueset_types is None:
+        return None
+    return {
+        valueset_type: [
+            {"codes": sorted(codes), "system": system}
+            for system, codes in systems.items()
+        ]
+        for valueset_type, systems in valueset_types.items()
+    }
+
+
+def get_code_set_index(db_path: str = ERSD_DB_PATH) -> Optional[CodeSetIndex]:
+    """
+    Returns the index of the eRSD database, loading it on first use and loading
+    it again whenever the database has been modified since, so that a reseeded
+    database is picked up without restarting the service. If the database
+    cannot be read, the error is logged and the index last loaded, if any, is
+    returned instead.
+
+    :param db_path: The path to the eRSD database.
+    :return: The index, from `load_code_set_index`, or `None` if the database
+      has not been loaded yet.
+    """
+    global _code_set_index
+    try:
+        mtime = os.stat(db_path).st_mtime_ns
+        if _code_set_index is None or _code_set_index[0] != mtime:
+            _code_set_index = (mtime, load_code_set_index(db_path))
+    except (OSError, sqlite3.Error) as error:
+        logger.error(f"Could not load the eRSD database at {db_path}: {error}")
+        if _code_set_index is None:
+            return None
+    return _code_set_index[1]
+
+
+def clear_code_set_index() -> None:
+    """
+    Drops the loaded index, so that the eRSD database is read again on next use.
+    """
+    global _code_set_index
+    _code_set_index = None
+
+
+def export_value_sets(code_set_index: CodeSetIndex) -> dict:
+    """
+    Gets the value sets of every condition in a code set index, so that they
+    can be looked up without calling the `/get-value-sets` endpoint.
+
+    :param code_set_index: The index, from `load_code_set_index`.
+    :return: A dictionary with SNOMED condition code as the key and the
+      condition's value sets, as returned by `get_value_sets`, as the value.
+    """
+    return {
+        condition_code: get_value_sets(code_set_index, condition_code)
+        for condition_code in sorted(code_set_index)
+    }
+
+
+# Writes the value sets of every condition in the eRSD database to a JSON file,
+# for services that bundle them, e.g.
+# `python -m app.ersd value-sets.json [seed-scripts/ersd.db]`
+if "__main__" == __name__:
+    output_path = sys.argv[1]
+    db_path = sys.argv[2] if len(sys.argv) > 2 else ERSD_DB_PATH
+    with open(output_path, "w") as output_file:
+        json.dump(export_value_sets(load_code_set_index(db_path)), output_file)
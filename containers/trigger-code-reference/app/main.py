@@ -1,19 +1,20 @@
 import string
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Annotated
 
 from fastapi import Body, Query, Response
 
 from app.base_service import BaseService
+from app.ersd import get_code_set_index, get_value_sets
 from app.models import InsertConditionInput
 from app.utils import (
     _find_codes_by_resource_type,
     add_human_readable_reportable_condition_name,
     add_reportable_condition_extension,
+    convert_inputs_to_list,
     find_conditions,
     get_clean_snomed_code,
-    get_concepts_dict,
-    get_concepts_list,
     read_json_from_assets,
 )
 
@@ -24,12 +25,31 @@ RESOURCE_TO_SERVICE_TYPES = {
     "DiagnosticReport": ["dxtc", "ostc", "lotc", "lrtc", "mrtc", "sdtc"],
 }
 
+# The response to requests made before the eRSD database has been loaded
+ERSD_UNAVAILABLE_MESSAGE = "The eRSD database is not available."
+
+# Strips the punctuation from a code, to match the "formatless" codes of the GEM
+FORMATLESS_CODE_TABLE = str.maketrans("", "", string.punctuation)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Loads the eRSD database into memory when the service starts, rather than
+    on the first request. A missing database does not stop the service from
+    starting; requests are answered with a 503 until it has been loaded.
+    """
+    get_code_set_index()
+    yield
+
+
 # Instantiate FastAPI via DIBBs' BaseService class
 app = BaseService(
     service_name="Trigger Code Reference",
     service_path="/trigger-code-reference",
     description_path=Path(__file__).parent.parent / "README.md",
     openapi_url="/trigger-code-reference/openapi.json",
+    lifespan=lifespan,
 ).start()
 
 # Load up the stamping annotated examples
@@ -75,14 +95,15 @@ async def stamp_condition_extensions(
       any linked conditions.
     """
     # Collate all clinical services for each of the found conditions to extend,
-    # collected by service type
-    stamp_codes_to_service_codes = {}
+    # collected by service type and code system
+    code_set_index = get_code_set_index()
+    if code_set_index is None:
+        return Response(content=ERSD_UNAVAILABLE_MESSAGE, status_code=503)
     condition_codes = find_conditions(input.bundle)
-
-    for condition_code in condition_codes:
-        cond_list = get_concepts_list([condition_code])
-        cond_dict = get_concepts_dict(cond_list)
-        stamp_codes_to_service_codes[condition_code] = cond_dict
+    stamp_codes_to_service_codes = {
+        condition_code: code_set_index.get(condition_code, {})
+        for condition_code in condition_codes
+    }
 
     bundle_entries = input.bundle.get("entry", [])
     for entry in bundle_entries:
@@ -95,37 +116,24 @@ async def stamp_condition_extensions(
             r_codes = _find_codes_by_resource_type(resource)
             if len(r_codes) == 0:
                 continue
+            # Do an extra check for "formatless" codes in case the match comes
+            # out of the GEM
+            r_codes = set(r_codes) | {
+                rcode.translate(FORMATLESS_CODE_TABLE) for rcode in r_codes
+            }
 
             # Want to check each queried condition for extension codes
             for condition_code in condition_codes:
-                # Only need a single instance of service type lookup to contain
-                # the resource's code
-                should_stamp = False
                 stamp_checks = stamp_codes_to_service_codes[condition_code]
 
-                # Use only the service types allowed by the current
-                # resource
-                for stype in RESOURCE_TO_SERVICE_TYPES[rtype]:
-                    if stype in stamp_checks:
-                        for code_sys_obj in stamp_checks[stype]:
-                            for rcode in r_codes:
-                                if rcode in code_sys_obj["codes"]:
-                                    should_stamp = True
-                                    break
-                                # Do an extra check for "formatless" codes in case
-                                # the match comes out of the GEM
-                                if (
-                                    rcode.translate(
-                                        str.maketrans("", "", string.punctuation)
-                                    )
-                                    in code_sys_obj["codes"]
-                                ):
-                                    should_stamp = True
-                                    break
-                            if should_stamp:
-                                break
-                    if should_stamp:
-                        break
+                # Only need a single instance of service type lookup to contain
+                # the resource's code, using only the service types allowed by
+                # the current resource
+                should_stamp = any(
+                    not r_codes.isdisjoint(codes)
+                    for stype in RESOURCE_TO_SERVICE_TYPES[rtype]
+                    for codes in stamp_checks.get(stype, {}).values()
+                )
 
                 if should_stamp:
                     resource = add_reportable_condition_extension(
@@ -153,8 +161,8 @@ async def get_value_sets_for_condition(
     ] = None,
 ) -> Response:
     """
-    For a given condition, queries and returns the value set of clinical
-    services associated with that condition.
+    For a given condition, returns the value set of clinical services
+    associated with that condition, from the eRSD database loaded into memory.
 
     :param condition_code: A query param supplied as a string representing a
       single SNOMED condition code.
@@ -169,10 +177,22 @@ async def get_value_sets_for_condition(
             content="Supplied condition code must be a non-empty string",
             status_code=422,
         )
-    else:
-        clean_snomed_code = get_clean_snomed_code(condition_code)
-        concepts_list = get_concepts_list(clean_snomed_code)
-        values = get_concepts_dict(concepts_list, filter_concepts)
+    clean_snomed_code = get_clean_snomed_code(condition_code)
+    if isinstance(clean_snomed_code, dict):
+        return Response(content=clean_snomed_code["error"], status_code=422)
+
+    code_set_index = get_code_set_index()
+    if code_set_index is None:
+        return Response(content=ERSD_UNAVAILABLE_MESSAGE, status_code=503)
+    values = get_value_sets(code_set_index, clean_snomed_code[0]) or {}
+    # Optional: Remove value set types not in specified list if provided
+    if filter_concepts:
+        concepts = convert_inputs_to_list(filter_concepts)
+        values = {
+            concept_type: entries
+            for concept_type, entries in values.items()
+            if concept_type in concepts
+        }
     return values
 
 
@@ -47,130 +47,6 @@ def get_clean_snomed_code(snomed_code: Union[list, str, int, float]) -> list:
     return clean_snomed_code
 
 
-def format_icd9_crosswalks(db_list: list[tuple]) -> list[tuple]:
-    """
-    Utility function to transform the returned tuple rows from the DB into a
-    list of properly formatted three-part tuples. This function handles ICD-9
-    formatting, since the GEM files only give us the relationship between ICD
-    9 and 10 rather than system and OID information itself, so this inserts
-    the missing formatting expected by the rest of the system.
-
-    :param db_list: The list of returned tuples from the SQLite DB.
-    :return: A list of tuples three elements long, formatted as the return for
-      `get_concepts_list`.
-    """
-    formatted_list = []
-    for vs_type in db_list:
-        if vs_type[3] is not None and vs_type[3] != "":
-            formatted_list.append((vs_type[0], vs_type[1], vs_type[2]))
-            formatted_list.append(
-                (vs_type[0], vs_type[3], "http://hl7.org/fhir/sid/icd-9-cm")
-            )
-        else:
-            formatted_list.append((vs_type[0], vs_type[1], vs_type[2]))
-    return formatted_list
-
-
-def get_concepts_list(snomed_code: list) -> list[tuple]:
-    """
-    Given a SNOMED code, this function runs a SQL query that joins
-    conditions to value sets, then uses the value set ids to get the
-    value set type, concept codes, and concept system
-    from the eRSD database grouped by value set type and system. It
-    also uses the GEM crosswalk tables to find any ICD-9 conversion
-    codes that might be represented under the given condition's
-    umbrella.
-
-    :param snomed_code: SNOMED code to check
-    :return: A list of tuples with valueset type, a delimited-string of
-      the relevant codes (including any found ICD-9 conversions, if they
-      exist), and code systems as objects within.
-    """
-    sql_query = """
-    SELECT
-        vs.type AS valueset_type,
-        GROUP_CONCAT(cs.code, '|') AS codes,
-        cs.code_system AS system,
-        GROUP_CONCAT(icd9_conversions, '|') AS crosswalk_conversions
-    FROM
-        conditions c
-    LEFT JOIN
-        condition_to_valueset cv ON c.id = cv.condition_id
-    LEFT JOIN
-        valuesets vs ON cv.valueset_id = vs.id
-    LEFT JOIN
-        valueset_to_concept vc ON vs.id = vc.valueset_id
-    LEFT JOIN
-        concepts cs ON vc.concept_id = cs.id
-    LEFT JOIN
-        (SELECT icd10_code, GROUP_CONCAT(icd9_code, '|') AS icd9_conversions from icd_crosswalk GROUP BY icd10_code) ON gem_formatted_code = icd10_code
-    WHERE
-        c.id = ?
-    GROUP BY
-        vs.type, cs.code_system
-    """
-    # Connect to the SQLite database, execute sql query, then close
-    try:
-        with sqlite3.connect("seed-scripts/ersd.db") as conn:
-            cursor = conn.cursor()
-            code = get_clean_snomed_code(snomed_code)
-            cursor.execute(sql_query, code)
-            concept_list = cursor.fetchall()
-
-            # We know it's not an actual error because we didn't get kicked to
-            # except, so just return the lack of results
-            if not concept_list:
-                return []
-
-        # Add any existing ICD-9 codes into the main code components
-        # Tuples are immutable so we'll need to make some fresh ones
-        refined_list = format_icd9_crosswalks(concept_list)
-        return refined_list
-    except sqlite3.Error as e:
-        return {"error": f"An SQL error occurred: {str(e)}"}
-
-
-def get_concepts_dict(
-    concept_list: list[tuple],
-    filter_concept_list: Union[str, list] = None,
-) -> dict:
-    """
-    This function parses a list of tuples containing data on clinical codes
-    into a dictionary for use in the /get-value-sets API endpoint.
-
-    There is an optional parameter to return select value set type(s)
-    specified as either a string or a list.
-
-    :param concept_list: A list of tuples with value set type,
-    a delimited-string of relevant codes and code systems as objects within.
-    :param filter_concept_list: (Optional) List of value set types
-    specified to keep. By default, all (currently) 6 value set types are
-    returned; use this parameter to return only types of interest.
-    :return: A nested dictionary with value set type as the key, a list
-    of the relevant codes and code systems as objects within.
-    """
-    # Convert to the final structured format
-    concept_dict = {}
-    for concept_type, codes_string, system in concept_list:
-        # If concept_type is not yet in the dictionary, initialize
-        if concept_type not in concept_dict:
-            concept_dict[concept_type] = []
-        # Append a new entry with the codes and their system
-        concept_dict[concept_type].append(
-            {"codes": codes_string.split("|"), "system": system}
-        )
-
-    # Optional: Remove value set types not in specified list if provided
-    if filter_concept_list:
-        concepts = convert_inputs_to_list(filter_concept_list)
-        # Create a list of types to remove
-        remove_list = [type for type in concept_dict.keys() if type not in concepts]
-        # Remove the types
-        for type in remove_list:
-            concept_dict.pop(type, None)
-    return concept_dict
-
-
 def _find_codes_by_resource_type(resource: dict) -> list[str]:
     """
     For a given resource, extracts the chief clinical codes within the
@@ -2,22 +2,13 @@ import json
 from pathlib import Path
 from unittest.mock import patch
 
-import pytest
+from app.ersd import clear_code_set_index
 from app.main import app
 from fastapi.testclient import TestClient
 
 client = TestClient(app)
 
 
-@pytest.fixture
-def mock_db():
-    with patch("sqlite3.connect", autospec=True) as mock_connect:
-        mock_conn = mock_connect.return_value
-        mock_conn.__enter__.return_value = mock_conn
-        mock_cursor = mock_conn.cursor.return_value
-        yield mock_cursor
-
-
 def _check_for_stamped_resource_in_bundle(
     stamped_message: dict, code: str, resource_type: str | None = None
 ) -> bool:
@@ -61,27 +52,47 @@ def test_health_check():
     }
 
 
-def test_get_value_sets_for_condition(mock_db):
-    mocked_db_response = [
-        ("dxtc", "A36.3|A36", "http://hl7.org/fhir/sid/icd-10-cm", "0363|0036"),
-        ("sdtc", "772150003", "http://snomed.info/sct", None),
-    ]
-    mock_db.fetchall.return_value = mocked_db_response
+@patch("app.main.get_code_set_index")
+def test_get_value_sets_for_condition(patched_get_code_set_index):
+    patched_get_code_set_index.return_value = {
+        "276197005": {
+            "dxtc": {
+                "http://hl7.org/fhir/sid/icd-10-cm": frozenset({"A36.3", "A36"}),
+                "http://hl7.org/fhir/sid/icd-9-cm": frozenset({"0363", "0036"}),
+            },
+            "sdtc": {"http://snomed.info/sct": frozenset({"772150003"})},
+        }
+    }
     response = client.get("/get-value-sets?condition_code=276197005")
     expected_result = {
         "dxtc": [
-            {"codes": ["A36.3", "A36"], "system": "http://hl7.org/fhir/sid/icd-10-cm"},
-            {"codes": ["0363", "0036"], "system": "http://hl7.org/fhir/sid/icd-9-cm"},
+            {"codes": ["A36", "A36.3"], "system": "http://hl7.org/fhir/sid/icd-10-cm"},
+            {"codes": ["0036", "0363"], "system": "http://hl7.org/fhir/sid/icd-9-cm"},
         ],
         "sdtc": [{"codes": ["772150003"], "system": "http://snomed.info/sct"}],
     }
     assert response.json() == expected_result
 
+    # value set types can be filtered
+    response = client.get(
+        "/get-value-sets?condition_code=276197005&filter_concepts=sdtc"
+    )
+    assert response.json() == {
+        "sdtc": [{"codes": ["772150003"], "system": "http://snomed.info/sct"}]
+    }
+
+    # conditions not in the eRSD database have no value sets
+    response = client.get("/get-value-sets?condition_code=840539006")
+    assert response.json() == {}
+
+    response = client.get("/get-value-sets?condition_code=276197005,840539006")
+    assert response.status_code == 422
 
-# Note: This function is defined in utils, but we mock it in the namespace
+
+# Note: This function is defined in ersd, but we mock it in the namespace
 # coming from main because that's where the endpoint is invoking it from
-@patch("app.main.get_concepts_list")
-def test_stamp_conditions_no_resources_to_stamp(patched_get_services_list):
+@patch("app.main.get_code_set_index")
+def test_stamp_conditions_no_resources_to_stamp(patched_get_code_set_index):
     # We don't stamp patient resources, bundle should be a no-op
     message = json.load(open(Path(__file__).parent / "assets" / "sample_ecr.json"))
     message["entry"] = [
@@ -90,15 +101,17 @@ def test_stamp_conditions_no_resources_to_stamp(patched_get_services_list):
         if e.get("resource").get("resourceType") == "Patient"
     ]
 
-    patched_get_services_list.return_value = [
-        # dxtc = diagnostic trigger code
-        # A36.3 = ICD-10-CM code for "Diphtheritic laryngitis"
-        # A36 = ICD-10-CM code for "Diphtheria" (parent code)
-        ("dxtc", "A36.3|A36", "http://hl7.org/fhir/sid/icd-10-cm"),
-        # sdtc = snomed trigger code
-        # 772150003 = SNOMED CT code for "Diphtheria caused by Corynebacterium diphtheriae (disorder)"
-        ("sdtc", "772150003", "http://snomed.info/sct"),
-    ]
+    patched_get_code_set_index.return_value = {
+        "276197005": {
+            # dxtc = diagnostic trigger code
+            # A36.3 = ICD-10-CM code for "Diphtheritic laryngitis"
+            # A36 = ICD-10-CM code for "Diphtheria" (parent code)
+            "dxtc": {"http://hl7.org/fhir/sid/icd-10-cm": frozenset({"A36.3", "A36"})},
+            # sdtc = snomed trigger code
+            # 772150003 = SNOMED CT code for "Diphtheria caused by Corynebacterium diphtheriae (disorder)"
+            "sdtc": {"http://snomed.info/sct": frozenset({"772150003"})},
+        }
+    }
     input = {
         "bundle": message,
         # 276197005 = SNOMED CT code for "Diphtheria contact (finding)"
@@ -114,19 +127,21 @@ def test_stamp_conditions_no_resources_to_stamp(patched_get_services_list):
     assert not found_matching_extension
 
 
-@patch("app.main.get_concepts_list")
-def test_stamp_condition_extensions(patched_get_services_list):
+@patch("app.main.get_code_set_index")
+def test_stamp_condition_extensions(patched_get_code_set_index):
     message = json.load(open(Path(__file__).parent / "assets" / "sample_ecr.json"))
 
     # mock the services list to match codes in our bundle
-    patched_get_services_list.return_value = [
-        # dxtc = diagnostic trigger code
-        # 94310-0 = LOINC code for "SARS-like Coronavirus N gene [Presence] in Unspecified specimen by NAA with probe detection"
-        ("dxtc", "94310-0", "http://loinc.org"),
-        # sdtc = snomed trigger code
-        # 840539006 = SNOMED CT code for "Disease caused by severe acute respiratory syndrome coronavirus 2 (disorder)"
-        ("sdtc", "840539006", "http://snomed.info/sct"),
-    ]
+    patched_get_code_set_index.return_value = {
+        "840539006": {
+            # dxtc = diagnostic trigger code
+            # 94310-0 = LOINC code for "SARS-like Coronavirus N gene [Presence] in Unspecified specimen by NAA with probe detection"
+            "dxtc": {"http://loinc.org": frozenset({"94310-0"})},
+            # sdtc = snomed trigger code
+            # 840539006 = SNOMED CT code for "Disease caused by severe acute respiratory syndrome coronavirus 2 (disorder)"
+            "sdtc": {"http://snomed.info/sct": frozenset({"840539006"})},
+        }
+    }
 
     # The covid-19 SNOMED code
     input = {
@@ -144,15 +159,17 @@ def test_stamp_condition_extensions(patched_get_services_list):
     assert found_matching_extension
 
 
-@patch("app.main.get_concepts_list")
-def test_stamp_condition_extensions_with_no_conditions(patched_get_services_list):
+@patch("app.main.get_code_set_index")
+def test_stamp_condition_extensions_with_no_conditions(patched_get_code_set_index):
     """Test that when no conditions are provided, no stamping occurs"""
     message = json.load(open(Path(__file__).parent / "assets" / "sample_ecr.json"))
 
-    patched_get_services_list.return_value = [
-        ("dxtc", "94310-0", "http://loinc.org"),
-        ("sdtc", "840539006", "http://snomed.info/sct"),
-    ]
+    patched_get_code_set_index.return_value = {
+        "840539006": {
+            "dxtc": {"http://loinc.org": frozenset({"94310-0"})},
+            "sdtc": {"http://snomed.info/sct": frozenset({"840539006"})},
+        }
+    }
 
     input = {"bundle": message}
 
@@ -167,3 +184,24 @@ def test_stamp_condition_extensions_with_no_conditions(patched_get_services_list
         "Observation",  # Different SNOMED code
     )
     assert not found_matching_extension
+
+
+def test_ersd_database_unavailable(tmp_path, monkeypatch):
+    """Test that the service starts, and answers with a 503, without the database"""
+    message = json.load(open(Path(__file__).parent / "assets" / "sample_ecr.json"))
+
+    # there is no eRSD database relative to the working directory
+    clear_code_set_index()
+    monkeypatch.chdir(tmp_path)
+    with TestClient(app) as unloaded_client:
+        assert unloaded_client.get("/").status_code == 200
+
+        response = unloaded_client.get(
+            "/get-value-sets", params={"condition_code": "840539006"}
+        )
+        assert response.status_code == 503
+
+        response = unloaded_client.post(
+            "/stamp-condition-extensions", json={"bundle": message}
+        )
+        assert response.status_code == 503
@@ -0,0 +1,166 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from contextlib import closing
+from pathlib import Path
+
+import pytest
+from app.ersd import (
+    ICD9_SYSTEM,
+    clear_code_set_index,
+    export_value_sets,
+    get_code_set_index,
+    get_value_sets,
+    load_code_set_index,
+)
+
+SCHEMA = """
+CREATE TABLE valuesets (id TEXT PRIMARY KEY, oid TEXT, version TEXT, name TEXT,
+    author TEXT, type TEXT);
+CREATE TABLE conditions (id TEXT PRIMARY KEY, system TEXT, name TEXT,
+    version TEXT);
+CREATE TABLE concepts (id TEXT PRIMARY KEY, code TEXT, code_system TEXT,
+    display TEXT, gem_formatted_code TEXT, version TEXT);
+CREATE TABLE condition_to_valueset (id TEXT PRIMARY KEY, condition_id TEXT,
+    valueset_id TEXT, source TEXT);
+CREATE TABLE valueset_to_concept (id TEXT PRIMARY KEY, valueset_id TEXT,
+    concept_id TEXT);
+CREATE TABLE icd_crosswalk (id TEXT PRIMARY KEY, icd10_code TEXT, icd9_code TEXT,
+    match_flags TEXT);
+"""
+
+
+@pytest.fixture
+def ersd_db(tmp_path):
+    db_path = tmp_path / "ersd.db"
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.executescript(SCHEMA)
+        conn.executemany(
+            "INSERT INTO conditions (id) VALUES (?)",
+            [("240589008",), ("840539006",)],
+        )
+        conn.executemany(
+            "INSERT INTO valuesets (id, type) VALUES (?, ?)",
+            [("vs-dxtc", "dxtc"), ("vs-lrtc", "lrtc"), ("vs-covid", "lrtc")],
+        )
+        conn.executemany(
+            "INSERT INTO condition_to_valueset (id, condition_id, valueset_id)"
+            " VALUES (?, ?, ?)",
+            [
+                ("1", "240589008", "vs-dxtc"),
+                ("2", "240589008", "vs-lrtc"),
+                ("3", "840539006", "vs-covid"),
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO concepts (id, code, code_system, gem_formatted_code)"
+            " VALUES (?, ?, ?, ?)",
+            [
+                ("c1", "A56.0", "http://hl7.org/fhir/sid/icd-10-cm", "A560"),
+                ("c2", "A56.1", "http://hl7.org/fhir/sid/icd-10-cm", "A561"),
+                ("c3", "53926-2", "http://loinc.org", None),
+                ("c4", "94309-2", "http://loinc.org", None),
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO valueset_to_concept (id, valueset_id, concept_id)"
+            " VALUES (?, ?, ?)",
+            [
+                ("1", "vs-dxtc", "c1"),
+                ("2", "vs-dxtc", "c2"),
+                ("3", "vs-lrtc", "c3"),
+                ("4", "vs-covid", "c4"),
+                ("5", "vs-covid", "c3"),
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO icd_crosswalk (id, icd10_code, icd9_code) VALUES (?, ?, ?)",
+            [("1", "A560", "0990"), ("2", "A560", "0991"), ("3", "A561", "0991")],
+        )
+        conn.commit()
+    return db_path
+
+
+def test_load_code_set_index(ersd_db):
+    index = load_code_set_index(str(ersd_db))
+    assert set(index) == {"240589008", "840539006"}
+    assert index["240589008"]["dxtc"] == {
+        "http://hl7.org/fhir/sid/icd-10-cm": frozenset({"A56.0", "A56.1"}),
+        ICD9_SYSTEM: frozenset({"0990", "0991"}),
+    }
+    assert index["240589008"]["lrtc"] == {"http://loinc.org": frozenset({"53926-2"})}
+    assert index["840539006"]["lrtc"] == {
+        "http://loinc.org": frozenset({"53926-2", "94309-2"})
+    }
+
+    # the index is read-only
+    with pytest.raises(TypeError):
+        index["240589008"]["dxtc"]["http://loinc.org"] = frozenset()
+
+
+def test_load_code_set_index_missing(tmp_path):
+    # the database is opened read-only, so a missing one is not created
+    with pytest.raises(sqlite3.OperationalError):
+        load_code_set_index(str(tmp_path / "ersd.db"))
+    assert not (tmp_path / "ersd.db").exists()
+
+
+def test_get_value_sets(ersd_db):
+    index = load_code_set_index(str(ersd_db))
+    assert get_value_sets(index, "840539006") == {
+        "lrtc": [{"codes": ["53926-2", "94309-2"], "system": "http://loinc.org"}]
+    }
+    assert get_value_sets(index, "186747009") is None
+
+
+def test_get_code_set_index(ersd_db):
+    clear_code_set_index()
+    index = get_code_set_index(str(ersd_db))
+    assert get_code_set_index(str(ersd_db)) is index
+
+    # the index is loaded again once the database is modified
+    with closing(sqlite3.connect(ersd_db)) as conn:
+        conn.execute("INSERT INTO conditions (id) VALUES ('186747009')")
+        conn.execute(
+            "INSERT INTO condition_to_valueset (id, condition_id, valueset_id)"
+            " VALUES ('4', '186747009', 'vs-covid')"
+        )
+        conn.commit()
+    mtime = os.stat(ersd_db).st_mtime_ns
+    os.utime(ersd_db, ns=(mtime + 1_000_000_000, mtime + 1_000_000_000))
+
+    reloaded_index = get_code_set_index(str(ersd_db))
+    assert reloaded_index is not index
+    assert "186747009" in reloaded_index
+    assert "186747009" not in index
+    clear_code_set_index()
+
+
+def test_get_code_set_index_missing(tmp_path, ersd_db, caplog):
+    # a missing database is logged rather than raised
+    clear_code_set_index()
+    assert get_code_set_index(str(tmp_path / "missing.db")) is None
+    assert "Could not load the eRSD database" in caplog.text
+
+    # the index last loaded is kept if the database goes missing
+    index = get_code_set_index(str(ersd_db))
+    os.remove(ersd_db)
+    assert get_code_set_index(str(ersd_db)) is index
+    clear_code_set_index()
+
+
+def test_export_value_sets(ersd_db, tmp_path):
+    index = load_code_set_index(str(ersd_db))
+    value_sets = export_value_sets(index)
+    assert list(value_sets) == ["240589008", "840539006"]
+    assert value_sets["840539006"] == get_value_sets(index, "840539006")
+
+    output_path = tmp_path / "value-sets.json"
+    subprocess.run(
+        [sys.executable, "-m", "app.ersd", output_path, ersd_db],
+        cwd=Path(__file__).parent.parent,
+        check=True,
+    )
+    assert json.loads(output_path.read_text()) == value_sets
@@ -1,29 +1,16 @@
 import json
-import sqlite3
 from pathlib import Path
 from unittest.mock import patch
 
-import pytest
 from app.utils import (
     _find_codes_by_resource_type,
     add_human_readable_reportable_condition_name,
     add_reportable_condition_extension,
     convert_inputs_to_list,
     get_clean_snomed_code,
-    get_concepts_dict,
-    get_concepts_list,
 )
 
 
-@pytest.fixture
-def mock_db():
-    with patch("sqlite3.connect", autospec=True) as mock_connect:
-        mock_conn = mock_connect.return_value
-        mock_conn.__enter__.return_value = mock_conn
-        mock_cursor = mock_conn.cursor.return_value
-        yield mock_cursor
-
-
 # tests to confirm sanitize inputs work
 def test_convert_inputs_to_list_single_value():
     assert convert_inputs_to_list("12345") == ["12345"]
@@ -44,69 +31,6 @@ def test_get_clean_snomed_code_multiple():
     assert "2 SNOMED codes provided" in result["error"]
 
 
-# Test getting clinical code list of tuples with a valid SNOMED ID
-def test_get_concepts_list_normal(mock_db):
-    code = 276197005
-    db_result = [
-        ("dxtc", "A36.3|A36", "http://hl7.org/fhir/sid/icd-10-cm", "0363|0036"),
-        ("sdtc", "772150003", "http://snomed.info/sct", None),
-    ]
-    mock_db.fetchall.return_value = db_result
-    result = get_concepts_list([code])
-    assert result == [
-        ("dxtc", "A36.3|A36", "http://hl7.org/fhir/sid/icd-10-cm"),
-        ("dxtc", "0363|0036", "http://hl7.org/fhir/sid/icd-9-cm"),
-        ("sdtc", "772150003", "http://snomed.info/sct"),
-    ]
-
-
-# Test with bad SNOMED code
-def test_get_concepts_list_no_results(mock_db):
-    code = ["junk_id"]
-    mock_db.fetchall.return_value = []
-    result = get_concepts_list(code)
-    assert result == []
-
-
-# Test SQL error messaging
-def test_get_concepts_list_sql_error(mock_db):
-    snomed_id = 276197005
-    mock_db.execute.side_effect = sqlite3.Error("SQL error")
-    result = get_concepts_list([snomed_id])
-    assert "error" in result
-    assert "SQL error" in result["error"]
-
-
-# Test transforming clinical services list to nested dictionary
-def test_get_concepts_dict_normal():
-    clinical_services_list = [
-        ("dxtc", "A36.3|A36", "http://hl7.org/fhir/sid/icd-10-cm"),
-        ("sdtc", "772150003", "http://snomed.info/sct"),
-    ]
-    expected_result = {
-        "dxtc": [
-            {"codes": ["A36.3", "A36"], "system": "http://hl7.org/fhir/sid/icd-10-cm"}
-        ],
-        "sdtc": [{"codes": ["772150003"], "system": "http://snomed.info/sct"}],
-    }
-    result = get_concepts_dict(clinical_services_list)
-    assert result == expected_result
-
-
-# Test clinical services dict limiting to just sdtc
-def test_get_concepts_dict_filter_services():
-    clinical_services_list = [
-        ("dxtc", "A36.3|A36", "http://hl7.org/fhir/sid/icd-10-cm"),
-        ("sdtc", "772150003", "http://snomed.info/sct"),
-    ]
-    filtered_services = ["sdtc"]
-    expected_result = {
-        "sdtc": [{"codes": ["772150003"], "system": "http://snomed.info/sct"}],
-    }
-    result = get_concepts_dict(clinical_services_list, filtered_services)
-    assert result == expected_result
-
-
 def test_find_codes_by_resource_type():
     message = json.load(open(Path(__file__).parent / "assets" / "sample_ecr.json"))
 
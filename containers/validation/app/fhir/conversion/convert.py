@@ -1,5 +1,9 @@
 from lxml import etree
 
+# any element with the LOINC code of a reportability response, which is only
+# present once an eICR has been merged with its RR
+rr_section_xpath = etree.XPath('//*[@code="88085-6"]')
+
 
 def add_rr_data_to_eicr(rr, ecr):
     """
@@ -26,7 +30,7 @@ def add_rr_data_to_eicr(rr, ecr):
     rr = etree.fromstring(rr)
     ecr = etree.fromstring(ecr)
 
-    if ecr.xpath('//*[@code="88085-6"]'):
+    if rr_section_xpath(ecr):
         print("This eCR has already been merged with RR data.")
         return etree.tostring(ecr, encoding="unicode", method="xml")
 
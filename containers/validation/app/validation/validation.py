@@ -8,6 +8,7 @@ from app.validation.xml_utils import (
     validate_xml_elements,
     validate_xml_value,
 )
+from app.xpath import get_xpath
 
 ERROR_MESSAGES = {
     "fatal": [],
@@ -42,13 +43,10 @@ def validate_ecr(ecr_message: str, config: dict, include_error_types: list) -> d
     xml = ecr_message.encode("utf-8")
     parser = etree.XMLParser(ns_clean=True, recover=True, encoding="utf-8")
 
-    # we need a try-catch around this to ensure that the ecr message
-    # passed in is proper XML - also ensure it's a clinical document
-    try:
-        parsed_ecr = etree.fromstring(xml, parser=parser)
-        parsed_ecr.xpath("//hl7:ClinicalDocument", namespaces=ECR_NAMESPACES)
-
-    except AttributeError:
+    # the recovering parser returns nothing rather than raising an error
+    # when the ecr message passed in is not proper XML
+    parsed_ecr = etree.fromstring(xml, parser=parser)
+    if parsed_ecr is None:
         _append_error_message(
             error_message_type="fatal", message="eCR Message is not valid XML!"
         )
@@ -61,9 +59,11 @@ def validate_ecr(ecr_message: str, config: dict, include_error_types: list) -> d
         # for the different fields
         cda_path = field.get("cdaPath")
 
-        # get a list of XML elements that match the field configuration
+        # get a list of XML elements that match the field configuration; the
+        # compiled form of each path is kept so that it is not recompiled for
+        # every message
         matched_xml_elements = validate_xml_elements(
-            xml_elements=parsed_ecr.xpath(cda_path, namespaces=ECR_NAMESPACES),
+            xml_elements=get_xpath(cda_path, ECR_NAMESPACES)(parsed_ecr),
             config_field=field,
         )
         error_message_type = (
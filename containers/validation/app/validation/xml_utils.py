@@ -15,6 +15,9 @@ ECR_NAMESPACES = {
     "voc": "http://www.lantanagroup.com/voc",
 }
 
+eicr_msg_id_xpath = etree.XPath(EICR_MSG_ID_XPATH, namespaces=ECR_NAMESPACES)
+rr_msg_id_xpath = etree.XPath(RR_MSG_ID_XPATH, namespaces=ECR_NAMESPACES)
+
 
 def _get_xml_message_id(id_xml_tag: etree.Element) -> dict:
     # extracts the message id from the root and extension
@@ -33,12 +36,8 @@ def get_ecr_message_ids(parsed_ecr) -> dict:
     """
     Get the message ids for the eICR and the RR
     """
-    xml_eicr_id = _get_xml_message_id(
-        parsed_ecr.xpath(EICR_MSG_ID_XPATH, namespaces=ECR_NAMESPACES)
-    )
-    xml_rr_id = _get_xml_message_id(
-        parsed_ecr.xpath(RR_MSG_ID_XPATH, namespaces=ECR_NAMESPACES)
-    )
+    xml_eicr_id = _get_xml_message_id(eicr_msg_id_xpath(parsed_ecr))
+    xml_rr_id = _get_xml_message_id(rr_msg_id_xpath(parsed_ecr))
 
     return {"eicr": xml_eicr_id, "rr": xml_rr_id}
 
@@ -0,0 +1,30 @@
+from functools import lru_cache
+from typing import Optional
+
+from lxml import etree
+
+# How many compiled `cdaPath`s of validation configs are kept; the default config
+# has a few dozen, so this leaves room for custom configs as well
+XPATH_CACHE_SIZE = 512
+
+
+def get_xpath(expression: str, namespaces: Optional[dict] = None) -> etree.XPath:
+    """
+    Gets the compiled form of an XPath expression that is only known at runtime,
+    such as the `cdaPath` of a field in a validation config. Expressions are
+    compiled on first use and kept in a least recently used cache of
+    `XPATH_CACHE_SIZE` expressions, rather than being recompiled by every call
+    to `.xpath()`.
+
+    :param expression: The XPath expression.
+    :param namespaces: Optionally, the prefixes used in the expression and the
+      namespaces they stand for.
+    :return: The compiled expression, which is called with the element to
+      evaluate it against.
+    """
+    return _compile_xpath(expression, tuple(sorted((namespaces or {}).items())))
+
+
+@lru_cache(maxsize=XPATH_CACHE_SIZE)
+def _compile_xpath(expression: str, namespaces_key: tuple) -> etree.XPath:
+    return etree.XPath(expression, namespaces=dict(namespaces_key))
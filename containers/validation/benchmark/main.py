@@ -0,0 +1,130 @@
+"""
+Measures what compiling XPath expressions once saves over passing them to
+`.xpath()`, which compiles them again on every call. Each path in the default
+validation config, and each expression the validation service compiles at
+module load, is evaluated against a sample eCR both ways, and the time per
+evaluation is reported along with the time to validate the whole eCR.
+
+Run from the `containers/validation` directory:
+
+    python -m benchmark.main --repeat 200
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+from app.utils import load_ecr_config
+from app.validation.validation import validate_ecr
+from app.validation.xml_utils import (
+    ECR_NAMESPACES,
+    EICR_MSG_ID_XPATH,
+    RR_MSG_ID_XPATH,
+)
+from app.xpath import get_xpath
+from lxml import etree
+
+VALIDATION_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_ECR_PATH = VALIDATION_DIR / "tests" / "assets" / "ecr_sample_input_good.xml"
+
+
+def time_per_call(function: callable, repeat: int) -> float:
+    """
+    Times a function, after calling it once to warm up.
+
+    :param function: The function to time, which takes no arguments.
+    :param repeat: How many times to call the function.
+    :return: The mean time per call, in microseconds.
+    """
+    function()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def benchmark_expressions(parsed_ecr: etree.Element, repeat: int) -> list[dict]:
+    """
+    Evaluates the XPath expressions used by the validation service against an
+    eCR, both compiled on every call and compiled once.
+
+    :param parsed_ecr: The root element of the eCR.
+    :param repeat: How many times to evaluate each expression each way.
+    :return: The time per evaluation of each expression each way.
+    """
+    expressions = [EICR_MSG_ID_XPATH, RR_MSG_ID_XPATH] + [
+        field["cdaPath"] for field in load_ecr_config()["fields"]
+    ]
+    results = []
+    for expression in dict.fromkeys(expressions):
+        compiled = get_xpath(expression, ECR_NAMESPACES)
+        results.append(
+            {
+                "expression": expression,
+                "xpath_us": time_per_call(
+                    lambda: parsed_ecr.xpath(expression, namespaces=ECR_NAMESPACES),
+                    repeat,
+                ),
+                "compiled_us": time_per_call(lambda: compiled(parsed_ecr), repeat),
+            }
+        )
+    return results
+
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parses the benchmark's command line arguments.
+
+    :return: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument(
+        "--ecr",
+        type=Path,
+        default=DEFAULT_ECR_PATH,
+        help="The eCR to evaluate the expressions against.",
+    )
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    return parser.parse_args()
+
+
+def main():
+    """
+    Runs the benchmark and prints the time per evaluation of each expression
+    both ways, and the time to validate the whole eCR.
+    """
+    args = parse_args()
+    message = args.ecr.read_text()
+    parsed_ecr = etree.fromstring(message.encode("utf-8"))
+
+    results = benchmark_expressions(parsed_ecr, args.repeat)
+    width = max(len(result["expression"]) for result in results)
+    print(f"{'expression':<{width}}  {'.xpath() us':>12}  {'compiled us':>12}")
+    for result in results:
+        print(
+            f"{result['expression']:<{width}}  {result['xpath_us']:>12.1f}"
+            f"  {result['compiled_us']:>12.1f}"
+        )
+    xpath_total = sum(result["xpath_us"] for result in results)
+    compiled_total = sum(result["compiled_us"] for result in results)
+    print(
+        f"{'total':<{width}}  {xpath_total:>12.1f}  {compiled_total:>12.1f}"
+        f"  ({xpath_total / compiled_total:.1f}x)"
+    )
+
+    config = load_ecr_config()
+    validate_us = time_per_call(
+        lambda: validate_ecr(message, config, ["fatal", "errors", "warnings"]),
+        args.repeat,
+    )
+    print(f"validate_ecr: {validate_us:.1f} us per eCR")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"expressions": results, "validate_ecr_us": validate_us}, file)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,15 @@
+import json
 from pathlib import Path
 
 import toml
-from app.base_service import DIBBS_CONTACT, LICENSES, BaseService
+from app.base_service import (
+    DIBBS_CONTACT,
+    LICENSES,
+    SUPPORTED_CONTENT_ENCODINGS,
+    BaseService,
+    CompressionMiddleware,
+    compress_content,
+)
 from fastapi.testclient import TestClient
 
 with open(
@@ -60,3 +68,106 @@ def test_base_service_alternate_license():
 
     response = client.get("/redoc")
     assert response.status_code == 200
+
+
+def test_base_service_compression():
+    service = BaseService(
+        service_name="Test Service",
+        service_path="/test-service",
+        description_path=Path(__file__).parent / "assets" / "test_description.md",
+    )
+
+    @service.app.post("/echo")
+    async def echo(body: dict) -> dict:
+        return body
+
+    client = TestClient(service.start())
+    payload = {"data": "x" * 4096}
+
+    # Compressed request bodies are decompressed before reaching the endpoint
+    response = client.post(
+        "/echo",
+        content=compress_content(json.dumps(payload).encode(), "gzip"),
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 200
+    assert response.json() == payload
+    assert response.headers["content-encoding"] in SUPPORTED_CONTENT_ENCODINGS
+    assert response.headers["accept-encoding"] == ", ".join(SUPPORTED_CONTENT_ENCODINGS)
+
+    # Small responses are left uncompressed
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+
+    # Unknown request encodings are rejected
+    response = client.post(
+        "/echo",
+        content=b"{}",
+        headers={"Content-Type": "application/json", "Content-Encoding": "br"},
+    )
+    assert response.status_code == 415
+
+
+def test_base_service_decompressed_size_limit():
+    service = BaseService(
+        service_name="Test Service",
+        service_path="/test-service",
+        description_path=Path(__file__).parent / "assets" / "test_description.md",
+    )
+
+    @service.app.post("/echo")
+    async def echo(body: dict) -> dict:
+        return body
+
+    app = service.start()
+    app.add_middleware(CompressionMiddleware, maximum_decompressed_size=1024)
+    client = TestClient(app)
+
+    # Bodies that decompress to more than the limit are rejected
+    for encoding in SUPPORTED_CONTENT_ENCODINGS:
+        response = client.post(
+            "/echo",
+            content=compress_content(b"{}" + b" " * 4096, encoding),
+            headers={"Content-Type": "application/json", "Content-Encoding": encoding},
+        )
+        assert response.status_code == 413
+
+    response = client.post(
+        "/echo",
+        content=compress_content(b"{}", "gzip"),
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 200
+
+
+def test_base_service_malformed_compressed_body():
+    service = BaseService(
+        service_name="Test Service",
+        service_path="/test-service",
+        description_path=Path(__file__).parent / "assets" / "test_description.md",
+    )
+
+    @service.app.post("/echo")
+    async def echo(body: dict) -> dict:
+        return body
+
+    client = TestClient(service.start())
+
+    # Bodies that are not valid in their encoding are rejected
+    for encoding in SUPPORTED_CONTENT_ENCODINGS:
+        response = client.post(
+            "/echo",
+            content=b"garbage",
+            headers={"Content-Type": "application/json", "Content-Encoding": encoding},
+        )
+        assert response.status_code == 400
+        assert response.text == f"Malformed {encoding} request body"
+
+    # including bodies cut short
+    response = client.post(
+        "/echo",
+        content=compress_content(b"{}" + b" " * 4096, "gzip")[:-8],
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 400
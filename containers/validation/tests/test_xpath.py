@@ -0,0 +1,20 @@
+from app.xpath import _compile_xpath, get_xpath
+from lxml import etree
+
+NAMESPACES = {"hl7": "urn:hl7-org:v3"}
+
+document = etree.fromstring(
+    '<ClinicalDocument xmlns="urn:hl7-org:v3"><id root="1"/></ClinicalDocument>'
+)
+
+
+def test_get_xpath():
+    _compile_xpath.cache_clear()
+    compiled = get_xpath("//hl7:id", NAMESPACES)
+    assert get_xpath("//hl7:id", {"hl7": "urn:hl7-org:v3"}) is compiled
+    assert _compile_xpath.cache_info().hits == 1
+    assert compiled(document)[0].get("root") == "1"
+
+    # the same expression bound to other namespaces is compiled separately
+    assert get_xpath("//hl7:id", {"hl7": "urn:hl7-org:sdtc"}) is not compiled
+    assert get_xpath("//hl7:id", {"hl7": "urn:hl7-org:sdtc"})(document) == []